@@ -0,0 +1,27 @@
+import logging
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from dependencies.queue import ReplicationQueueDep
+from helpers import metrics
+
+router = APIRouter()
+
+
+@router.get('/metrics',
+            summary="Metrics of the instance in Prometheus text format",
+            response_class=PlainTextResponse,
+            include_in_schema=False,
+            )
+async def get_metrics(queue: ReplicationQueueDep) -> PlainTextResponse:
+    try:
+        metrics.QUEUE_DEPTH.set(await queue.depth())
+    except Exception as e:
+        logging.warning(f"Can't get replication queue depth: {e!r}")
+    if metrics.metrics_files:
+        text = await metrics.metrics_files.render()
+    else:
+        text = metrics.render()
+    return PlainTextResponse(text,
+                             media_type='text/plain; version=0.0.4')
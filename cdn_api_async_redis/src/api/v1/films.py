@@ -1,21 +1,42 @@
 import logging
 
 from fastapi import APIRouter, Request, UploadFile, HTTPException, status
-from fastapi.responses import RedirectResponse
+from fastapi.responses import ORJSONResponse, RedirectResponse
 
-from core.config import settings
-from helpers.helper_async import (get_active_nodes, find_closest_node,
-                                  origin_is_alive, get_mpu_id)
-from models.model import Status
+from core.config import replication_settings
+from helpers.availability import requested_range
+from helpers.client import client_ip
+from helpers.helper_async import find_closest_node, origin_is_alive
+from helpers.metrics import OBJECT_URL_STAGE
+from helpers.stream import BodyReader
+from models.model import Status, UploadSession, UploadSessionIn
+from dependencies.jobs import UploadJobsDep
+from dependencies.nodes import NodesDep
+from dependencies.queue import ReplicationQueueDep
 from dependencies.redis import CacheDep
-from dependencies.scheduler import SchedulerDep
+from dependencies.s3 import S3PoolDep
+from services.capacity import touch_replica
+from services.prefetch import count_demand
 from services.films import get_client_data, get_multipart_upload_client_data, \
     process_deleting_object
+from services.redirects import redirect_cache
+from services.sessions import abort_session, complete_session, \
+    create_session, get_session_urls
 from services.service import multipart_upload
 
 router = APIRouter()
 
 
+def accepted(request: Request,
+             object_name: str,
+             job_id: str) -> ORJSONResponse:
+    return ORJSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content={"job_id": job_id,
+                 "status": str(request.url_for('object_status',
+                                               object_name=object_name))})
+
+
 @router.get('/{object_name}',
             summary="Get URL to preview object (movie, music, photo)",
             response_description="Redirects to url to preview object",
@@ -24,27 +45,56 @@ async def object_url(
         request: Request,
         object_name: str,
         cache: CacheDep,
-        scheduler: SchedulerDep
+        queue: ReplicationQueueDep,
+        nodes: NodesDep,
+        pool: S3PoolDep,
+        partial: bool = False
 ) -> RedirectResponse:
-    client_host = request.client.host
+    client_host = client_ip(request)
     # Stub to test CDN on localhost
     # client_host = "137.0.0.1"
-    active_nodes = await get_active_nodes()
+    with OBJECT_URL_STAGE.time('node_lookup'):
+        snapshot = nodes.snapshot
+        active_nodes = snapshot.nodes
     closest_node = await find_closest_node(client_host,
-                                           active_nodes)
+                                           snapshot)
     if not closest_node and await origin_is_alive(active_nodes):
         closest_node = active_nodes['ORIGIN']
         logging.info(f"Use Origin S3 '{closest_node.alias}'")
+    count_demand(closest_node, object_name)
 
-    client, endpoint = await get_client_data(active_nodes,
-                                             cache,
-                                             closest_node,
-                                             object_name,
-                                             scheduler)
+    range_ = None
+    # Head reports its own size in Content-Range, only clients that know the
+    # object size ask for ranges that may be served by it
+    if partial and replication_settings.head_bytes:
+        range_ = requested_range(request.headers.get('range'))
+    with OBJECT_URL_STAGE.time('redirect_cache'):
+        decision = await redirect_cache.get(cache, object_name, closest_node)
+    # Range may be served by the head copied to the closest edge already
+    if decision and not (range_ and decision[0] != closest_node.endpoint):
+        endpoint, url = decision
+        logging.info(f"URL found in redirect cache for endpoint '{endpoint}'")
+        if endpoint == closest_node.endpoint:
+            touch_replica(closest_node, object_name)
+        return RedirectResponse(url=url)
 
-    url = await client.get_url(bucket_name=settings.bucket_name,
-                               object_name=object_name)
+    client, serving_node, key = await get_client_data(active_nodes,
+                                                      cache,
+                                                      closest_node,
+                                                      object_name,
+                                                      queue,
+                                                      pool,
+                                                      range_)
+
+    with OBJECT_URL_STAGE.time('presign'):
+        url = await client.get_url(bucket_name=serving_node.bucket,
+                                   object_name=key)
+    endpoint = serving_node.endpoint
     logging.info(f"URL created using endpoint '{endpoint}'")
+    # Head serves only ranges inside it, it isn't a decision for the object
+    if url and key == object_name:
+        await redirect_cache.put(cache, object_name, closest_node, endpoint,
+                                 url)
     return RedirectResponse(url=url)
 
 
@@ -54,9 +104,10 @@ async def object_url(
             )
 async def object_status(
         object_name: str,
-        cache: CacheDep
+        cache: CacheDep,
+        nodes: NodesDep
 ) -> str | HTTPException:
-    active_nodes = await get_active_nodes()
+    active_nodes = nodes.snapshot.nodes
     origin_node = await origin_is_alive(active_nodes)
     endpoint = 'http://' + origin_node.endpoint
     key: str = f"api^{object_name}^{endpoint}"
@@ -64,9 +115,15 @@ async def object_status(
     object_api = await cache.get_from_cache_by_key(key)
 
     if object_api:
-        return (f"'{object_name}' has status "
-                f"'{str(object_api[b'status'], 'utf-8')}' "
-                f"on node '{endpoint}'")
+        message = (f"'{object_name}' has status "
+                   f"'{str(object_api[b'status'], 'utf-8')}' "
+                   f"on node '{endpoint}'")
+        if b'job_id' in object_api:
+            message += f", job '{str(object_api[b'job_id'], 'utf-8')}'"
+        if b'uploaded' in object_api and b'size' in object_api:
+            message += (f", {int(object_api[b'uploaded'])} of "
+                        f"{int(object_api[b'size'])} bytes uploaded")
+        return message
     else:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -80,20 +137,35 @@ async def object_status(
              summary="Upload object to storage",
              )
 async def upload_object(
+        request: Request,
         file_upload: UploadFile,
-        cache: CacheDep
-) -> str | HTTPException:
-    active_nodes = await get_active_nodes()
+        cache: CacheDep,
+        nodes: NodesDep,
+        pool: S3PoolDep,
+        jobs: UploadJobsDep,
+        background: bool = False
+) -> str | ORJSONResponse | HTTPException:
+    active_nodes = nodes.snapshot.nodes
     origin_node = await origin_is_alive(active_nodes)
     filename = file_upload.filename
+    if not filename:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="File name is required",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
 
-    endpoint, origin_client = await get_multipart_upload_client_data(
+    origin_client, mpu_id = await get_multipart_upload_client_data(
         cache,
-        file_upload,
         filename,
-        origin_node)
+        file_upload.content_type,
+        file_upload.size,
+        origin_node,
+        pool)
 
-    mpu_id = await get_mpu_id(endpoint, filename, cache)
+    if background:
+        job_id = await jobs.submit(cache, origin_client, mpu_id, file_upload)
+        return accepted(request, filename, job_id)
 
     if await multipart_upload(cache,
                               origin_client,
@@ -109,17 +181,135 @@ async def upload_object(
         )
 
 
+@router.put('/object/{object_name}',
+            response_model=None,
+            summary="Upload object to storage streaming the request body",
+            )
+async def stream_object(
+        request: Request,
+        object_name: str,
+        cache: CacheDep,
+        nodes: NodesDep,
+        pool: S3PoolDep,
+        jobs: UploadJobsDep,
+        background: bool = False
+) -> str | ORJSONResponse | HTTPException:
+    # Body isn't saved to disk, parts are sent to S3 while it's received
+    active_nodes = nodes.snapshot.nodes
+    origin_node = await origin_is_alive(active_nodes)
+    content_length = request.headers.get('content-length')
+    if background and not content_length:
+        # Size is needed for admission control
+        raise HTTPException(
+            status_code=status.HTTP_411_LENGTH_REQUIRED,
+            detail="Content-Length is required for background upload",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    origin_client, mpu_id = await get_multipart_upload_client_data(
+        cache,
+        object_name,
+        request.headers.get('content-type'),
+        int(content_length) if content_length else 0,
+        origin_node,
+        pool)
+
+    if background:
+        job_id = await jobs.submit(cache, origin_client, mpu_id,
+                                   BodyReader(request.stream()))
+        return accepted(request, object_name, job_id)
+
+    if await multipart_upload(cache,
+                              origin_client,
+                              status=Status.IN_PROGRESS.value,
+                              object_=BodyReader(request.stream()),
+                              mpu_id=mpu_id):
+        return f"Upload {object_name} completed successfully."
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Upload failed. Please retry",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
 @router.delete('/object',
                response_model=None,
                summary="Delete object from all nodes",
                )
 async def delete_object(
         object_name: str,
-        cache: CacheDep
+        cache: CacheDep,
+        nodes: NodesDep,
+        pool: S3PoolDep
 ) -> str | HTTPException:
-    active_nodes = await get_active_nodes()
+    active_nodes = nodes.snapshot.nodes
 
     endpoints = await process_deleting_object(active_nodes,
                                               cache,
-                                              object_name)
+                                              object_name,
+                                              pool)
     return f"{object_name} was removed from nodes {endpoints}"
+
+
+@router.post('/sessions',
+             response_model=UploadSession,
+             summary="Start upload session to upload parts straight to S3",
+             )
+async def start_upload_session(
+        data: UploadSessionIn,
+        cache: CacheDep,
+        nodes: NodesDep,
+        pool: S3PoolDep
+) -> UploadSession:
+    # Client PUTs parts to the presigned URLs in parallel, bytes don't go
+    # through the API
+    origin_node = await origin_is_alive(nodes.snapshot.nodes)
+    return await create_session(cache, data, origin_node, pool)
+
+
+@router.get('/sessions/{object_name}/parts',
+            response_model=UploadSession,
+            summary="Get presigned URLs for the parts of upload session",
+            )
+async def upload_session_parts(
+        object_name: str,
+        cache: CacheDep,
+        nodes: NodesDep,
+        pool: S3PoolDep,
+        first: int = 1,
+        count: int = 100
+) -> UploadSession:
+    origin_node = await origin_is_alive(nodes.snapshot.nodes)
+    return await get_session_urls(cache, object_name, origin_node, pool,
+                                  first, count)
+
+
+@router.post('/sessions/{object_name}/complete',
+             response_model=None,
+             summary="Complete upload session",
+             )
+async def complete_upload_session(
+        object_name: str,
+        cache: CacheDep,
+        nodes: NodesDep,
+        pool: S3PoolDep
+) -> str | HTTPException:
+    origin_node = await origin_is_alive(nodes.snapshot.nodes)
+    await complete_session(cache, object_name, origin_node, pool)
+    return f"Upload {object_name} completed successfully."
+
+
+@router.delete('/sessions/{object_name}',
+               response_model=None,
+               summary="Abort upload session",
+               )
+async def abort_upload_session(
+        object_name: str,
+        cache: CacheDep,
+        nodes: NodesDep,
+        pool: S3PoolDep
+) -> str | HTTPException:
+    origin_node = await origin_is_alive(nodes.snapshot.nodes)
+    await abort_session(cache, object_name, origin_node, pool)
+    return f"Upload session for {object_name} aborted."
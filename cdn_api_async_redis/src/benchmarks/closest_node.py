@@ -0,0 +1,93 @@
+"""
+Compare the closest node search with geodesic distance over every node
+(the old implementation) and with NearestNodeIndex.
+
+Run from `cdn_api_async_redis/src`:
+    python -m benchmarks.closest_node
+"""
+import random
+from math import asin, degrees
+from time import perf_counter
+
+from geopy.distance import distance
+
+from helpers.geo import NearestNodeIndex, haversine
+from models.model import Node
+
+NODE_COUNTS = (3, 50, 500)
+LOOKUPS = 500
+
+
+def random_point(rnd: random.Random) -> tuple[float, float]:
+    # Uniform distribution on the sphere
+    return degrees(asin(rnd.uniform(-1, 1))), rnd.uniform(-180, 180)
+
+
+def make_nodes(count: int, rnd: random.Random) -> dict[str, Node]:
+    nodes = {}
+    for i in range(count):
+        latitude, longitude = random_point(rnd)
+        nodes[f"NODE{i}"] = Node(endpoint=f"node{i}:9000",
+                                 alias=f"n{i}",
+                                 access_key_id='',
+                                 secret_access_key='',
+                                 city='',
+                                 latitude=latitude,
+                                 longitude=longitude,
+                                 is_active='True')
+    return nodes
+
+
+def geodesic_loop(coordinates, nodes: dict[str, Node]) -> Node:
+    closest_node = list(nodes.values())[0]
+    min_distance = distance(coordinates,
+                            (closest_node.latitude, closest_node.longitude))
+    for node in list(nodes.values())[1:]:
+        distance_ = distance(coordinates, (node.latitude, node.longitude))
+        if distance_ < min_distance:
+            min_distance = distance_
+            closest_node = node
+    return closest_node
+
+
+def haversine_loop(coordinates, nodes: dict[str, Node]) -> Node:
+    return min(nodes.values(),
+               key=lambda n: haversine(coordinates[0], coordinates[1],
+                                       n.latitude, n.longitude))
+
+
+def timed(func, points) -> tuple[float, list]:
+    start = perf_counter()
+    result = [func(p) for p in points]
+    return (perf_counter() - start) / len(points) * 1e6, result
+
+
+def share_same(expected: list, got: list) -> float:
+    return sum(a is b for a, b in zip(expected, got)) / len(got)
+
+
+def main():
+    rnd = random.Random(42)
+    # "exact" - index gives the same node as the full haversine scan,
+    # "geodesic" - the same node as the old geodesic loop (ellipsoid and
+    # sphere disagree only for points almost equidistant from two nodes)
+    print(f"{'nodes':>6} {'geodesic, us':>14} {'index cold, us':>15} "
+          f"{'index warm, us':>15} {'speedup':>9} {'exact':>8} "
+          f"{'geodesic':>9}")
+    for count in NODE_COUNTS:
+        nodes = make_nodes(count, rnd)
+        points = [random_point(rnd) for _ in range(LOOKUPS)]
+        index = NearestNodeIndex(nodes)
+
+        loop_us, expected = timed(lambda p: geodesic_loop(p, nodes), points)
+        cold_us, _ = timed(index.closest, points)
+        warm_us, got = timed(index.closest, points)
+        exact = [haversine_loop(p, nodes) for p in points]
+        print(f"{count:>6} {loop_us:>14.1f} {cold_us:>15.1f} "
+              f"{warm_us:>15.1f} {loop_us / warm_us:>8.0f}x "
+              f"{share_same(exact, got):>8.2%} "
+              f"{share_same(expected, got):>9.2%}")
+
+
+if __name__ == '__main__':
+    main()
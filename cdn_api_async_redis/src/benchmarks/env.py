@@ -0,0 +1,20 @@
+"""
+Settings of the service for benchmarks. Import before any module of the
+service, values from the environment and `.env` win.
+"""
+import os
+
+for name, value in {'PROJECT_NAME': 'cdn-benchmark',
+                    'HOST_CDN': '127.0.0.1',
+                    'PORT_CDN': '8000',
+                    'BUCKET_NAME': 'video',
+                    'UPLOAD_PART_SIZE': str(8 * 1024 ** 2),
+                    'IPAPI_KEY': '',
+                    'REDIS_HOST': '127.0.0.1',
+                    'REDIS_PORT': '6379',
+                    'CACHE_EXPIRE_IN_SECONDS': '3600',
+                    # Fake S3 doesn't check signatures, any region works
+                    'S3_REGION': 'us-east-1',
+                    'GEOIP_USE_IPAPI': 'False',
+                    'REPLICATION_QUEUE': 'local'}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,244 @@
+"""
+In-process cache stand-in for benchmarks. Implements AbstractCache with
+Redis semantics the service relies on (bytes values, hashes, sorted sets,
+expiring keys, pipelines) and waits `latency` seconds per round trip.
+"""
+import asyncio
+import fnmatch
+from time import monotonic, time
+
+from connectors.abstract import AbstractCache
+from helpers.metrics import count_round_trip
+
+
+def encode(value) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode()
+
+
+class FakePipeline:
+    def __init__(self, cache: 'FakeCache'):
+        self.cache = cache
+        self.commands: list[tuple[str, tuple, dict]] = []
+
+    def __getattr__(self, name: str):
+        def command(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return command
+
+    async def execute(self) -> list:
+        await self.cache.round_trip()
+        commands, self.commands = self.commands, []
+        return [getattr(self.cache, f"_{name}")(*args, **kwargs)
+                for name, args, kwargs in commands]
+
+
+class FakeCache(AbstractCache):
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.round_trips = 0
+        # Key has a value of one type, like in Redis
+        self.strings: dict[str, bytes] = {}
+        self.hashes: dict[str, dict[bytes, bytes]] = {}
+        self.zsets: dict[str, dict[bytes, float]] = {}
+        # key -> monotonic time of expiration
+        self.expires: dict[str, float] = {}
+
+    async def round_trip(self) -> None:
+        self.round_trips += 1
+        count_round_trip()
+        await asyncio.sleep(self.latency)
+
+    @property
+    def _stores(self) -> tuple[dict, ...]:
+        return self.strings, self.hashes, self.zsets
+
+    def _alive(self, key: str) -> bool:
+        expires = self.expires.get(key)
+        if expires is not None and expires <= monotonic():
+            for store in self._stores:
+                store.pop(key, None)
+            del self.expires[key]
+        return any(key in store for store in self._stores)
+
+    # Redis commands used in pipelines
+
+    def _get(self, key: str) -> bytes | None:
+        return self.strings.get(key) if self._alive(key) else None
+
+    def _set(self, key: str, value, ex: float | None = None,
+             px: float | None = None, nx: bool = False) -> bool:
+        if nx and self._alive(key):
+            return False
+        self._delete(key)
+        self.strings[key] = encode(value)
+        ttl = ex or (px / 1000 if px else None)
+        if ttl:
+            self.expires[key] = monotonic() + ttl
+        return True
+
+    def _delete(self, *keys: str) -> int:
+        deleted = 0
+        for key in keys:
+            deleted += self._alive(key)
+            for store in self._stores:
+                store.pop(key, None)
+            self.expires.pop(key, None)
+        return deleted
+
+    def _expire(self, key: str, seconds: float) -> bool:
+        if not self._alive(key):
+            return False
+        self.expires[key] = monotonic() + seconds
+        return True
+
+    def _incr(self, key: str, amount: int = 1) -> int:
+        value = int(self._get(key) or 0) + amount
+        self.strings[key] = encode(value)
+        return value
+
+    def _hset(self, name: str, mapping: dict) -> int:
+        self._alive(name)
+        self.hashes.setdefault(name, {}).update(
+            {encode(k): encode(v) for k, v in mapping.items()})
+        return len(mapping)
+
+    def _hgetall(self, name: str) -> dict[bytes, bytes]:
+        return dict(self.hashes.get(name, {})) if self._alive(name) else {}
+
+    def _zadd(self, name: str, mapping: dict) -> int:
+        self._alive(name)
+        zset = self.zsets.setdefault(name, {})
+        zset.update({encode(k): float(v) for k, v in mapping.items()})
+        return len(mapping)
+
+    def _zrem(self, name: str, *members) -> int:
+        zset = self.zsets.get(name, {})
+        return sum(zset.pop(encode(m), None) is not None for m in members)
+
+    def _zincrby(self, name: str, amount: float, member) -> float:
+        self._alive(name)
+        zset = self.zsets.setdefault(name, {})
+        zset[encode(member)] = zset.get(encode(member), 0) + amount
+        return zset[encode(member)]
+
+    def _zrange(self, name: str, start: int, end: int,
+                withscores: bool = False) -> list:
+        items = sorted(self.zsets.get(name, {}).items(),
+                       key=lambda item: item[1])
+        items = items[start:None if end == -1 else end + 1]
+        return items if withscores else [member for member, _ in items]
+
+    def _zunionstore(self, dest: str, keys: dict) -> int:
+        zset: dict[bytes, float] = {}
+        for key, weight in keys.items():
+            for member, score in self.zsets.get(key, {}).items():
+                zset[member] = zset.get(member, 0) + score * weight
+        self.zsets[dest] = zset
+        return len(zset)
+
+    def _hincrby(self, name: str, key, amount: int = 1) -> int:
+        self._alive(name)
+        hash_ = self.hashes.setdefault(name, {})
+        value = int(hash_.get(encode(key), 0)) + amount
+        hash_[encode(key)] = encode(value)
+        return value
+
+    def _zremrangebyrank(self, name: str, start: int, end: int) -> int:
+        members = self._zrange(name, start, end)
+        return self._zrem(name, *members)
+
+    def _hdel(self, name: str, *keys) -> int:
+        hash_ = self.hashes.get(name, {})
+        return sum(hash_.pop(encode(k), None) is not None for k in keys)
+
+    def _zrangebyscore(self, name: str, min_score, max_score) -> list:
+        zset = self.zsets.get(name, {})
+        return [member for member, score in
+                sorted(zset.items(), key=lambda item: item[1])
+                if float(min_score) <= score <= float(max_score)]
+
+    def _zremrangebyscore(self, name: str, min_score, max_score) -> int:
+        members = self._zrangebyscore(name, min_score, max_score)
+        return self._zrem(name, *members)
+
+    # AbstractCache
+
+    async def close(self):
+        ...
+
+    async def get_from_cache_by_id(self, _id: str):
+        await self.round_trip()
+        return self._get(_id)
+
+    async def put_to_cache_by_id(self, _id, entity, expire):
+        await self.round_trip()
+        self._set(_id, entity, ex=expire)
+
+    async def delete_from_cache_by_id(self, _id):
+        await self.round_trip()
+        self._delete(_id)
+
+    async def get_from_cache_by_key(self, key: str = '',
+                                    sort: str = '') -> dict | None:
+        await self.round_trip()
+        return self._hgetall(key) or None
+
+    async def put_to_cache_by_key(self, key: str = '',
+                                  entities: dict | None = None):
+        await self.round_trip()
+        self._hset(key, entities or {})
+
+    async def get_keys_by_pattern(self, pattern: str = '*'):
+        keys = [key.encode() for store in self._stores for key in list(store)
+                if fnmatch.fnmatchcase(key, pattern)]
+
+        async def scan():
+            for key in keys:
+                yield key
+        return scan()
+
+    async def get_pipeline(self):
+        return FakePipeline(self)
+
+    async def get_index_range(self, index: str, min_score: float,
+                              max_score: float) -> list:
+        await self.round_trip()
+        return self._zrangebyscore(index, min_score, max_score)
+
+    async def get_many_by_keys(self, keys: list[str]) -> list[dict]:
+        await self.round_trip()
+        return [self._hgetall(key) for key in keys]
+
+    async def add_to_windows(self, counts: dict[str, int],
+                             window: float) -> dict[str, float]:
+        await self.round_trip()
+        now = time()
+        index = int(now // window)
+        estimates = {}
+        for key, count in counts.items():
+            current = self._incr(f"{key}:{index}", count)
+            self._expire(f"{key}:{index}", 2 * window)
+            previous = int(self._get(f"{key}:{index - 1}") or 0)
+            estimates[key] = previous * (1 - (now - index * window) /
+                                         window) + current
+        return estimates
+
+    async def acquire_lock(self, key: str, token: str, ttl: float) -> bool:
+        await self.round_trip()
+        return self._set(key, token, px=ttl * 1000, nx=True) or \
+            self._get(key) == token.encode()
+
+    async def extend_lock(self, key: str, token: str, ttl: float) -> bool:
+        await self.round_trip()
+        if self._get(key) != token.encode():
+            return False
+        return self._expire(key, ttl)
+
+    async def release_lock(self, key: str, token: str) -> bool:
+        await self.round_trip()
+        if self._get(key) != token.encode():
+            return False
+        return bool(self._delete(key))
@@ -0,0 +1,269 @@
+"""
+S3 node stand-in for benchmarks: an HTTP server with the subset of S3 API
+used by the service (HEAD/GET/PUT/DELETE object, CopyObject, multipart
+upload with UploadPartCopy and ListParts). Signatures aren't checked.
+
+Objects keep only their size, content is generated on read and uploaded
+bytes are dropped, so multi-GB objects don't take memory. Every request
+waits `latency` seconds and every body is sent at `bandwidth` bytes/s.
+"""
+import asyncio
+import itertools
+from dataclasses import dataclass, field
+from hashlib import md5
+from urllib.parse import unquote
+
+from aiohttp import web
+
+NS = 'http://s3.amazonaws.com/doc/2006-03-01/'
+CHUNK = 1024 * 1024
+# Content of every object is this block repeated
+BLOCK = bytes(range(256)) * (CHUNK // 256)
+
+
+@dataclass
+class Upload:
+    key: str
+    content_type: str
+    # part number -> (size, etag)
+    parts: dict[int, tuple[int, str]] = field(default_factory=dict)
+
+
+def etag_of(*values) -> str:
+    return md5(':'.join(map(str, values)).encode()).hexdigest()
+
+
+def xml(root: str, body: str) -> web.Response:
+    return web.Response(
+        text=f'<?xml version="1.0" encoding="UTF-8"?>'
+             f'<{root} xmlns="{NS}">{body}</{root}>',
+        content_type='application/xml')
+
+
+def error(status: int, code: str) -> web.Response:
+    return web.Response(
+        status=status,
+        text=f'<?xml version="1.0" encoding="UTF-8"?>'
+             f'<Error><Code>{code}</Code><Message>{code}</Message></Error>',
+        content_type='application/xml')
+
+
+class FakeS3Node:
+    def __init__(self,
+                 latency: float = 0,
+                 bandwidth: float = 0,
+                 host: str = '127.0.0.1'):
+        """
+        :param latency: Seconds added to every request
+        :param bandwidth: Bytes per second of request and response bodies,
+        0 is unlimited
+        """
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.host = host
+        self.port = 0
+        # (bucket, key) -> (size, etag, content type)
+        self.objects: dict[tuple[str, str], tuple[int, str, str]] = {}
+        self.uploads: dict[str, Upload] = {}
+        self.requests = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._ids = itertools.count(1)
+        self._runner: web.AppRunner | None = None
+
+    @property
+    def endpoint(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    def put(self, bucket: str, key: str, size: int,
+            content_type: str = 'video/mp4') -> None:
+        self.objects[(bucket, key)] = (size, etag_of(bucket, key, size),
+                                       content_type)
+
+    async def _transfer(self, size: int) -> None:
+        if self.bandwidth:
+            await asyncio.sleep(size / self.bandwidth)
+
+    @web.middleware
+    async def _delay(self, request: web.Request, handler):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return await handler(request)
+
+    async def start(self) -> None:
+        app = web.Application(middlewares=[self._delay],
+                              client_max_size=1024 ** 4)
+        app.router.add_route('*', '/{bucket}', self.bucket)
+        app.router.add_route('*', '/{bucket}/{key:.+}', self.object)
+        runner = self._runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, self.host, 0).start()
+        self.port = runner.addresses[0][1]
+
+    async def close(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def bucket(self, request: web.Request) -> web.Response:
+        if 'location' in request.query:
+            return xml('LocationConstraint', '')
+        return web.Response()
+
+    async def object(self, request: web.Request) -> web.StreamResponse:
+        bucket = request.match_info['bucket']
+        key = request.match_info['key']
+        query = request.query
+        method = request.method
+        if method == 'POST' and 'uploads' in query:
+            return self.create_upload(request, key)
+        if 'uploadId' in query:
+            upload = self.uploads.get(query['uploadId'])
+            if upload is None:
+                return error(404, 'NoSuchUpload')
+            if method == 'PUT':
+                return await self.upload_part(request, upload)
+            if method == 'GET':
+                return self.list_parts(upload, query)
+            if method == 'POST':
+                return self.complete(bucket, upload, query['uploadId'])
+            if method == 'DELETE':
+                del self.uploads[query['uploadId']]
+                return web.Response(status=204)
+        if method == 'PUT':
+            return await self.put_object(request, bucket, key)
+        if method == 'DELETE':
+            self.objects.pop((bucket, key), None)
+            return web.Response(status=204)
+        obj = self.objects.get((bucket, key))
+        if obj is None:
+            return error(404, 'NoSuchKey')
+        size, etag, content_type = obj
+        headers = {'ETag': f'"{etag}"', 'Content-Type': content_type,
+                   'Accept-Ranges': 'bytes'}
+        if method == 'HEAD':
+            return web.Response(headers=headers | {
+                'Content-Length': str(size)})
+        return await self.get_object(request, size, headers)
+
+    def create_upload(self, request: web.Request,
+                      key: str) -> web.Response:
+        upload_id = f"upload-{next(self._ids)}"
+        self.uploads[upload_id] = Upload(
+            key, request.headers.get('Content-Type', 'binary/octet-stream'))
+        return xml('InitiateMultipartUploadResult',
+                   f'<Bucket>{request.match_info["bucket"]}</Bucket>'
+                   f'<Key>{key}</Key><UploadId>{upload_id}</UploadId>')
+
+    def _copy_size(self, request: web.Request) -> int | None:
+        source = unquote(
+            request.headers['x-amz-copy-source'].split('?')[0]).lstrip('/')
+        bucket, _, key = source.partition('/')
+        obj = self.objects.get((bucket, key))
+        if obj is None:
+            return None
+        range_ = request.headers.get('x-amz-copy-source-range')
+        if range_:
+            start, end = range_.split('=')[1].split('-')
+            return int(end) - int(start) + 1
+        return obj[0]
+
+    async def _read_body(self, request: web.Request) -> int:
+        size = 0
+        async for chunk in request.content.iter_chunked(CHUNK):
+            size += len(chunk)
+            await self._transfer(len(chunk))
+        self.bytes_in += size
+        return size
+
+    async def upload_part(self, request: web.Request,
+                          upload: Upload) -> web.Response:
+        number = int(request.query['partNumber'])
+        if 'x-amz-copy-source' in request.headers:
+            size = self._copy_size(request)
+            if size is None:
+                return error(404, 'NoSuchKey')
+            etag = etag_of(upload.key, number, size)
+            upload.parts[number] = (size, etag)
+            return xml('CopyPartResult',
+                       f'<ETag>"{etag}"</ETag>'
+                       f'<LastModified>2024-01-01T00:00:00.000Z'
+                       f'</LastModified>')
+        size = await self._read_body(request)
+        etag = etag_of(upload.key, number, size)
+        upload.parts[number] = (size, etag)
+        return web.Response(headers={'ETag': f'"{etag}"'})
+
+    def list_parts(self, upload: Upload, query) -> web.Response:
+        marker = int(query.get('part-number-marker', 0))
+        max_parts = int(query.get('max-parts', 1000))
+        numbers = sorted(n for n in upload.parts if n > marker)
+        page = numbers[:max_parts]
+        truncated = len(numbers) > max_parts
+        parts = ''.join(
+            f'<Part><PartNumber>{n}</PartNumber>'
+            f'<ETag>"{upload.parts[n][1]}"</ETag>'
+            f'<Size>{upload.parts[n][0]}</Size>'
+            f'<LastModified>2024-01-01T00:00:00.000Z</LastModified></Part>'
+            for n in page)
+        return xml('ListPartsResult',
+                   f'<Key>{upload.key}</Key>'
+                   f'<PartNumberMarker>{marker}</PartNumberMarker>'
+                   f'<NextPartNumberMarker>{page[-1] if page else marker}'
+                   f'</NextPartNumberMarker>'
+                   f'<MaxParts>{max_parts}</MaxParts>'
+                   f'<IsTruncated>{str(truncated).lower()}</IsTruncated>'
+                   f'{parts}')
+
+    def complete(self, bucket: str, upload: Upload,
+                 upload_id: str) -> web.Response:
+        size = sum(size for size, _ in upload.parts.values())
+        self.put(bucket, upload.key, size, upload.content_type)
+        del self.uploads[upload_id]
+        etag = self.objects[(bucket, upload.key)][1]
+        return xml('CompleteMultipartUploadResult',
+                   f'<Bucket>{bucket}</Bucket><Key>{upload.key}</Key>'
+                   f'<ETag>"{etag}"</ETag>')
+
+    async def put_object(self, request: web.Request, bucket: str,
+                         key: str) -> web.Response:
+        content_type = request.headers.get('Content-Type',
+                                           'binary/octet-stream')
+        if 'x-amz-copy-source' in request.headers:
+            size = self._copy_size(request)
+            if size is None:
+                return error(404, 'NoSuchKey')
+            self.put(bucket, key, size, content_type)
+            return xml('CopyObjectResult',
+                       f'<ETag>"{self.objects[(bucket, key)][1]}"</ETag>'
+                       f'<LastModified>2024-01-01T00:00:00.000Z'
+                       f'</LastModified>')
+        self.put(bucket, key, await self._read_body(request), content_type)
+        return web.Response(
+            headers={'ETag': f'"{self.objects[(bucket, key)][1]}"'})
+
+    async def get_object(self, request: web.Request, size: int,
+                         headers: dict) -> web.StreamResponse:
+        start, end, status = 0, size - 1, 200
+        range_ = request.headers.get('Range')
+        if range_:
+            first, last = range_.split('=')[1].split('-')
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            status = 206
+            headers = headers | {'Content-Range':
+                                 f'bytes {start}-{end}/{size}'}
+        length = end - start + 1
+        response = web.StreamResponse(
+            status=status,
+            headers=headers | {'Content-Length': str(length)})
+        await response.prepare(request)
+        while length > 0:
+            chunk = BLOCK[:min(length, CHUNK)]
+            await self._transfer(len(chunk))
+            await response.write(chunk)
+            length -= len(chunk)
+            self.bytes_out += len(chunk)
+        await response.write_eof()
+        return response
@@ -0,0 +1,456 @@
+"""
+Load test of `main.app` without external services. S3 nodes are fake HTTP
+servers with configurable latency and bandwidth (`benchmarks.fake_s3`),
+Redis is an in-process stand-in (`benchmarks.fake_cache`), requests are sent
+to the ASGI app directly. Workloads:
+
+- redirects: `GET /api/v1/films/{object}` from clients of all regions,
+  objects are requested with Zipf distribution, misses start replications;
+- uploads: concurrent `PUT /api/v1/films/object/{object}` with streamed
+  bodies of `--upload-size` MB;
+- replication_storm: every object is requested from every edge region at
+  once, measured until all replications are finished.
+
+Every workload reports p50/p99 latency, throughput and peak RSS of the
+process (fake nodes included). `--save-baseline FILE` writes the results,
+`--baseline FILE` compares with them and exits with 1 on regressions
+bigger than `--tolerance` or on failed requests. Baselines depend on the
+machine, keep them next to the CI runner.
+
+Run from `cdn_api_async_redis/src`:
+    python -m benchmarks.load
+    python -m benchmarks.load --uploads 2 --upload-size 4096
+    python -m benchmarks.load --baseline baseline.json
+"""
+from benchmarks import env  # noqa: F401
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+from itertools import accumulate
+from time import perf_counter
+
+from benchmarks.fake_cache import FakeCache
+from benchmarks.fake_s3 import BLOCK, CHUNK, FakeS3Node
+from connectors import geoip, nodes, pool, queue, redis
+from core.config import edge_cache_settings, pool_settings, \
+    prefetch_settings, replication_settings, settings, upload_job_settings
+from main import app
+from services import capacity, jobs, prefetch, replication
+
+MB = 1024 ** 2
+# Node name -> (alias, city, latitude, longitude, network of its clients)
+REGIONS = {
+    'ORIGIN': ('origin', 'Frankfurt', 50.11, 8.68, '11.0.0.0/8'),
+    'EDGE1': ('edge1', 'New York', 40.71, -74.01, '12.0.0.0/8'),
+    'EDGE2': ('edge2', 'Singapore', 1.35, 103.82, '13.0.0.0/8'),
+    'EDGE3': ('edge3', 'Sao Paulo', -23.55, -46.63, '14.0.0.0/8'),
+}
+# Metric -> True if the bigger value is better
+DIRECTIONS = {'p50_ms': False,
+              'p99_ms': False,
+              'rps': True,
+              'mb_per_s': True,
+              'peak_rss_mb': False,
+              'redis_round_trips': False}
+# Seconds to wait for replications of a workload
+DRAIN_TIMEOUT = 600
+
+
+class Cluster:
+    """
+    Fake nodes and the service globals set up as `main.startup` does
+    """
+
+    def __init__(self, args: argparse.Namespace):
+        self.nodes = {
+            name: FakeS3Node(args.origin_latency, args.origin_bandwidth * MB)
+            if name == 'ORIGIN' else
+            FakeS3Node(args.edge_latency, args.edge_bandwidth * MB)
+            for name in REGIONS}
+        self.cache = FakeCache(args.redis_latency)
+        self.edge_capacity = args.edge_capacity * MB
+        self.directory = tempfile.TemporaryDirectory()
+
+    @property
+    def origin(self) -> FakeS3Node:
+        return self.nodes['ORIGIN']
+
+    @property
+    def edges(self) -> dict[str, FakeS3Node]:
+        return {name: node for name, node in self.nodes.items()
+                if name != 'ORIGIN'}
+
+    def _write_files(self) -> tuple[str, str]:
+        nodes_file = os.path.join(self.directory.name, 'nodes.json')
+        with open(nodes_file, 'w') as file:
+            json.dump({name: {'endpoint': self.nodes[name].endpoint,
+                              'alias': alias,
+                              'access_key_id': 'benchmark',
+                              'secret_access_key': 'benchmark',
+                              'city': city,
+                              'latitude': latitude,
+                              'longitude': longitude,
+                              'is_active': 'True',
+                              'capacity_bytes': 0 if name == 'ORIGIN' else
+                              self.edge_capacity}
+                       for name, (alias, city, latitude, longitude, _)
+                       in REGIONS.items()}, file)
+        geoip_file = os.path.join(self.directory.name, 'geoip.csv')
+        with open(geoip_file, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(('network', 'latitude', 'longitude'))
+            for _, _, latitude, longitude, network in REGIONS.values():
+                writer.writerow((network, latitude, longitude))
+        return nodes_file, geoip_file
+
+    async def start(self) -> None:
+        for node in self.nodes.values():
+            await node.start()
+        nodes_file, geoip_file = self._write_files()
+        nodes.node_registry = nodes.NodeRegistry(nodes_file)
+        await nodes.node_registry.start()
+        local = geoip.LocalGeoResolver(geoip_file)
+        await local.load()
+        geoip.geo_resolver = geoip.ChainGeoResolver(local)
+        pool.s3_pool = pool.S3Pool(pool_settings.max_connections,
+                                   pool_settings.max_connections_per_host,
+                                   pool_settings.keepalive_timeout,
+                                   pool_settings.region,
+                                   pool_settings.connect_timeout,
+                                   pool_settings.read_timeout)
+        await pool.s3_pool.start()
+        redis.redis = self.cache
+        queue.replication_queue = queue.LocalQueue(
+            replication_settings.max_attempts)
+        replication.replication_workers = replication.ReplicationWorkers(
+            queue.replication_queue,
+            self.cache,
+            replication_settings.workers,
+            replication_settings.per_edge,
+            replication_settings.claim_idle / 3)
+        await replication.replication_workers.start()
+        capacity.replica_tracker = capacity.ReplicaTracker(
+            self.cache,
+            edge_cache_settings.flush_interval)
+        await capacity.replica_tracker.start()
+        if prefetch_settings.enabled:
+            prefetch.demand_counter = prefetch.DemandCounter(
+                self.cache,
+                prefetch_settings.flush_interval)
+            await prefetch.demand_counter.start()
+        jobs.upload_jobs = jobs.UploadJobs(upload_job_settings.workers,
+                                           upload_job_settings.max_jobs,
+                                           upload_job_settings.max_bytes,
+                                           upload_job_settings.directory)
+        await jobs.upload_jobs.start()
+
+    async def close(self) -> None:
+        await jobs.upload_jobs.close()
+        await capacity.replica_tracker.close()
+        if prefetch.demand_counter:
+            await prefetch.demand_counter.close()
+        await replication.replication_workers.close()
+        await nodes.node_registry.close()
+        await geoip.geo_resolver.close()
+        await pool.s3_pool.close()
+        for node in self.nodes.values():
+            await node.close()
+        self.directory.cleanup()
+
+    def put(self, object_name: str, size: int) -> None:
+        self.origin.put(settings.bucket_name, object_name, size)
+
+    async def drain(self) -> None:
+        """
+        Wait until replications of the workload are finished
+        """
+        deadline = perf_counter() + DRAIN_TIMEOUT
+        while (await queue.replication_queue.depth() or
+               replication.replication_workers.busy):
+            if perf_counter() > deadline:
+                raise TimeoutError('Replications are not finished')
+            await asyncio.sleep(0.01)
+
+    def replicated(self, object_names: list[str]) -> int:
+        return sum((settings.bucket_name, name) in node.objects
+                   for node in self.edges.values()
+                   for name in object_names)
+
+
+async def send_request(method: str,
+                       path: str,
+                       client_host: str,
+                       body_size: int = 0) -> tuple[int, float]:
+    """
+    Call the app like an HTTP server behind the trusted proxy
+    :return: (status, seconds)
+    """
+    headers = [(b'host', b'cdn'), (b'x-real-ip', client_host.encode())]
+    if method in ('PUT', 'POST'):
+        headers += [(b'content-length', str(body_size).encode()),
+                    (b'content-type', b'video/mp4')]
+    scope = {'type': 'http',
+             'asgi': {'version': '3.0'},
+             'http_version': '1.1',
+             'method': method,
+             'scheme': 'http',
+             'path': path,
+             'raw_path': path.encode(),
+             'query_string': b'',
+             'root_path': '',
+             'headers': headers,
+             'client': ('127.0.0.1', 50000),
+             'server': ('127.0.0.1', 8000)}
+    remaining = body_size
+    body_sent = False
+    finished = asyncio.Event()
+    result = {}
+
+    async def receive():
+        nonlocal remaining, body_sent
+        if body_sent:
+            await finished.wait()
+            return {'type': 'http.disconnect'}
+        chunk = BLOCK[:min(remaining, CHUNK)]
+        remaining -= len(chunk)
+        body_sent = remaining <= 0
+        return {'type': 'http.request', 'body': chunk,
+                'more_body': not body_sent}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            result['status'] = message['status']
+        elif not message.get('more_body'):
+            finished.set()
+
+    started = perf_counter()
+    await app(scope, receive, send)
+    finished.set()
+    return result.get('status', 0), perf_counter() - started
+
+
+def client_of(region: str, rnd: random.Random) -> str:
+    first = REGIONS[region][4].split('.')[0]
+    return f"{first}.{rnd.randrange(256)}.{rnd.randrange(256)}." \
+           f"{rnd.randrange(1, 255)}"
+
+
+async def run_requests(requests: list[tuple], concurrency: int,
+                       expected: int) -> tuple[list[float], int, float]:
+    """
+    Send requests with `concurrency` at the same time
+    :return: (latencies, failed requests, seconds)
+    """
+    latencies, errors = [], 0
+    pending = iter(requests)
+
+    async def client():
+        nonlocal errors
+        for request in pending:
+            try:
+                status, seconds = await send_request(*request)
+            except Exception as e:
+                logging.error(f"{request[:2]} failed: {e!r}")
+                status, seconds = 0, 0
+            if status == expected:
+                latencies.append(seconds)
+            else:
+                errors += 1
+
+    started = perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, errors, perf_counter() - started
+
+
+def percentile(values: list[float], share: float) -> float:
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, round(share * (len(values) - 1)))]
+
+
+def peak_rss_mb() -> float:
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summary(latencies: list[float], errors: int, seconds: float) -> dict:
+    return {'requests': len(latencies) + errors,
+            'errors': errors,
+            'p50_ms': percentile(latencies, 0.5) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'rps': len(latencies) / seconds if seconds else 0,
+            'peak_rss_mb': peak_rss_mb()}
+
+
+async def redirects(cluster: Cluster, args: argparse.Namespace,
+                    rnd: random.Random) -> dict:
+    object_names = [f"zipf-{i}.mp4" for i in range(args.objects)]
+    for name in object_names:
+        cluster.put(name, args.object_size * MB)
+    weights = list(accumulate(1 / rank ** args.zipf
+                              for rank in range(1, len(object_names) + 1)))
+    regions = list(REGIONS)
+    requests = [('GET', f"/api/v1/films/{name}",
+                 client_of(rnd.choice(regions), rnd))
+                for name in rnd.choices(object_names, cum_weights=weights,
+                                        k=args.requests)]
+    round_trips = cluster.cache.round_trips
+    result = summary(*await run_requests(requests, args.concurrency, 307))
+    result['redis_round_trips'] = \
+        (cluster.cache.round_trips - round_trips) / args.requests
+    await cluster.drain()
+    return result
+
+
+async def uploads(cluster: Cluster, args: argparse.Namespace,
+                  rnd: random.Random) -> dict:
+    size = args.upload_size * MB
+    requests = [('PUT', f"/api/v1/films/object/upload-{i}.mp4",
+                 client_of('ORIGIN', rnd), size)
+                for i in range(args.uploads)]
+    latencies, errors, seconds = await run_requests(requests, args.uploads,
+                                                    200)
+    result = summary(latencies, errors, seconds)
+    result['mb_per_s'] = len(latencies) * args.upload_size / seconds
+    return result
+
+
+async def replication_storm(cluster: Cluster, args: argparse.Namespace,
+                            rnd: random.Random) -> dict:
+    object_names = [f"storm-{i}.mp4" for i in range(args.storm_objects)]
+    for name in object_names:
+        cluster.put(name, args.storm_size * MB)
+    requests = [('GET', f"/api/v1/films/{name}", client_of(region, rnd))
+                for name in object_names for region in cluster.edges]
+    rnd.shuffle(requests)
+    started = perf_counter()
+    latencies, errors, _ = await run_requests(requests, len(requests), 307)
+    await cluster.drain()
+    seconds = perf_counter() - started
+    copies = cluster.replicated(object_names)
+    result = summary(latencies, errors, seconds)
+    # Replications that didn't reach the edge are failures too
+    result['errors'] += len(requests) - copies
+    result['mb_per_s'] = copies * args.storm_size / seconds
+    return result
+
+
+WORKLOADS = {'redirects': redirects,
+             'uploads': uploads,
+             'replication_storm': replication_storm}
+
+
+async def run(args: argparse.Namespace) -> dict:
+    rnd = random.Random(args.seed)
+    cluster = Cluster(args)
+    await cluster.start()
+    results = {}
+    try:
+        for name in args.workloads:
+            results[name] = await WORKLOADS[name](cluster, args, rnd)
+    finally:
+        await cluster.close()
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for workload, metrics in results.items():
+        if metrics['errors']:
+            regressions.append(f"{workload}: {metrics['errors']} of "
+                               f"{metrics['requests']} requests failed")
+        for metric, expected in baseline.get(workload, {}).items():
+            if metric not in DIRECTIONS or metric not in metrics:
+                continue
+            value = metrics[metric]
+            if DIRECTIONS[metric]:
+                worse = value < expected * (1 - tolerance)
+            else:
+                worse = value > expected * (1 + tolerance)
+            if worse:
+                regressions.append(f"{workload}.{metric}: {value:.2f}, "
+                                   f"baseline {expected:.2f}")
+    return regressions
+
+
+def print_results(results: dict) -> None:
+    print(f"{'workload':<18} {'requests':>8} {'errors':>6} {'p50, ms':>9} "
+          f"{'p99, ms':>9} {'req/s':>8} {'MB/s':>8} {'RSS, MB':>8}")
+    for workload, metrics in results.items():
+        print(f"{workload:<18} {metrics['requests']:>8} "
+              f"{metrics['errors']:>6} {metrics['p50_ms']:>9.2f} "
+              f"{metrics['p99_ms']:>9.2f} {metrics['rps']:>8.1f} "
+              f"{metrics.get('mb_per_s', 0):>8.1f} "
+              f"{metrics['peak_rss_mb']:>8.0f}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workloads', nargs='+', choices=list(WORKLOADS),
+                        default=list(WORKLOADS))
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--objects', type=int, default=200)
+    parser.add_argument('--zipf', type=float, default=1.1,
+                        help='Exponent of object popularity')
+    parser.add_argument('--object-size', type=int, default=16,
+                        help='MB, size of objects of redirects')
+    parser.add_argument('--uploads', type=int, default=4,
+                        help='Uploads at the same time')
+    parser.add_argument('--upload-size', type=int, default=256, help='MB')
+    parser.add_argument('--storm-objects', type=int, default=20)
+    parser.add_argument('--storm-size', type=int, default=16, help='MB')
+    parser.add_argument('--origin-latency', type=float, default=0.005,
+                        help='Seconds per S3 request')
+    parser.add_argument('--edge-latency', type=float, default=0.002)
+    parser.add_argument('--origin-bandwidth', type=float, default=0,
+                        help='MB/s per request, 0 is unlimited')
+    parser.add_argument('--edge-bandwidth', type=float, default=0)
+    parser.add_argument('--edge-capacity', type=int, default=0,
+                        help='MB of replicas per edge, 0 is unlimited')
+    parser.add_argument('--redis-latency', type=float, default=0.0002,
+                        help='Seconds per Redis round trip')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', action='store_true',
+                        help='Print results as JSON')
+    parser.add_argument('--baseline', help='Compare with the baseline file')
+    parser.add_argument('--save-baseline', help='Save results to the file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed change of metrics, share of baseline')
+    parser.add_argument('--verbose', action='store_true',
+                        help='Show logs of the service')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if not args.verbose:
+        logging.disable(logging.INFO)
+    results = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as file:
+            json.dump(results, file, indent=2)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
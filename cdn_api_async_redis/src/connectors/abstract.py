@@ -4,7 +4,7 @@ from typing import Optional
 from miniopy_async.datatypes import Object
 from pymongo.results import DeleteResult
 
-from models.model import Model
+from models.model import Model, ObjectMeta, QueueItem
 
 
 class AbstractS3(ABC):
@@ -41,6 +41,17 @@ class AbstractS3(ABC):
                          **kwargs) -> dict | bool:
         pass
 
+    @abstractmethod
+    async def head_object(self,
+                          bucket_name: str,
+                          object_name: str) -> ObjectMeta | None:
+        """
+        Lightweight existence check. Sends HEAD request, no body is
+        transferred.
+        :return: Object metadata or None if object doesn't exist
+        """
+        pass
+
     @abstractmethod
     async def stat_object(self,
                           bucket_name: str,
@@ -49,7 +60,14 @@ class AbstractS3(ABC):
         pass
 
     @abstractmethod
-    async def copy_object(self, source: str, destination: str) -> None:
+    async def copy_object(self,
+                          bucket_name: str,
+                          object_name: str,
+                          source_bucket: str,
+                          source_object: str) -> bool:
+        """
+        Server-side copy inside one S3 service, data doesn't leave storage
+        """
         pass
 
     @abstractmethod
@@ -67,6 +85,25 @@ class AbstractS3(ABC):
         pass
 
 
+class AbstractGeoResolver(ABC):
+    """
+    Abstract class to find geographic coordinates of the IP address
+    """
+
+    @abstractmethod
+    async def resolve(self, ip: str) -> tuple[float, float] | None:
+        """
+        Get coordinates of the IP address
+        :param ip: IPv4 or IPv6 address
+        :return: (latitude, longitude) or None if address is unknown
+        """
+        ...
+
+    @abstractmethod
+    async def close(self):
+        ...
+
+
 class AbstractStorage(ABC):
     """
     Абстрактный класс для работы с хранилищем данных.
@@ -201,3 +238,123 @@ class AbstractCache(ABC):
         :return:
         """
         ...
+
+    @abstractmethod
+    async def get_index_range(self,
+                              index: str,
+                              min_score: float,
+                              max_score: float) -> list:
+        """
+        Абстрактный асинхронный метод для получения ключей из индекса
+        (сортированного множества) со score от min_score до max_score
+        """
+        ...
+
+    @abstractmethod
+    async def get_many_by_keys(self, keys: list[str]) -> list[dict]:
+        """
+        Абстрактный асинхронный метод для получения данных по нескольким
+        ключам за один запрос к кэшу
+        :return: данные в порядке ключей, пустой dict для отсутствующих
+        """
+        ...
+
+    @abstractmethod
+    async def add_to_windows(self,
+                             counts: dict[str, int],
+                             window: float) -> dict[str, float]:
+        """
+        Абстрактный асинхронный метод, который атомарно добавляет запросы в
+        скользящие окна счётчиков за один запрос к кэшу
+        :param counts: {ключ счётчика: количество новых запросов}
+        :param window: длина окна в секундах
+        :return: {ключ счётчика: количество запросов в скользящем окне}
+        """
+        ...
+
+    @abstractmethod
+    async def acquire_lock(self, key: str, token: str, ttl: float) -> bool:
+        """
+        Абстрактный асинхронный метод, который атомарно захватывает
+        блокировку, если она свободна
+        :param key: ключ блокировки
+        :param token: уникальный токен владельца
+        :param ttl: время жизни блокировки в секундах
+        :return: True, если блокировка захвачена
+        """
+        ...
+
+    @abstractmethod
+    async def extend_lock(self, key: str, token: str, ttl: float) -> bool:
+        """
+        Абстрактный асинхронный метод, который продлевает блокировку, если
+        она всё ещё принадлежит владельцу токена
+        :return: True, если блокировка продлена
+        """
+        ...
+
+    @abstractmethod
+    async def release_lock(self, key: str, token: str) -> bool:
+        """
+        Абстрактный асинхронный метод, который снимает блокировку, если
+        она всё ещё принадлежит владельцу токена
+        :return: True, если блокировка снята
+        """
+        ...
+
+
+class AbstractQueue(ABC):
+    """
+    Abstract class of the work queue. Task is a dict of strings, it stays in
+    the queue until it's acknowledged.
+    """
+
+    @abstractmethod
+    async def put(self, task: dict, priority: bool = False) -> None:
+        """
+        Add task to the queue
+        :param priority: Task is taken before all not priority tasks
+        """
+        ...
+
+    @abstractmethod
+    async def get(self, count: int, timeout: float) -> list[QueueItem]:
+        """
+        Take up to `count` tasks of every priority, priority tasks first
+        :param timeout: Seconds to wait for a task if the queue is empty
+        """
+        ...
+
+    @abstractmethod
+    async def ack(self, item: QueueItem) -> None:
+        """
+        Remove finished task from the queue
+        """
+        ...
+
+    @abstractmethod
+    async def retry(self, item: QueueItem) -> None:
+        """
+        Return failed task to the queue or move it to dead letters when it
+        has no attempts left
+        """
+        ...
+
+    @abstractmethod
+    async def touch(self, item: QueueItem) -> None:
+        """
+        Tell the queue that the task is still processed, so it isn't taken
+        for a task of a stopped consumer
+        """
+        ...
+
+    @abstractmethod
+    async def depth(self) -> int:
+        """
+        Tasks waiting in the queue
+        """
+        ...
+
+    @abstractmethod
+    async def close(self) -> None:
+        ...
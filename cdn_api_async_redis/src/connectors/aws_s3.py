@@ -1,28 +1,74 @@
+import asyncio
 import logging
 import os
+from collections import deque
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Any
+from time import perf_counter
+from typing import Any, AsyncGenerator, Awaitable, Callable
 
 from aioboto3 import Session
 from aiofiles import open
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
 from fastapi import HTTPException, status
 from miniopy_async import S3Error
 from miniopy_async.datatypes import Object
 
-from core.config import settings
+from core.config import replication_settings, settings, upload_settings
 from connectors.abstract import AbstractS3, AbstractCache
+from helpers.metrics import UPLOAD_PART_SECONDS, UPLOAD_PART_SPEED
+from helpers.progress import ProgressCheckpointer
+from models.model import ObjectMeta
+from services.backoff import backoff, endpoint_of, retry
+
+# Errors of unavailable node, request is retried
+S3_ERRORS = (BotoCoreError, asyncio.TimeoutError)
+# Error codes of an overloaded node, other 4xx errors (NoSuchUpload,
+# EntityTooSmall, AccessDenied...) fail the same way on every try
+THROTTLING_CODES = {'SlowDown', 'Throttling', 'ThrottlingException',
+                    'RequestLimitExceeded', 'TooManyRequestsException',
+                    'RequestTimeout'}
+
+
+class TransientClientError(ClientError):
+    """
+    ClientError worth retrying: 5xx or throttling reply of the node
+    """
+
+    @staticmethod
+    def is_transient(e: ClientError) -> bool:
+        status_code = e.response.get(
+            'ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return status_code >= 500 or status_code == 429 or \
+            e.response.get('Error', {}).get('Code') in THROTTLING_CODES
 
 
 class AWSS3(AbstractS3):
-    def __init__(self, endpoint: str, *args, **kwargs):
-        self.session = Session()
+    def __init__(self, endpoint: str, client=None, *args, **kwargs):
         self.endpoint = endpoint
-        self.client = self.session.client('s3',
-                                          endpoint_url=self.endpoint,
-                                          *args,
-                                          **kwargs
-                                          )
+        # Client borrowed from S3Pool is already opened and must stay opened
+        self.borrowed = client is not None
+        if self.borrowed:
+            self.client = client
+        else:
+            self.session = Session()
+            self.client = self.session.client('s3',
+                                              endpoint_url=self.endpoint,
+                                              *args,
+                                              **kwargs
+                                              )
+
+    @asynccontextmanager
+    async def connect(self):
+        """
+        Get low level S3 client. Own client is opened and closed here,
+        borrowed one is returned as is.
+        """
+        if self.borrowed:
+            yield self.client
+        else:
+            async with self.client as s3:
+                yield s3
 
     async def get_url(self, *args, **kwargs) -> str:
         pass
@@ -51,6 +97,22 @@ class AWSS3(AbstractS3):
             logging.info(e)
             return False
 
+    @backoff(service=endpoint_of, exceptions=S3_ERRORS)
+    async def head_object(self,
+                          bucket_name: str,
+                          object_name: str) -> ObjectMeta | None:
+        try:
+            async with self.connect() as s3:
+                response = await s3.head_object(Bucket=bucket_name,
+                                                Key=object_name)
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                logging.error(e)
+            return None
+        return ObjectMeta(size=response['ContentLength'],
+                          etag=response['ETag'].strip('"'),
+                          content_type=response.get('ContentType'))
+
     async def stat_object(self,
                           bucket_name: str,
                           object_name: str
@@ -65,15 +127,32 @@ class AWSS3(AbstractS3):
                 headers={"WWW-Authenticate": "Bearer"},
             )
 
-    async def copy_object(self, source: str, destination: str) -> None:
-        pass
+    @backoff(service=endpoint_of, exceptions=S3_ERRORS)
+    async def copy_object(self,
+                          bucket_name: str,
+                          object_name: str,
+                          source_bucket: str,
+                          source_object: str) -> bool:
+        try:
+            async with self.connect() as s3:
+                await s3.copy_object(Bucket=bucket_name,
+                                     Key=object_name,
+                                     CopySource={'Bucket': source_bucket,
+                                                 'Key': source_object})
+            logging.info(f"Copied '{source_object}' from bucket "
+                         f"'{source_bucket}' to bucket '{bucket_name}' in "
+                         f"S3 '{self.endpoint}'")
+            return True
+        except (ClientError, BotoCoreError) as e:
+            logging.error(e)
+            return False
 
     async def fget_object(self,
                           bucket_name: str,
                           object_name: str,
                           file_name) -> bool:
         try:
-            async with self.client as s3:
+            async with self.connect() as s3:
                 s3.download_file(bucket_name,
                                  object_name,
                                  file_name)
@@ -95,6 +174,8 @@ class AWSS3(AbstractS3):
 class S3MultipartUpload(AWSS3):
     # AWS throws EntityTooSmall error for parts smaller than 5 MB
     PART_MINIMUM = int(5e6)
+    PART_MAXIMUM = 5 * 1024 ** 3
+    MAX_PARTS = 10000
 
     def __init__(self,
                  bucket: str,
@@ -102,19 +183,52 @@ class S3MultipartUpload(AWSS3):
                  local_path: str | None = None,
                  content_type: str | None = None,
                  total_bytes: int = 0,
-                 part_size: int = settings.upload_part_size,
+                 part_size: int | None = None,
+                 source_bucket: str | None = None,
+                 server_side_copy: bool = False,
+                 source_key: str | None = None,
                  *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.bucket = bucket
         self.key = key
+        # Bucket on origin node to replicate the object from
+        self.source_bucket = source_bucket or bucket
+        # Object on origin node, e.g. the whole object for its head copy
+        self.source_key = source_key or key
+        # Parts are copied by the storage with UploadPartCopy
+        self.server_side_copy = server_side_copy
         self.path = local_path
         self.content_type = content_type
         if self.path:
             self.total_bytes = os.stat(local_path).st_size
         else:
-            self.total_bytes = total_bytes
-        self.part_bytes = part_size
-        assert part_size > self.PART_MINIMUM
+            self.total_bytes = total_bytes or 0
+        # Resumed upload must keep the part size it was started with
+        self.part_bytes = part_size or self.plan_part_size(self.total_bytes)
+        assert self.part_bytes > self.PART_MINIMUM
+
+    @classmethod
+    def plan_part_size(cls, total_bytes: int) -> int:
+        """
+        Choose part size for the object: about `UPLOAD_TARGET_PARTS` parts
+        between `UPLOAD_PART_SIZE` and `UPLOAD_PART_MAX_SIZE` bytes. Parts
+        are made bigger if the object doesn't fit into 10000 parts anyway.
+        Object of unknown size (chunked request body) is uploaded in the
+        biggest parts that fit into `UPLOAD_MEMORY_BUDGET`, as every part is
+        buffered, so it can be up to 10000 such parts.
+        :param total_bytes: Object size, 0 if it's unknown
+        :return: Part size in bytes
+        """
+        if not total_bytes:
+            size = min(upload_settings.part_max_size,
+                       upload_settings.memory_budget)
+            return min(max(size, settings.upload_part_size),
+                       cls.PART_MAXIMUM)
+        size = -(-total_bytes // upload_settings.target_parts)
+        size = min(max(size, settings.upload_part_size),
+                   upload_settings.part_max_size)
+        size = max(size, -(-total_bytes // cls.MAX_PARTS))
+        return min(size, cls.PART_MAXIMUM)
 
     async def list_multipart_uploads(self, s3) -> dict:
         try:
@@ -149,12 +263,37 @@ class S3MultipartUpload(AWSS3):
 
     async def get_uploaded_parts(self, s3, upload_id: str) -> list:
         parts = []
-        res = await s3.list_parts(Bucket=self.bucket, Key=self.key,
-                                  UploadId=upload_id)
-        if "Parts" in res:
-            for p in res["Parts"]:
-                parts.append(p)  # PartNumber, ETag, Size [bytes], ...
-        return parts
+        marker = 0
+        while True:
+            # S3 returns up to 1000 parts per request
+            res = await s3.list_parts(Bucket=self.bucket, Key=self.key,
+                                      UploadId=upload_id,
+                                      PartNumberMarker=marker)
+            if "Parts" in res:
+                for p in res["Parts"]:
+                    parts.append(p)  # PartNumber, ETag, Size [bytes], ...
+            if not res.get("IsTruncated"):
+                return parts
+            marker = res["NextPartNumberMarker"]
+
+    async def presign_part(self,
+                           s3,
+                           mpu_id: str,
+                           part_number: int,
+                           expires: int) -> str:
+        """
+        URL to upload the part with PUT request straight to S3
+        """
+        return await s3.generate_presigned_url(
+            'upload_part',
+            Params={'Bucket': self.bucket,
+                    'Key': self.key,
+                    'UploadId': mpu_id,
+                    'PartNumber': part_number},
+            ExpiresIn=expires)
+
+    def parts_count(self) -> int:
+        return max(1, -(-self.total_bytes // self.part_bytes))
 
     async def create(self, s3):
         mpu = await s3.create_multipart_upload(
@@ -208,6 +347,177 @@ class S3MultipartUpload(AWSS3):
                 i += 1
         return parts
 
+    async def _fetch_origin_part(self,
+                                 origin_client: AbstractS3,
+                                 origin_client_s3,
+                                 offset: int,
+                                 size: int) -> bytes:
+        got_obj = await origin_client.get_object(
+            self.source_bucket,
+            self.source_key,
+            s3=origin_client_s3,
+            offset=offset,
+            length=offset + size - 1)
+        return await got_obj['Body'].content.readexactly(
+            got_obj['ContentLength'])
+
+    async def _read_origin_parts(self,
+                                 origin_client: AbstractS3,
+                                 origin_client_s3,
+                                 skip: set[int]
+                                 ) -> AsyncGenerator[tuple[int, int,
+                                                           bytes | None],
+                                                     None]:
+        """
+        Read object from origin node with ranged GETs. Up to
+        `REPLICATION_PREFETCH_PARTS` parts are downloaded ahead while
+        previous parts are uploaded to the edge. Parts from `skip` are not
+        downloaded at all.
+        :return: (part number, part size, data or None for skipped part)
+        """
+        fetches: deque[tuple[int, int, asyncio.Task | None]] = deque()
+
+        async def next_part() -> tuple[int, int, bytes | None]:
+            part_number, size, task = fetches.popleft()
+            return part_number, size, await task if task else None
+
+        try:
+            offsets = range(0, self.total_bytes, self.part_bytes)
+            for part_number, offset in enumerate(offsets, 1):
+                size = min(self.part_bytes, self.total_bytes - offset)
+                task = None
+                if part_number not in skip:
+                    task = asyncio.create_task(self._fetch_origin_part(
+                        origin_client, origin_client_s3, offset, size))
+                fetches.append((part_number, size, task))
+                while len(fetches) > replication_settings.prefetch_parts or \
+                        fetches and fetches[0][2] is None:
+                    yield await next_part()
+            while fetches:
+                yield await next_part()
+        finally:
+            for _, _, task in fetches:
+                if task:
+                    task.cancel()
+
+    async def _read_copy_parts(self, skip: set[int]
+                               ) -> AsyncGenerator[tuple[int, int,
+                                                         str | None],
+                                                   None]:
+        """
+        Split object on origin node into ranges for UploadPartCopy
+        :return: (part number, part size, range or None for skipped part)
+        """
+        offsets = range(0, self.total_bytes, self.part_bytes)
+        for part_number, offset in enumerate(offsets, 1):
+            size = min(self.part_bytes, self.total_bytes - offset)
+            range_ = None
+            if part_number not in skip:
+                range_ = f"bytes={offset}-{offset + size - 1}"
+            yield part_number, size, range_
+
+    async def _read_stream_parts(self, object_: Any
+                                 ) -> AsyncGenerator[tuple[int, int, bytes],
+                                                     None]:
+        """
+        Read client's file part by part
+        :return: (part number, part size, data)
+        """
+        part_number = 0
+        while True:
+            data = await object_.read(self.part_bytes)
+            if not len(data):
+                break
+            part_number += 1
+            if part_number > self.MAX_PARTS:
+                # Body of unknown size is bigger than 10000 parts
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"Object is bigger than "
+                           f"{self.MAX_PARTS * self.part_bytes} bytes",
+                    headers={"WWW-Authenticate": "Bearer"},
+                )
+            yield part_number, len(data), data
+
+    async def upload_part(self,
+                          s3,
+                          mpu_id: str,
+                          part_number: int,
+                          data: bytes) -> str:
+        """
+        Upload one part, retrying it on errors
+        :return: ETag of the part
+        """
+        async def request() -> str:
+            part = await s3.upload_part(
+                # We could include `ContentMD5='hash'` to discover if
+                # data has been corrupted upon transfer
+                Body=data,
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=mpu_id,
+                PartNumber=part_number,
+            )
+            return part["ETag"]
+
+        return await self._retry_part(part_number, request)
+
+    async def upload_part_copy(self,
+                               s3,
+                               mpu_id: str,
+                               part_number: int,
+                               range_: str) -> str:
+        """
+        Copy one part from origin bucket on the storage side, retrying it
+        on errors
+        :param range_: Bytes range of the source object
+        :return: ETag of the part
+        """
+        async def request() -> str:
+            part = await s3.upload_part_copy(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=mpu_id,
+                PartNumber=part_number,
+                CopySource={'Bucket': self.source_bucket,
+                            'Key': self.source_key},
+                CopySourceRange=range_,
+            )
+            return part["CopyPartResult"]["ETag"]
+
+        return await self._retry_part(part_number, request)
+
+    async def _retry_part(self, part_number: int, request) -> str:
+        async def attempt() -> str:
+            try:
+                return await request()
+            except ClientError as e:
+                # Permanent errors are raised at once and don't count as
+                # failures of the node
+                if TransientClientError.is_transient(e):
+                    raise TransientClientError(e.response,
+                                               e.operation_name) from e
+                raise
+
+        try:
+            return await retry(attempt,
+                               endpoint_of(self),
+                               start_sleep_time=0.5,
+                               max_tries=upload_settings.part_retries + 1,
+                               exceptions=S3_ERRORS + (TransientClientError,))
+        except (ClientError, BotoCoreError, asyncio.TimeoutError) as e:
+            logging.error(f"Part {part_number} of '{self.key}' failed: {e}")
+            raise
+
+    @staticmethod
+    async def _measure_part(link: str, size: int, part) -> str:
+        started = perf_counter()
+        etag = await part
+        elapsed = perf_counter() - started
+        UPLOAD_PART_SECONDS.observe(elapsed, link)
+        UPLOAD_PART_SPEED.observe(size / elapsed if elapsed else 0, link)
+        return etag
+
     async def upload_bytes(self,
                            s3,
                            mpu_id: str,
@@ -219,86 +529,126 @@ class S3MultipartUpload(AWSS3):
                            object_: Any = None,
                            collection: str = "api",
                            ):
+        """
+        Upload parts concurrently. Up to `UPLOAD_MAX_IN_FLIGHT` parts and
+        `UPLOAD_MEMORY_BUDGET` bytes are uploaded at the same time, the next
+        part is read only when there is room for it. With `server_side_copy`
+        parts are copied by the storage and the memory budget isn't used.
+        :param parts: Already uploaded parts (from `get_uploaded_parts`)
+        :return: Parts list ordered by part number for `complete`
+        """
+        uploaded_parts = {p["PartNumber"]: p for p in parts or []}
+        # Data of a part is bytes to upload or range to copy, None for parts
+        # that are already uploaded
+        source: AsyncGenerator[tuple[int, int, bytes | str | None], None]
+        send_part: Callable[[Any, str, int, Any], Awaitable[str]] = \
+            self.upload_part
+        # Replicas and their heads are read from origin, copied parts don't
+        # pass through the API
+        replica = collection in ("cdn", "head")
+        copying = replica and self.server_side_copy
+        if copying:
+            source = self._read_copy_parts(set(uploaded_parts))
+            send_part = self.upload_part_copy
+        elif replica:
+            source = self._read_origin_parts(origin_client,
+                                             origin_client_s3,
+                                             set(uploaded_parts))
+        elif collection == "api":
+            source = self._read_stream_parts(object_)
+        else:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Bad collection '{str(collection)}'!",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
 
         object_name = self.key
-        endpoint = self.endpoint
-
-        if parts is None:
-            parts = []
-
+        key = f"{collection}^{object_name}^{self.endpoint}"
+        # Source and destination of the bytes for metrics
+        link = f"{endpoint_of(origin_client) if origin_client else 'api'}" \
+               f"->{endpoint_of(self)}"
+        etags: dict[int, str] = {}
+        # task -> (part number, part size)
+        pending: dict[asyncio.Task, tuple[int, int]] = {}
+        buffered = 0 if copying else 1
+        in_flight_bytes = 0
         uploaded_bytes = 0
-        part_number = 1
-        while True:
-            if collection == "cdn":
-                offset = uploaded_bytes
-                length = uploaded_bytes + settings.upload_part_size - 1
-                if offset >= self.total_bytes:
-                    data = b''
-                else:
-                    got_obj = await origin_client.get_object(
-                        settings.bucket_name,
-                        object_name,
-                        s3=origin_client_s3,
-                        offset=offset,
-                        length=length)
-                    data = await got_obj['Body'].content.readexactly(
-                        got_obj['ContentLength'])
-
-            elif collection == "api":
-                data = await object_.read(settings.upload_part_size)
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Bad collection '{str(collection)}'!",
-                    headers={"WWW-Authenticate": "Bearer"},
-                )
-            if not len(data):
-                break
-            uploaded_bytes += len(data)
-
-            if len(parts) >= part_number:
-                # Already uploaded, go to the next one
-                part = parts[part_number - 1]
-                if len(data) != part["Size"]:
-                    raise Exception("Size mismatch: local " + str(
-                        len(data)) + ", remote: " + str(part["Size"]))
-                parts[part_number - 1] = {k: part[k]
-                                          for k in ('PartNumber', 'ETag')}
-            else:
-                part = await s3.upload_part(
-                    # We could include `ContentMD5='hash'` to discover if
-                    # data has been corrupted upon transfer
-                    Body=data,
-                    Bucket=self.bucket,
-                    Key=self.key,
-                    UploadId=mpu_id,
-                    PartNumber=part_number,
-                )
-                logging.info(
-                    f"""{uploaded_bytes} of {self.total_bytes} bytes \
-                uploaded {await self.as_percent(uploaded_bytes,
-                                                self.total_bytes)}%""")
-                parts.append({"PartNumber": part_number, "ETag": part["ETag"]})
-
-            # Uploading intermediate data to the cache
-
-            key = f"{collection}^{object_name}^{endpoint}"
-            entity = {"mpu_id": mpu_id,
-                      "Etag": part["ETag"],
-                      "part_number": part_number,
-                      "size": self.total_bytes,
-                      "uploaded": uploaded_bytes,
-                      "last_modified": str(datetime.utcnow()),
-                      "status": status_}
-            await cache.put_to_cache_by_key(key, entity)
-            logging.info(f"Uploading intermediate data to storage for object: "
-                         f"'{object_name}' with mpu_id: '{mpu_id}', "
-                         f"part_number: '{part_number}, "
-                         f"status: '{status_}'")
 
-            part_number += 1
-
-        return parts
+        async def finish_parts(return_when) -> None:
+            nonlocal in_flight_bytes, uploaded_bytes
+            done, _ = await asyncio.wait(pending, return_when=return_when)
+            for task in done:
+                part_number, size = pending.pop(task)
+                in_flight_bytes -= size * buffered
+                etags[part_number] = task.result()
+                uploaded_bytes += size
+                # Size of chunked request body is unknown until it ends
+                if self.total_bytes:
+                    percent = await self.as_percent(uploaded_bytes,
+                                                    self.total_bytes)
+                    logging.debug(f"{uploaded_bytes} of {self.total_bytes} "
+                                  f"bytes uploaded {percent}%")
+                else:
+                    logging.debug(f"{uploaded_bytes} bytes uploaded")
+
+                # Uploading intermediate data to the cache
+                entity = {"mpu_id": mpu_id,
+                          "Etag": etags[part_number],
+                          "part_number": part_number,
+                          "part_size": self.part_bytes,
+                          "uploaded": uploaded_bytes,
+                          "last_modified": str(datetime.utcnow()),
+                          "status": status_}
+                if self.total_bytes:
+                    entity["size"] = self.total_bytes
+                progress.update(key, entity)
+                logging.debug(f"Uploading intermediate data to storage for "
+                              f"object: '{object_name}' with mpu_id: "
+                              f"'{mpu_id}', part_number: '{part_number}, "
+                              f"status: '{status_}'")
+
+        progress = ProgressCheckpointer(cache,
+                                        upload_settings.progress_interval,
+                                        upload_settings.progress_parts)
+        async with progress:
+            try:
+                async for part_number, size, data in source:
+                    uploaded = uploaded_parts.get(part_number)
+                    if uploaded:
+                        # Already uploaded, go to the next one
+                        if size != uploaded["Size"]:
+                            raise Exception("Size mismatch: local " + str(
+                                size) + ", remote: " + str(uploaded["Size"]))
+                        etags[part_number] = uploaded["ETag"]
+                        uploaded_bytes += size
+                        continue
+
+                    # Wait for a free slot. One part is always allowed, even
+                    # if it's bigger than the memory budget
+                    while pending and (
+                            len(pending) >= upload_settings.max_in_flight or
+                            in_flight_bytes + size * buffered >
+                            upload_settings.memory_budget):
+                        await finish_parts(asyncio.FIRST_COMPLETED)
+
+                    task = asyncio.create_task(self._measure_part(
+                        link, size, send_part(s3, mpu_id, part_number, data)))
+                    pending[task] = (part_number, size)
+                    in_flight_bytes += size * buffered
+
+                while pending:
+                    await finish_parts(asyncio.FIRST_COMPLETED)
+            except BaseException:
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+                raise
+            finally:
+                await source.aclose()
+
+        return [{"PartNumber": number, "ETag": etags[number]}
+                for number in sorted(etags)]
 
     async def complete(self, s3, mpu_id, parts):
         result = await s3.complete_multipart_upload(
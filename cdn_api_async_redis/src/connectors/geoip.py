@@ -0,0 +1,197 @@
+import asyncio
+import csv
+import logging
+from bisect import bisect_right
+from ipaddress import ip_address, ip_network
+
+from aiohttp import ClientError, ClientSession, ClientTimeout
+
+from core.config import geoip_settings, settings
+from connectors.abstract import AbstractGeoResolver
+from helpers.cache import MISSING, TTLCache
+
+Coordinates = tuple[float, float]
+
+
+class GeoLookupError(Exception):
+    """
+    Resolver couldn't answer now (network error, timeout, rate limit), the
+    address may be found later
+    """
+
+
+class LocalGeoResolver(AbstractGeoResolver):
+    """
+    Offline resolver. Loads CSV file with CIDR ranges into sorted arrays and
+    finds the range with binary search. File must have `network`, `latitude`
+    and `longitude` columns, so MaxMind GeoLite2 City blocks files can be used
+    as is.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        # IP version -> (range starts, range ends, coordinates)
+        self._tables: dict[int, tuple[list[int], list[int],
+                                      list[Coordinates]]] = {}
+
+    def _read(self) -> dict[int, tuple[list[int], list[int],
+                                       list[Coordinates]]]:
+        rows: dict[int, list[tuple[int, int, Coordinates]]] = {4: [], 6: []}
+        with open(self.file_path, newline='') as file:
+            for row in csv.DictReader(file):
+                try:
+                    network = ip_network(row['network'], strict=False)
+                    coordinates = (float(row['latitude']),
+                                   float(row['longitude']))
+                except (KeyError, ValueError):
+                    # GeoLite2 has networks without coordinates
+                    continue
+                rows[network.version].append(
+                    (int(network.network_address),
+                     int(network.broadcast_address),
+                     coordinates))
+
+        tables = {}
+        for version, ranges in rows.items():
+            ranges.sort()
+            tables[version] = ([r[0] for r in ranges],
+                               [r[1] for r in ranges],
+                               [r[2] for r in ranges])
+        return tables
+
+    async def load(self) -> None:
+        self._tables = await asyncio.to_thread(self._read)
+        logging.info(f"Loaded {sum(len(t[0]) for t in self._tables.values())}"
+                     f" networks from '{self.file_path}'")
+
+    async def resolve(self, ip: str) -> Coordinates | None:
+        try:
+            address = ip_address(ip)
+        except ValueError:
+            logging.error(f"'{ip}' is not a valid IP address")
+            return None
+        starts, ends, coordinates = self._tables.get(address.version,
+                                                     ([], [], []))
+        value = int(address)
+        i = bisect_right(starts, value) - 1
+        if i >= 0 and value <= ends[i]:
+            return coordinates[i]
+        return None
+
+    async def close(self):
+        ...
+
+
+class IpapiGeoResolver(AbstractGeoResolver):
+    """
+    Remote resolver using https://ipapi.co. One HTTP session is reused
+    for all requests. Raises GeoLookupError when ipapi.co isn't available.
+    """
+
+    def __init__(self, key: str = '', timeout: float = 2):
+        self.key = key
+        self.timeout = ClientTimeout(total=timeout)
+        self._session: ClientSession | None = None
+
+    async def resolve(self, ip: str) -> Coordinates | None:
+        if self._session is None or self._session.closed:
+            self._session = ClientSession(timeout=self.timeout)
+        if self.key:
+            url_ip_location = f"https://ipapi.co/{ip}/json/?key={self.key}"
+        else:
+            url_ip_location = f"https://ipapi.co/{ip}/json/"
+        try:
+            async with self._session.get(url_ip_location) as response:
+                if response.status == 429 or response.status >= 500:
+                    raise GeoLookupError(f"ipapi.co answered "
+                                         f"{response.status} for '{ip}'")
+                res = await response.json()
+                return float(res['latitude']), float(res['longitude'])
+        except (KeyError, TypeError, ValueError):
+            logging.error(f"'{ip}' not found in the database.")
+        except (ClientError, asyncio.TimeoutError) as err:
+            raise GeoLookupError(repr(err)) from err
+        return None
+
+    async def close(self):
+        if self._session:
+            await self._session.close()
+
+
+class CachedGeoResolver(AbstractGeoResolver):
+    """
+    Bounded LRU cache with time to live in front of another resolver.
+    Unknown addresses are cached too, so they don't hit the backend again.
+    Failed lookups are cached only for `error_ttl` seconds, so a short
+    outage of the backend doesn't send clients to origin for `ttl`.
+    """
+
+    def __init__(self, resolver: AbstractGeoResolver, maxsize: int,
+                 ttl: float, error_ttl: float = 30):
+        self.resolver = resolver
+        self.error_ttl = error_ttl
+        self.cache = TTLCache(maxsize, ttl)
+
+    async def resolve(self, ip: str) -> Coordinates | None:
+        coordinates = self.cache.get(ip)
+        if coordinates is MISSING:
+            try:
+                coordinates = await self.resolver.resolve(ip)
+            except GeoLookupError as e:
+                logging.error(f"Location of '{ip}' isn't resolved: {e}")
+                self.cache.set(ip, None, self.error_ttl)
+                return None
+            self.cache.set(ip, coordinates)
+        return coordinates
+
+    async def close(self):
+        await self.resolver.close()
+
+
+class ChainGeoResolver(AbstractGeoResolver):
+    """
+    Asks resolvers one by one until one of them knows the address
+    """
+
+    def __init__(self, *resolvers: AbstractGeoResolver):
+        self.resolvers = resolvers
+
+    async def resolve(self, ip: str) -> Coordinates | None:
+        for resolver in self.resolvers:
+            coordinates = await resolver.resolve(ip)
+            if coordinates:
+                return coordinates
+        return None
+
+    async def close(self):
+        for resolver in self.resolvers:
+            await resolver.close()
+
+
+async def create_geo_resolver() -> AbstractGeoResolver:
+    """
+    Build resolver according to settings: local database first (if it's
+    configured), then cached ipapi.co (if it's enabled).
+    """
+    resolvers: list[AbstractGeoResolver] = []
+    if geoip_settings.database:
+        local = LocalGeoResolver(geoip_settings.database)
+        await local.load()
+        resolvers.append(local)
+    if geoip_settings.use_ipapi:
+        resolvers.append(
+            CachedGeoResolver(IpapiGeoResolver(settings.ipapi_key,
+                                               geoip_settings.ipapi_timeout),
+                              geoip_settings.cache_size,
+                              geoip_settings.cache_ttl,
+                              geoip_settings.error_ttl))
+    return ChainGeoResolver(*resolvers)
+
+
+geo_resolver: AbstractGeoResolver | None = None
+
+
+async def get_geo_resolver() -> AbstractGeoResolver:
+    # Set on the application start up
+    assert geo_resolver is not None
+    return geo_resolver
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from datetime import timedelta
 
@@ -6,13 +7,25 @@ from aiohttp import ClientResponse
 from fastapi import HTTPException, status
 from miniopy_async.datatypes import Object
 from miniopy_async import Minio, S3Error
+from miniopy_async.commonconfig import CopySource
 
+from core.config import settings
 from connectors.abstract import AbstractS3
+from models.model import ObjectMeta
+from services.backoff import backoff, endpoint_of
+
+# Errors of unavailable node, request is retried
+S3_ERRORS = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
 
 
 class MinioS3(AbstractS3):
-    def __init__(self, endpoint: str, *args, **kwargs):
+    def __init__(self,
+                 endpoint: str,
+                 session: aiohttp.ClientSession | None = None,
+                 *args, **kwargs):
         self.endpoint = endpoint
+        # Shared HTTP session with keep-alive connections
+        self.session = session
         self.client = Minio(endpoint=self.endpoint,
                             *args,
                             **kwargs)
@@ -23,7 +36,8 @@ class MinioS3(AbstractS3):
                 "GET",
                 bucket_name=bucket_name,
                 object_name=object_name,
-                expires=timedelta(hours=1))
+                expires=timedelta(
+                    seconds=settings.presigned_url_expire_in_seconds))
             logging.info(f'{url}')
             return url
         except S3Error as exc:
@@ -32,12 +46,14 @@ class MinioS3(AbstractS3):
             logging.error(f"Minio.get_presigned_url() called with bad params: "
                           f"{kwargs}")
 
+    @backoff(service=endpoint_of, exceptions=S3_ERRORS)
     async def bucket_exists(self, bucket_name: str) -> bool:
         try:
             return await self.client.bucket_exists(bucket_name)
         except S3Error as exc:
             logging.error(f"{exc}")
 
+    @backoff(service=endpoint_of, exceptions=S3_ERRORS)
     async def get_object(self,
                          bucket_name: str,
                          object_name: str,
@@ -47,20 +63,56 @@ class MinioS3(AbstractS3):
                          *args,
                          **kwargs) -> bool | ClientResponse:
         try:
-            async with aiohttp.ClientSession() as session:
+            if self.session:
                 response = await self.client.get_object(
                     bucket_name,
                     object_name,
-                    session,
+                    self.session,
                     offset,
                     length)
-                logging.info(f"Found '{object_name}' in bucket "
-                             f"'{bucket_name}' in S3 '{self.endpoint}'")
+            else:
+                async with aiohttp.ClientSession() as session:
+                    response = await self.client.get_object(
+                        bucket_name,
+                        object_name,
+                        session,
+                        offset,
+                        length)
+            logging.info(f"Found '{object_name}' in bucket "
+                         f"'{bucket_name}' in S3 '{self.endpoint}'")
             return response
         except S3Error as e:
             logging.info(e)
             return False
 
+    @backoff(service=endpoint_of, exceptions=S3_ERRORS)
+    async def head_object(self,
+                          bucket_name: str,
+                          object_name: str) -> ObjectMeta | None:
+        # Minio.stat_object opens a new HTTP session for every call, so
+        # presigned HEAD request is sent through the shared session instead
+        url = await self.client.get_presigned_url(
+            "HEAD",
+            bucket_name=bucket_name,
+            object_name=object_name,
+            expires=timedelta(minutes=1))
+        if self.session:
+            response = await self.session.head(url)
+        else:
+            async with aiohttp.ClientSession() as session:
+                response = await session.head(url)
+        response.release()
+        if response.status == status.HTTP_404_NOT_FOUND:
+            return None
+        if response.status != status.HTTP_200_OK:
+            logging.error(f"HEAD '{object_name}' in S3 '{self.endpoint}' "
+                          f"returned {response.status}")
+            return None
+        return ObjectMeta(
+            size=int(response.headers.get('Content-Length', 0)),
+            etag=response.headers.get('ETag', '').strip('"'),
+            content_type=response.headers.get('Content-Type'))
+
     async def stat_object(self,
                           bucket_name: str,
                           object_name: str
@@ -74,13 +126,31 @@ class MinioS3(AbstractS3):
                 headers={"WWW-Authenticate": "Bearer"},
             )
 
-    async def copy_object(self, source: str, destination: str) -> None:
-        pass
+    @backoff(service=endpoint_of, exceptions=S3_ERRORS)
+    async def copy_object(self,
+                          bucket_name: str,
+                          object_name: str,
+                          source_bucket: str,
+                          source_object: str) -> bool:
+        try:
+            await self.client.copy_object(bucket_name,
+                                          object_name,
+                                          CopySource(source_bucket,
+                                                     source_object))
+            logging.info(f"Copied '{source_object}' from bucket "
+                         f"'{source_bucket}' to bucket '{bucket_name}' in "
+                         f"S3 '{self.endpoint}'")
+            return True
+        except (S3Error, ValueError) as e:
+            # ValueError is raised for objects bigger than 5 GiB
+            logging.error(e)
+            return False
 
     async def fget_object(self, bucket_name: str, object_name: str,
                           file_name) -> bool:
         pass
 
+    @backoff(service=endpoint_of, exceptions=S3_ERRORS)
     async def remove_object(self, bucket_name: str, object_name: str):
         try:
             response = await self.client.remove_object(
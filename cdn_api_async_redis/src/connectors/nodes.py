@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import os
+from dataclasses import dataclass, field
+from json import JSONDecodeError, loads
+
+from aiofiles import open
+
+from core.config import settings
+from helpers.geo import NearestNodeIndex
+from models.model import Node
+
+
+@dataclass(frozen=True)
+class NodesSnapshot:
+    """
+    Immutable view of the node topology. A new snapshot with a bigger version
+    is created every time the configuration file changes.
+    """
+    version: int
+    nodes: dict[str, Node] = field(default_factory=dict)
+    mtime_ns: int = 0
+    index: NearestNodeIndex | None = None
+
+
+async def read_nodes(file_path: str) -> dict[str, Node]:
+    """
+    Get origin and all active edge locations (is_active = True)
+    :param file_path: Edge and origin configuration
+    :return: Collection of {node name: Node}
+    """
+    try:
+        async with open(file_path, "r") as file:
+            j = loads(await file.read())
+            return {k: Node(**(v | {'bucket': v.get('bucket') or
+                                    settings.bucket_name}))
+                    for k, v in j.items()
+                    if v['is_active'] == "True"}
+
+    except FileNotFoundError:
+        logging.error('File with nodes doesn\'t exist!!!')
+        raise FileNotFoundError
+
+
+class NodeRegistry:
+    """
+    Process-wide registry of origin and edge nodes.
+    Configuration file is parsed once and kept in memory. Background task
+    polls file mtime and atomically swaps the snapshot when the file changes,
+    so readers never touch the disk.
+    """
+
+    def __init__(self,
+                 file_path: str,
+                 reload_interval: float = 5,
+                 index_cell_size: float = 1.0):
+        self.file_path = file_path
+        self.reload_interval = reload_interval
+        self.index_cell_size = index_cell_size
+        self._snapshot = NodesSnapshot(version=0)
+        self._watcher: asyncio.Task | None = None
+        # mtime of the last file version that failed to load
+        self._broken_mtime_ns: int | None = None
+
+    @property
+    def snapshot(self) -> NodesSnapshot:
+        return self._snapshot
+
+    @property
+    def nodes(self) -> dict[str, Node]:
+        return self._snapshot.nodes
+
+    async def load(self) -> NodesSnapshot:
+        """
+        Read configuration file and publish a new snapshot
+        :return: New snapshot
+        """
+        try:
+            mtime_ns = os.stat(self.file_path).st_mtime_ns
+        except FileNotFoundError:
+            logging.error('File with nodes doesn\'t exist!!!')
+            raise
+        nodes = await read_nodes(self.file_path)
+        self._snapshot = NodesSnapshot(version=self._snapshot.version + 1,
+                                       nodes=nodes,
+                                       mtime_ns=mtime_ns,
+                                       index=NearestNodeIndex(
+                                           nodes, self.index_cell_size))
+        logging.info(f"Loaded nodes {list(nodes)} from '{self.file_path}', "
+                     f"version {self._snapshot.version}")
+        return self._snapshot
+
+    async def reload_if_changed(self) -> bool:
+        """
+        Reload configuration if file was modified. Broken file doesn't
+        replace the current snapshot.
+        :return: True if a new snapshot was published
+        """
+        mtime_ns = None
+        try:
+            mtime_ns = os.stat(self.file_path).st_mtime_ns
+            if mtime_ns in (self._snapshot.mtime_ns, self._broken_mtime_ns):
+                return False
+            await self.load()
+            return True
+        except (FileNotFoundError, JSONDecodeError, KeyError, TypeError,
+                IOError) as e:
+            self._broken_mtime_ns = mtime_ns
+            logging.error(f"Can't reload nodes from '{self.file_path}': {e}")
+            return False
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            await self.reload_if_changed()
+
+    async def start(self) -> None:
+        await self.load()
+        self._watcher = asyncio.create_task(self._watch())
+
+    async def close(self) -> None:
+        if self._watcher:
+            self._watcher.cancel()
+            self._watcher = None
+
+
+node_registry: NodeRegistry | None = None
+
+
+async def get_node_registry() -> NodeRegistry:
+    # Set on the application start up
+    assert node_registry is not None
+    return node_registry
@@ -0,0 +1,120 @@
+import asyncio
+from contextlib import AsyncExitStack
+from typing import Any
+
+import aiohttp
+from aioboto3 import Session
+from aiobotocore.config import AioConfig
+
+from connectors.minio_s3 import MinioS3
+from models.model import Node
+
+
+class S3Pool:
+    """
+    Long-lived S3 clients keyed by node. Clients keep HTTP connections
+    alive between requests, so probes and uploads don't pay for TCP/TLS
+    handshakes. Created on the application start up and closed on shutdown.
+    Clients are keyed by endpoint and credentials, not by the node: nodes
+    file reload creates new nodes, they get the clients of the old ones and
+    only changed credentials get a new client.
+    """
+
+    def __init__(self,
+                 max_connections: int = 100,
+                 max_connections_per_host: int = 20,
+                 keepalive_timeout: float = 60,
+                 region: str | None = None,
+                 connect_timeout: float = 2,
+                 read_timeout: float = 30):
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.keepalive_timeout = keepalive_timeout
+        # Unavailable node fails fast instead of holding the request
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.region = region or None
+        self.session: aiohttp.ClientSession | None = None
+        self._aws_session = Session()
+        self._exit_stack = AsyncExitStack()
+        self._lock = asyncio.Lock()
+        self._minio: dict[tuple[str, str, str], MinioS3] = {}
+        self._aws: dict[tuple[str, str, str], Any] = {}
+
+    async def start(self) -> None:
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections,
+            limit_per_host=self.max_connections_per_host,
+            keepalive_timeout=self.keepalive_timeout)
+        timeout = aiohttp.ClientTimeout(total=None,
+                                        connect=self.connect_timeout,
+                                        sock_read=self.read_timeout)
+        self.session = aiohttp.ClientSession(connector=connector,
+                                             timeout=timeout)
+
+    @staticmethod
+    def _key(node: Node) -> tuple[str, str, str]:
+        return node.endpoint, node.access_key_id, node.secret_access_key
+
+    def minio(self, node: Node) -> MinioS3:
+        """
+        Get Minio client of the node. It caches bucket region and sends
+        requests through the shared HTTP session.
+        """
+        key = self._key(node)
+        client = self._minio.get(key)
+        if client is None:
+            client = self._minio[key] = MinioS3(
+                endpoint=node.endpoint,
+                session=self.session,
+                access_key=node.access_key_id,
+                secret_key=node.secret_access_key,
+                secure=False,
+                region=self.region)
+        return client
+
+    async def aws(self, node: Node) -> Any:
+        """
+        Get opened aioboto3 S3 client of the node. Client must not be closed
+        by the caller.
+        """
+        key = self._key(node)
+        client = self._aws.get(key)
+        if client is not None:
+            return client
+        async with self._lock:
+            client = self._aws.get(key)
+            if client is None:
+                config = AioConfig(
+                    max_pool_connections=self.max_connections_per_host,
+                    connect_timeout=self.connect_timeout,
+                    read_timeout=self.read_timeout,
+                    connector_args={
+                        'keepalive_timeout': self.keepalive_timeout})
+                client = await self._exit_stack.enter_async_context(
+                    self._aws_session.client(
+                        's3',
+                        endpoint_url='http://' + node.endpoint,
+                        aws_access_key_id=node.access_key_id,
+                        aws_secret_access_key=node.secret_access_key,
+                        region_name=self.region,
+                        verify=False,
+                        config=config))
+                self._aws[key] = client
+        return client
+
+    async def close(self) -> None:
+        await self._exit_stack.aclose()
+        self._aws.clear()
+        self._minio.clear()
+        if self.session:
+            await self.session.close()
+
+
+s3_pool: S3Pool | None = None
+
+
+async def get_s3_pool() -> S3Pool:
+    # Set on the application start up
+    assert s3_pool is not None
+    return s3_pool
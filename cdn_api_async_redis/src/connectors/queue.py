@@ -0,0 +1,229 @@
+import asyncio
+import itertools
+import logging
+import os
+import socket
+from time import monotonic
+
+import orjson
+from redis.asyncio import Redis as AsyncRedis
+from redis.exceptions import ResponseError
+
+from core.config import replication_settings, resilience_settings, \
+    settings
+from connectors.abstract import AbstractQueue
+from models.model import QueueItem
+from services.backoff import backoff
+
+
+class RedisStreamQueue(AbstractQueue):
+    """
+    Durable queue in Redis Streams `{name}:high` and `{name}:low` read by
+    the consumer group. Task stays pending until it's acknowledged, the
+    consumer touches tasks it's processing, so tasks of a crashed consumer
+    are claimed by another one after `claim_idle` seconds. Failed tasks are
+    added again up to `max_attempts` times, then they are moved to
+    `{name}:dead`.
+    """
+
+    def __init__(self,
+                 name: str = 'replication',
+                 group: str = 'replicators',
+                 consumer: str = 'consumer',
+                 claim_idle: float = 300,
+                 max_attempts: int = 3,
+                 poll: float = 5,
+                 **params):
+        self.streams = {True: f"{name}:high", False: f"{name}:low"}
+        self.dead = f"{name}:dead"
+        self.group = group
+        self.consumer = consumer
+        self.claim_idle = claim_idle
+        self.max_attempts = max_attempts
+        # Reads block up to `poll` seconds, socket waits longer than that
+        self.poll = poll
+        params['socket_timeout'] = (params.get('socket_timeout') or 0) + poll
+        self.session = AsyncRedis(**params)
+        self._claimed_at = float('-inf')
+
+    @backoff(service='Redis')
+    async def start(self) -> None:
+        for stream in self.streams.values():
+            try:
+                await self.session.xgroup_create(stream, self.group, id='0',
+                                                 mkstream=True)
+            except ResponseError as e:
+                if 'BUSYGROUP' not in str(e):
+                    raise
+
+    async def close(self) -> None:
+        await self.session.close()
+
+    def _item(self, stream: str, message_id, fields: dict) -> QueueItem:
+        return QueueItem(id=str(message_id, 'utf-8'),
+                         task=orjson.loads(fields[b'task']),
+                         priority=stream == self.streams[True],
+                         attempts=int(fields.get(b'attempts', 0)))
+
+    @backoff(service='Redis')
+    async def put(self, task: dict, priority: bool = False) -> None:
+        await self.session.xadd(self.streams[priority],
+                                {'task': orjson.dumps(task), 'attempts': 0})
+
+    async def _claim(self, count: int) -> list[QueueItem]:
+        items = []
+        for stream in self.streams.values():
+            res = await self.session.xautoclaim(
+                stream, self.group, self.consumer,
+                min_idle_time=int(self.claim_idle * 1000),
+                start_id='0-0',
+                count=count)
+            for message_id, fields in res[1]:
+                if not fields:
+                    continue
+                item = self._item(stream, message_id, fields)
+                # Consumer crashed, it was an attempt too
+                item.attempts += 1
+                logging.warning(f"Task '{item.id}' is claimed from a "
+                                f"stopped consumer")
+                if item.attempts >= self.max_attempts:
+                    await self.retry(item)
+                else:
+                    items.append(item)
+        return items
+
+    @backoff(service='Redis')
+    async def get(self, count: int, timeout: float) -> list[QueueItem]:
+        if monotonic() - self._claimed_at >= self.claim_idle / 2:
+            self._claimed_at = monotonic()
+            if items := await self._claim(count):
+                return items
+        res = await self.session.xreadgroup(
+            self.group, self.consumer, {self.streams[True]: '>'},
+            count=count)
+        if not res:
+            res = await self.session.xreadgroup(
+                self.group, self.consumer,
+                {stream: '>' for stream in self.streams.values()},
+                count=count,
+                block=int(min(timeout, self.poll) * 1000))
+        return [self._item(str(stream, 'utf-8'), message_id, fields)
+                for stream, messages in res or ()
+                for message_id, fields in messages]
+
+    @backoff(service='Redis')
+    async def ack(self, item: QueueItem) -> None:
+        stream = self.streams[item.priority]
+        pipe = self.session.pipeline()
+        pipe.xack(stream, self.group, item.id)
+        pipe.xdel(stream, item.id)
+        await pipe.execute()
+
+    @backoff(service='Redis')
+    async def touch(self, item: QueueItem) -> None:
+        # Claiming own message resets its idle time
+        await self.session.xclaim(self.streams[item.priority], self.group,
+                                  self.consumer, min_idle_time=0,
+                                  message_ids=[item.id], justid=True)
+
+    @backoff(service='Redis')
+    async def retry(self, item: QueueItem) -> None:
+        stream = self.streams[item.priority]
+        attempts = item.attempts + 1
+        pipe = self.session.pipeline()
+        if attempts >= self.max_attempts:
+            logging.error(f"Task {item.task} failed {attempts} times, moved "
+                          f"to '{self.dead}'")
+            pipe.xadd(self.dead, {'task': orjson.dumps(item.task),
+                                  'attempts': attempts},
+                      maxlen=10000, approximate=True)
+        else:
+            pipe.xadd(stream, {'task': orjson.dumps(item.task),
+                               'attempts': attempts})
+        pipe.xack(stream, self.group, item.id)
+        pipe.xdel(stream, item.id)
+        await pipe.execute()
+
+    @backoff(service='Redis')
+    async def depth(self) -> int:
+        pipe = self.session.pipeline(transaction=False)
+        for stream in self.streams.values():
+            pipe.xlen(stream)
+        return sum(await pipe.execute())
+
+
+class LocalQueue(AbstractQueue):
+    """
+    Queue in the process memory for a single instance. Tasks are lost on
+    restart, unfinished replications are found again by the scheduler.
+    """
+
+    def __init__(self, max_attempts: int = 3):
+        self.max_attempts = max_attempts
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._ids = itertools.count()
+
+    async def put(self, task: dict, priority: bool = False) -> None:
+        self._put(QueueItem(id=str(next(self._ids)), task=task,
+                            priority=priority))
+
+    def _put(self, item: QueueItem) -> None:
+        self._queue.put_nowait((not item.priority, int(item.id), item))
+
+    async def get(self, count: int, timeout: float) -> list[QueueItem]:
+        try:
+            items = [(await asyncio.wait_for(self._queue.get(), timeout))[2]]
+        except asyncio.TimeoutError:
+            return []
+        while len(items) < count and not self._queue.empty():
+            items.append(self._queue.get_nowait()[2])
+        return items
+
+    async def ack(self, item: QueueItem) -> None:
+        ...
+
+    async def touch(self, item: QueueItem) -> None:
+        ...
+
+    async def retry(self, item: QueueItem) -> None:
+        item.attempts += 1
+        if item.attempts >= self.max_attempts:
+            logging.error(f"Task {item.task} failed {item.attempts} times, "
+                          f"dropped")
+            return
+        item.id = str(next(self._ids))
+        self._put(item)
+
+    async def depth(self) -> int:
+        return self._queue.qsize()
+
+    async def close(self) -> None:
+        ...
+
+
+async def create_replication_queue() -> AbstractQueue:
+    """
+    Build replication queue according to settings
+    """
+    if replication_settings.queue == 'local':
+        return LocalQueue(replication_settings.max_attempts)
+    queue = RedisStreamQueue(
+        consumer=f"{socket.gethostname()}:{os.getpid()}",
+        claim_idle=replication_settings.claim_idle,
+        max_attempts=replication_settings.max_attempts,
+        host=settings.redis_host,
+        port=settings.redis_port,
+        ssl=False,
+        socket_timeout=resilience_settings.redis_timeout,
+        socket_connect_timeout=resilience_settings.redis_timeout)
+    await queue.start()
+    return queue
+
+
+replication_queue: AbstractQueue | None = None
+
+
+async def get_replication_queue() -> AbstractQueue:
+    # Set on the application start up
+    assert replication_queue is not None
+    return replication_queue
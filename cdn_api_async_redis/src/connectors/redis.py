@@ -1,17 +1,60 @@
+from time import time
 from typing import Optional
 
 from redis.asyncio import Redis as AsyncRedis
+from redis.asyncio.connection import Connection
 
 from connectors.abstract import AbstractCache
+from helpers.metrics import count_round_trip
+from services.backoff import backoff
+
+
+# Lock is changed only by the owner of the token
+EXTEND_LOCK = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_LOCK = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+# Sliding window counter: requests of the current window plus the part of
+# the previous window that is still inside the sliding window
+SLIDING_WINDOW = """
+local current = redis.call('incrby', KEYS[1], ARGV[1])
+redis.call('pexpire', KEYS[1], 2 * ARGV[2])
+local previous = tonumber(redis.call('get', KEYS[2]) or '0')
+return tostring(previous * (1 - ARGV[3] / ARGV[2]) + current)
+"""
+
+
+class CountingConnection(Connection):
+    """
+    Connection that counts round trips of the current request. Pipeline is
+    sent with one call, so it's one round trip.
+    """
+
+    async def send_packed_command(self, *args, **kwargs):
+        count_round_trip()
+        return await super().send_packed_command(*args, **kwargs)
 
 
 class Redis(AbstractCache):
     def __init__(self, **params):
         self.session = AsyncRedis(**params)
+        self.session.connection_pool.connection_class = CountingConnection
+        self._extend_lock = self.session.register_script(EXTEND_LOCK)
+        self._release_lock = self.session.register_script(RELEASE_LOCK)
+        self._sliding_window = self.session.register_script(SLIDING_WINDOW)
 
     async def close(self):
         ...
 
+    @backoff(service='Redis')
     async def get_from_cache_by_id(self, _id: str) -> Optional:
         data = await self.session.get(_id)
         if not data:
@@ -19,14 +62,17 @@ class Redis(AbstractCache):
 
         return data
 
+    @backoff(service='Redis')
     async def put_to_cache_by_id(self, _id, entity, expire):
         await self.session.set(_id,
                                entity,
                                expire)
 
+    @backoff(service='Redis')
     async def delete_from_cache_by_id(self, _id):
         await self.session.delete(_id)
 
+    @backoff(service='Redis')
     async def get_from_cache_by_key(self,
                                     key: str = None,
                                     sort: str = None) -> dict | None:
@@ -36,6 +82,7 @@ class Redis(AbstractCache):
 
         return data
 
+    @backoff(service='Redis')
     async def put_to_cache_by_key(self,
                                   key: str = None,
                                   entities: dict = None):
@@ -48,6 +95,53 @@ class Redis(AbstractCache):
     async def get_pipeline(self):
         return self.session.pipeline()
 
+    @backoff(service='Redis')
+    async def get_index_range(self,
+                              index: str,
+                              min_score: float,
+                              max_score: float) -> list:
+        return await self.session.zrangebyscore(index, min_score, max_score)
+
+    @backoff(service='Redis')
+    async def get_many_by_keys(self, keys: list[str]) -> list[dict]:
+        pipe = self.session.pipeline(transaction=False)
+        for key in keys:
+            pipe.hgetall(key)
+        return await pipe.execute()
+
+    @backoff(service='Redis')
+    async def acquire_lock(self, key: str, token: str, ttl: float) -> bool:
+        if await self.session.set(key, token, nx=True, px=int(ttl * 1000)):
+            return True
+        # Retried call may find the lock taken by its first attempt
+        return await self.session.get(key) == token.encode()
+
+    @backoff(service='Redis')
+    async def extend_lock(self, key: str, token: str, ttl: float) -> bool:
+        return bool(await self._extend_lock(keys=[key],
+                                            args=[token, int(ttl * 1000)]))
+
+    @backoff(service='Redis')
+    async def release_lock(self, key: str, token: str) -> bool:
+        return bool(await self._release_lock(keys=[key], args=[token]))
+
+    # Counters aren't idempotent, a retried call would count requests twice
+    @backoff(service='Redis', max_tries=1)
+    async def add_to_windows(self,
+                             counts: dict[str, int],
+                             window: float) -> dict[str, float]:
+        now = time()
+        index = int(now // window)
+        elapsed = now - index * window
+        pipe = self.session.pipeline(transaction=False)
+        for key, count in counts.items():
+            await self._sliding_window(
+                keys=[f"{key}:{index}", f"{key}:{index - 1}"],
+                args=[count, int(window * 1000), int(elapsed * 1000)],
+                client=pipe)
+        return {key: float(estimate) for key, estimate in
+                zip(counts, await pipe.execute())}
+
     async def get_keys_by_pattern(self,
                                   pattern: str = None,):
         data = self.session.scan_iter(pattern)
@@ -1,25 +1,64 @@
 import logging
 from datetime import datetime, timedelta
+from time import monotonic, time
 from typing import Any, Type
 
 from apscheduler.job import Job
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from fastapi import HTTPException
 
-from core.config import cron_settings, settings
-from connectors.abstract import AbstractCache, AbstractS3
+from core.config import cron_settings, edge_cache_settings, \
+    prefetch_settings, replication_settings
+from connectors.abstract import AbstractCache, AbstractQueue, AbstractS3
 from connectors.aws_s3 import AWSS3, S3MultipartUpload
+from connectors.pool import get_s3_pool
+from connectors.queue import get_replication_queue
+from helpers.availability import forget_ranges, get_ranges, head_key, \
+    save_range
 from helpers.exceptions import object_already_uploaded
-from helpers.helper_async import get_mpu_id, get_active_nodes, origin_is_alive
-from models.model import Node, Status
-from services.service import multipart_upload
+from helpers.election import Election
+from helpers.lock import Lease
+from helpers.metrics import EVICTED_BYTES, PREFETCHED_BYTES, SWEEP_SECONDS
+from helpers.helper_async import forget_object_meta, get_upload_plan, \
+    get_active_nodes, head_object, origin_is_alive, same_cluster
+from helpers.progress import backfill_progress_index, delete_progress, \
+    drop_finished_index, get_stale_progress
+from models.model import Node, ObjectMeta, Status
+from services.capacity import decay_hits, forget_replica, get_replicas, \
+    is_limited, record_replica
+from services.prefetch import get_trending, prefetch_candidates, region_of
+from services.redirects import redirect_cache
+from services.service import finish_upload, multipart_upload
 
 scheduler: AsyncIOScheduler | None = AsyncIOScheduler()
+# Chooses the instance that runs the sweeps
+election: Election | None = None
+
+# (object name, edge endpoint) of replications queued by this process and
+# the time until they are considered queued or running
+replications: dict[tuple[str, str], float] = {}
+MAX_REPLICATIONS = 10000
 
 
 async def get_scheduler() -> AsyncIOScheduler:
     return scheduler
 
 
+async def get_election() -> Election | None:
+    return election
+
+
+def owns_node(node: Node) -> bool:
+    # Without election (e.g. single process) all nodes are swept here
+    return election is None or election.owns(node.endpoint)
+
+
+async def backfill_index(cache: AbstractCache) -> None:
+    if election is None or election.is_leader:
+        await backfill_progress_index(cache)
+        await drop_finished_index(cache)
+
+
 async def jobs(scheduler_: AsyncIOScheduler,
                function: Any = None,
                *args,
@@ -55,6 +94,108 @@ async def add_startup_jobs(scheduler_: AsyncIOScheduler,
                trigger='interval',
                minutes=cron_settings.abort_old_tasks['minute'],
                )
+    await jobs(scheduler_,
+               manage_edge_capacity,
+               args=(cache,),
+               trigger='interval',
+               seconds=edge_cache_settings.eviction_interval,
+               )
+    if prefetch_settings.enabled:
+        await jobs(scheduler_,
+                   prefetch_trending_objects,
+                   args=(cache,),
+                   trigger='interval',
+                   seconds=prefetch_settings.interval,
+                   )
+    # Records written before the progress index existed
+    await jobs(scheduler_,
+               backfill_index,
+               args=(cache,),
+               next_run_time=datetime.now(),
+               )
+
+
+def replication_lock_key(object_name: str, edge_node: Node) -> str:
+    # Must not match patterns of the progress records
+    return f"lock:replication:{edge_node.endpoint}:{object_name}"
+
+
+async def schedule_replication(queue: AbstractQueue,
+                               object_name: str,
+                               edge_node: Node,
+                               cache: AbstractCache,
+                               status: str = Status.IN_PROGRESS.value,
+                               priority: bool = True) -> bool:
+    """
+    Queue copying of the object to the edge unless it's already queued or
+    running in the cluster. Replications of this process are checked first,
+    then the lock in the cache. Queued task holds the lock up to
+    `REPLICATION_CLAIM_IDLE` seconds, the worker extends it while it copies.
+    :param priority: Users are waiting for the object
+    :return: True if a new replication was queued
+    """
+    flight = (object_name, edge_node.endpoint)
+    if replications.get(flight, 0) > monotonic():
+        return False
+    if len(replications) >= MAX_REPLICATIONS:
+        for key, until in list(replications.items()):
+            if until <= monotonic():
+                del replications[key]
+    replications[flight] = monotonic() + replication_settings.claim_idle
+    lease = Lease(cache,
+                  replication_lock_key(object_name, edge_node),
+                  replication_settings.claim_idle)
+    try:
+        if not await lease.acquire():
+            logging.info(f"Replication of '{object_name}' to "
+                         f"'{edge_node.endpoint}' is already running")
+            return False
+        try:
+            # Token goes with the task, so the worker holds the same lock
+            await queue.put({"object_name": object_name,
+                             "edge": edge_node.endpoint,
+                             "status": status,
+                             "token": lease.token},
+                            priority)
+        except BaseException:
+            await lease.release()
+            raise
+    except BaseException:
+        replications.pop(flight, None)
+        raise
+    return True
+
+
+async def replicate_to_node(cache: AbstractCache, task: dict) -> None:
+    """
+    Copy object of the queued task to the edge holding the replication lock
+    """
+    object_name = task["object_name"]
+    try:
+        active_nodes = await get_active_nodes()
+        origin_node = await origin_is_alive(active_nodes)
+        edge_node = next((node for node in active_nodes.values()
+                          if node.endpoint == task["edge"]), None)
+        if not edge_node:
+            logging.warning(f"Edge '{task['edge']}' isn't active, "
+                            f"replication of '{object_name}' is dropped")
+            return
+        lease = Lease(cache,
+                      replication_lock_key(object_name, edge_node),
+                      replication_settings.lock_ttl,
+                      task["token"])
+        if not await lease.acquire():
+            logging.info(f"Replication of '{object_name}' to "
+                         f"'{edge_node.endpoint}' is already running")
+            return
+        async with lease:
+            await copy_object_to_node(AWSS3, object_name, origin_node,
+                                      edge_node, cache, task["status"])
+    except HTTPException as e:
+        # Object is already on the edge
+        logging.info(e.detail)
+    finally:
+        replications.pop((object_name, task["edge"]), None)
 
 
 async def copy_object_to_node(client: Type[AbstractS3],
@@ -67,127 +208,363 @@ async def copy_object_to_node(client: Type[AbstractS3],
     storage_data = (cache, edge_node, object_name, "cdn")
     await object_already_uploaded(*storage_data)
 
+    pool = await get_s3_pool()
     origin_client: AbstractS3 = client(
         endpoint='http://' + origin_node.endpoint,
-        aws_access_key_id=origin_node.access_key_id,
-        aws_secret_access_key=origin_node.secret_access_key,
-        verify=False)
-    async with origin_client.client as s3:
-        obj = await origin_client.get_object(
-            settings.bucket_name,
-            object_name,
-            s3=s3)
+        client=await pool.aws(origin_node))
+    async with origin_client.connect() as s3:
+        meta = await origin_client.head_object(origin_node.bucket,
+                                               object_name)
+        if not meta:
+            logging.error(f"'{object_name}' doesn't exist on "
+                          f"'{origin_client.endpoint}'. Nothing to copy")
+            return
+
+        if is_limited(edge_node):
+            if meta.size > edge_node.capacity_bytes:
+                logging.error(f"'{object_name}' is bigger than capacity of "
+                              f"'{edge_node.endpoint}'. Nothing to copy")
+                return
+            await evict_cold_replicas(cache, edge_node, meta.size)
 
+        # If upload was failed - try to re-upload it with current mpu_id
         endpoint = 'http://' + edge_node.endpoint
-        edge_client_dict = {
-            'endpoint': endpoint,
-            'aws_access_key_id': edge_node.access_key_id,
-            'aws_secret_access_key': edge_node.secret_access_key,
-            'verify': False}
-        total_bytes = int(
-            obj['ContentRange'][obj['ContentRange'].rindex('/') + 1:])
-        edge_client = S3MultipartUpload(settings.bucket_name,
+        mpu_id, part_size = await get_upload_plan(endpoint,
+                                                  object_name,
+                                                  cache,
+                                                  collection="cdn")
+
+        # Nodes of one cluster copy the object without the API in between
+        server_side_copy = same_cluster(origin_node, edge_node)
+        if replication_settings.head_bytes and \
+                meta.size >= replication_settings.head_min_size:
+            try:
+                await copy_head(cache, origin_client, s3, origin_node,
+                                edge_node, object_name, meta, status)
+            except Exception as e:
+                # Edge gets the whole object anyway
+                logging.error(f"Head of '{object_name}' isn't copied to "
+                              f"'{edge_node.endpoint}': {e!r}")
+        edge_client = S3MultipartUpload(edge_node.bucket,
                                         object_name,
-                                        total_bytes=total_bytes,
-                                        content_type=obj['ContentType'],
-                                        **edge_client_dict)
+                                        total_bytes=meta.size,
+                                        content_type=meta.content_type,
+                                        part_size=part_size,
+                                        source_bucket=origin_node.bucket,
+                                        server_side_copy=server_side_copy,
+                                        endpoint=endpoint,
+                                        client=await pool.aws(edge_node))
 
-        # If upload was failed - try to re-upload it with current mpu_id
-        mpu_id = await get_mpu_id(endpoint,
-                                  object_name,
-                                  cache,
-                                  collection="cdn")
+        # Small object is copied with one request
+        if server_side_copy and not mpu_id and \
+                meta.size <= edge_client.part_bytes:
+            logging.info(
+                f"Copying '{object_name}' from '{origin_client.endpoint}' to "
+                f"'{edge_client.endpoint}' on the storage side.")
+            if await edge_client.copy_object(edge_node.bucket,
+                                             object_name,
+                                             origin_node.bucket,
+                                             object_name):
+                await finish_upload(cache, edge_client, "cdn")
+                await record_replica(cache, edge_node, object_name,
+                                     meta.size)
+                return
 
         logging.info(
             f"Uploading '{object_name}' from '{origin_client.endpoint}' to "
-            f"'{edge_client.endpoint}'.")
-        await multipart_upload(cache=cache,
-                               upload_client=edge_client,
-                               origin_client=origin_client,
-                               origin_client_s3=s3,
-                               status=status,
-                               collection="cdn",
-                               mpu_id=mpu_id,
-                               )
+            f"'{edge_client.endpoint}'"
+            f"{' on the storage side' if server_side_copy else ''}.")
+        if await multipart_upload(cache=cache,
+                                  upload_client=edge_client,
+                                  origin_client=origin_client,
+                                  origin_client_s3=s3,
+                                  status=status,
+                                  collection="cdn",
+                                  mpu_id=mpu_id,
+                                  ):
+            await record_replica(cache, edge_node, object_name, meta.size)
+            await drop_head(cache, edge_node, object_name)
+
+
+async def copy_head(cache: AbstractCache,
+                    origin_client: AbstractS3,
+                    origin_client_s3,
+                    origin_node: Node,
+                    edge_node: Node,
+                    object_name: str,
+                    meta: ObjectMeta,
+                    status: str) -> None:
+    """
+    Copy the first `REPLICATION_HEAD_BYTES` of the object to the edge as a
+    separate object and record the range in the availability map, so the
+    edge serves playback start while the whole object is copied
+    """
+    if edge_node.endpoint in await get_ranges(cache, object_name):
+        return
+    pool = await get_s3_pool()
+    key = head_key(object_name)
+    endpoint = 'http://' + edge_node.endpoint
+    mpu_id, part_size = await get_upload_plan(endpoint,
+                                              key,
+                                              cache,
+                                              collection="head")
+    size = min(replication_settings.head_bytes, meta.size)
+    head_client = S3MultipartUpload(edge_node.bucket,
+                                    key,
+                                    total_bytes=size,
+                                    content_type=meta.content_type,
+                                    part_size=part_size,
+                                    source_bucket=origin_node.bucket,
+                                    server_side_copy=same_cluster(
+                                        origin_node, edge_node),
+                                    source_key=object_name,
+                                    endpoint=endpoint,
+                                    client=await pool.aws(edge_node))
+    logging.info(f"Copying head of '{object_name}' to "
+                 f"'{head_client.endpoint}'.")
+    if await multipart_upload(cache=cache,
+                              upload_client=head_client,
+                              origin_client=origin_client,
+                              origin_client_s3=origin_client_s3,
+                              status=status,
+                              collection="head",
+                              mpu_id=mpu_id,
+                              ):
+        await save_range(cache, object_name, edge_node, size - 1)
+
+
+async def drop_head(cache: AbstractCache,
+                    node: Node,
+                    object_name: str) -> None:
+    """
+    Remove the head of the object from the node when the whole object is
+    there or deleted
+    """
+    if node.endpoint not in await get_ranges(cache, object_name):
+        return
+    # Requests stop going to the head before it's removed
+    await forget_ranges(cache, object_name, node)
+    key = head_key(object_name)
+    pool = await get_s3_pool()
+    await pool.minio(node).remove_object(node.bucket, key)
+    await delete_progress(cache, f"head^{key}^http://{node.endpoint}")
+
+
+async def evict_replica(cache: AbstractCache,
+                        node: Node,
+                        object_name: str) -> bool:
+    """
+    Remove the replica from the edge with its progress records and cached
+    redirects. Replica that is being copied isn't touched.
+    :return: True if the replica was removed
+    """
+    lease = Lease(cache,
+                  replication_lock_key(object_name, node),
+                  replication_settings.lock_ttl)
+    if not await lease.acquire():
+        return False
+    async with lease:
+        pool = await get_s3_pool()
+        await pool.minio(node).remove_object(node.bucket, object_name)
+        endpoint = 'http://' + node.endpoint
+        await delete_progress(cache,
+                              f"api^{object_name}^{endpoint}",
+                              f"cdn^{object_name}^{endpoint}")
+        await forget_replica(cache, node, object_name)
+        active_nodes = await get_active_nodes()
+        await forget_object_meta(object_name, active_nodes.values())
+        await redirect_cache.invalidate(cache,
+                                        object_name,
+                                        active_nodes.values())
+    return True
+
+
+async def evict_cold_replicas(cache: AbstractCache,
+                              node: Node,
+                              need: int = 0) -> int:
+    """
+    Evict replicas from the edge if it's fuller than the high watermark
+    until it's not fuller than the low one
+    :param need: Bytes of the object that is going to be copied to the edge
+    :return: Evicted bytes
+    """
+    if not is_limited(node):
+        return 0
+    sizes, candidates = await get_replicas(cache, node)
+    used = sum(sizes.values()) + need
+    if used <= node.capacity_bytes * edge_cache_settings.high_watermark:
+        return 0
+    target = node.capacity_bytes * edge_cache_settings.low_watermark
+    evicted = 0
+    for object_name in candidates:
+        if used - evicted <= target:
+            break
+        if await evict_replica(cache, node, object_name):
+            logging.info(f"Evicted '{object_name}' from '{node.endpoint}'")
+            evicted += sizes[object_name]
+    EVICTED_BYTES.inc(node.endpoint, value=evicted)
+    if used - evicted > node.capacity_bytes:
+        # Recently requested replicas are kept anyway
+        logging.warning(f"'{node.endpoint}' stays over capacity, no cold "
+                        f"replicas left")
+    return evicted
+
+
+async def manage_edge_capacity(cache: AbstractCache) -> None:
+    with SWEEP_SECONDS.time('manage_edge_capacity'):
+        active_nodes = await get_active_nodes()
+        for node in active_nodes.values():
+            if not is_limited(node) or not owns_node(node):
+                continue
+            try:
+                await evict_cold_replicas(cache, node)
+                await decay_hits(cache, node)
+            except Exception as e:
+                logging.error(f"Can't evict replicas from "
+                              f"'{node.endpoint}': {e!r}")
 
 
 async def finish_in_progress_tasks(client: Type[AWSS3],
                                    cache: AbstractCache, ) -> None:
-    key_pattern = "cdn^*^"
-    await process_unfinished_tasks(cache,
-                                   client,
-                                   key_pattern,
-                                   finish=True)
+    with SWEEP_SECONDS.time('finish_in_progress_tasks'):
+        await process_unfinished_tasks(cache,
+                                       client,
+                                       finish=True)
 
 
 async def abort_old_tasks(client: Type[S3MultipartUpload],
                           cache: AbstractCache, ):
-    key_pattern = "*^*^"
-    await process_unfinished_tasks(cache,
-                                   client,
-                                   key_pattern,
-                                   finish=False)
+    with SWEEP_SECONDS.time('abort_old_tasks'):
+        await process_unfinished_tasks(cache,
+                                       client,
+                                       finish=False)
 
 
 async def process_unfinished_tasks(cache: AbstractCache,
                                    client: Type[AWSS3],
-                                   key_pattern: str,
                                    finish: bool = True) -> None:
     """
     Process tasks that are not in "finished" (in process) state. Task can be
-    finished or aborted.
+    finished or aborted. Tasks are read from the progress index of every
+    node, so only unfinished records are loaded.
     :param cache: object cache
     :param client: S3 client
-    :param key_pattern: Pattern to search a key in cache
-    :param finish: If True - finish uploading from one node to another,
-    if False - abort uploading
+    :param finish: If True - finish uploading from one node to another
+    (tasks updated during the last 6 hours), if False - abort uploading
+    (tasks not updated for 6 hours)
     :return:
     """
-    time_now = datetime.utcnow() - timedelta(hours=6)
+    border = time() - timedelta(hours=6).total_seconds()
     active_nodes = await get_active_nodes()
-    origin_node = await origin_is_alive(active_nodes)
+    statuses: tuple[str, ...] = (Status.IN_PROGRESS.value,
+                                 Status.SCHEDULER_IN_PROGRESS.value)
+    if not finish:
+        # Failed and never started background uploads keep their multipart
+        # uploads on the node too
+        statuses += (Status.QUEUED.value, Status.FAILED.value)
 
     for node in active_nodes.values():
+        # Node is swept by the leader or by its shard owner
+        if not owns_node(node):
+            continue
         endpoint = 'http://' + node.endpoint
-        key_ = key_pattern + endpoint
-        async for key in await cache.get_keys_by_pattern(key_):
-            if not key:
-                logging.info(
-                    f"No in progress objects for "
-                    f"{endpoint}. Everything is good.")
+        tasks = await get_stale_progress(
+            cache,
+            endpoint,
+            statuses,
+            **({'min_time': border} if finish else {'max_time': border}))
+        if not tasks:
+            logging.info(
+                f"No in progress objects for "
+                f"{endpoint}. Everything is good.")
+        for key, obj in tasks.items():
+            collection, object_name = key[:key.rindex('^')].split('^', 1)
+            if finish:
+                # Only replications are finished, uploads are resumed by
+                # the client
+                if collection != "cdn":
+                    continue
+                await schedule_replication(
+                    await get_replication_queue(),
+                    object_name,
+                    node,
+                    cache,
+                    Status.SCHEDULER_IN_PROGRESS.value,
+                    priority=False)
             else:
-                obj = await cache.get_from_cache_by_key(key)
-                key = str(key, 'utf-8')
-                object_name = key[key.index('^') + 1:key.rindex('^')]
-                last_modified = datetime.strptime(str(obj[b'last_modified'],
-                                                      'utf-8'),
-                                                  '%Y-%m-%d %H:%M:%S.%f')
-                comparing = last_modified > time_now \
-                    if finish \
-                    else last_modified < time_now
-                if str(obj[b'status'], 'utf-8') in (
-                        Status.IN_PROGRESS.value,
-                        Status.SCHEDULER_IN_PROGRESS.value) \
-                        and comparing:
-                    if finish:
-                        await copy_object_to_node(
-                            client,
-                            object_name,
-                            origin_node,
-                            node,
-                            cache,
-                            Status.SCHEDULER_IN_PROGRESS.value)
-                    else:
-                        client_dict = {
-                            'endpoint': endpoint,
-                            'aws_access_key_id': node.access_key_id,
-                            'aws_secret_access_key': node.secret_access_key,
-                            'verify': False}
-                        client = S3MultipartUpload(settings.bucket_name,
-                                                   object_name,
-                                                   **client_dict)
-                        async with client.client as s3:
-                            mpu_id = str(obj[b'mpu_id'], 'utf-8')
-                            await client.abort_multipart_upload(s3,
-                                                                mpu_id)
-                            await cache.delete_from_cache_by_id(key)
+                pool = await get_s3_pool()
+                client = S3MultipartUpload(
+                    node.bucket,
+                    object_name,
+                    endpoint=endpoint,
+                    client=await pool.aws(node))
+                if b'mpu_id' in obj:
+                    async with client.connect() as s3:
+                        mpu_id = str(obj[b'mpu_id'], 'utf-8')
+                        await client.abort_multipart_upload(s3, mpu_id)
+                await delete_progress(cache, key)
+
+
+async def prefetch_to_node(cache: AbstractCache,
+                           origin_node: Node,
+                           edge_node: Node,
+                           object_names: list[str]) -> None:
+    """
+    Queue copies of the objects missing on the edge while the budget of
+    `PREFETCH_BANDWIDTH` bytes per second of the sweep interval lasts
+    :param object_names: Candidates, the most wanted first
+    """
+    if not object_names:
+        return
+    endpoint = 'http://' + edge_node.endpoint
+    # Objects with progress records are copied or being copied
+    records = await cache.get_many_by_keys(
+        [f"cdn^{object_name}^{endpoint}" for object_name in object_names])
+    budget = prefetch_settings.bandwidth * prefetch_settings.interval
+    pool = await get_s3_pool()
+    queue = await get_replication_queue()
+    for object_name, record in zip(object_names, records):
+        if record:
+            continue
+        meta = await head_object(pool,
+                                 origin_node.bucket,
+                                 object_name,
+                                 origin_node)
+        # Smaller objects may still fit into the budget
+        if not meta or meta.size > budget:
+            continue
+        if await schedule_replication(queue,
+                                      object_name,
+                                      edge_node,
+                                      cache,
+                                      priority=False):
+            logging.info(f"Prefetch '{object_name}' to "
+                         f"'{edge_node.endpoint}'")
+            budget -= meta.size
+            PREFETCHED_BYTES.inc(edge_node.endpoint, value=meta.size)
+
+
+async def prefetch_trending_objects(cache: AbstractCache) -> None:
+    """
+    Copy objects trending in the region of every edge, or in several other
+    regions, to the edge before its clients request them
+    """
+    with SWEEP_SECONDS.time('prefetch_trending_objects'):
+        active_nodes = await get_active_nodes()
+        origin_node = await origin_is_alive(active_nodes)
+        edges = [node for node in active_nodes.values()
+                 if node.alias != 'origin' and owns_node(node)]
+        if not edges:
+            return
+        trending = await get_trending(
+            cache, {region_of(node) for node in active_nodes.values()})
+        for node in edges:
+            try:
+                await prefetch_to_node(
+                    cache,
+                    origin_node,
+                    node,
+                    prefetch_candidates(trending, region_of(node)))
+            except Exception as e:
+                logging.error(f"Can't prefetch objects to "
+                              f"'{node.endpoint}': {e!r}")
@@ -24,6 +24,18 @@ class Settings(MainConf):
     redis_host: str = Field(..., env='REDIS_HOST')
     redis_port: int = Field(..., env='REDIS_PORT')
     cache_expire_in_seconds: int = Field(..., env='CACHE_EXPIRE_IN_SECONDS')
+    object_meta_cache_size: int = Field(100000, env='OBJECT_META_CACHE_SIZE')
+    object_meta_cache_ttl: float = Field(5, env='OBJECT_META_CACHE_TTL')
+    presigned_url_expire_in_seconds: int = Field(
+        3600, env='PRESIGNED_URL_EXPIRE_IN_SECONDS')
+    nodes_file: str = Field('./.env.minio.json', env='NODES_FILE')
+    nodes_reload_interval: float = Field(5, env='NODES_RELOAD_INTERVAL')
+    # Size of the nearest node index cell in degrees
+    nodes_index_cell_size: float = Field(1.0, env='NODES_INDEX_CELL_SIZE')
+    # Proxies allowed to pass client IP in X-Real-IP header
+    trusted_proxies: list[str] = Field(
+        ['127.0.0.0/8', '10.0.0.0/8', '172.16.0.0/12', '192.168.0.0/16'],
+        env='TRUSTED_PROXIES')
     # host_auth: str = Field(..., env='HOST_AUTH')
     # port_auth: str = Field(..., env='PORT_AUTH')
 
@@ -35,11 +47,198 @@ class RateLimit(MainConf):
     request_limit_per_minute: int = Field(env="REQUEST_LIMIT_PER_MINUTE",
                                           default=20)
     is_rate_limit: bool = (os.getenv('IS_RATE_LIMIT', 'False') == 'True')
+    window: float = Field(60, env='RATE_LIMIT_WINDOW')
+    # Limits of routes by name of the route function, e.g.
+    # {"object_url": 120, "upload_object": 5}. 0 disables the limit.
+    routes: dict[str, int] = Field({}, env='RATE_LIMIT_ROUTES')
+    # Allowed requests are counted in Redis every `RATE_LIMIT_SYNC_INTERVAL`
+    # seconds or `RATE_LIMIT_SYNC_BATCH` requests of a client
+    sync_interval: float = Field(1, env='RATE_LIMIT_SYNC_INTERVAL')
+    sync_batch: int = Field(10, env='RATE_LIMIT_SYNC_BATCH')
 
 
 rl = RateLimit()
 
 
+class ResilienceSettings(MainConf):
+    # Errors in a row that open circuit of Redis or S3 node
+    failure_threshold: int = Field(5, env='CIRCUIT_FAILURE_THRESHOLD')
+    # Seconds before a trial call to the dependency with open circuit
+    recovery_timeout: float = Field(30, env='CIRCUIT_RECOVERY_TIMEOUT')
+    # Retries per call allowed when reserve of retries is spent
+    retry_budget_ratio: float = Field(0.2, env='RETRY_BUDGET_RATIO')
+    retry_budget_reserve: int = Field(10, env='RETRY_BUDGET_RESERVE')
+    redis_timeout: float = Field(1, env='REDIS_TIMEOUT')
+
+
+resilience_settings = ResilienceSettings()
+
+
+class GeoIPSettings(MainConf):
+    # CSV file with `network`, `latitude`, `longitude` columns
+    database: str = Field('', env='GEOIP_DATABASE')
+    use_ipapi: bool = Field(True, env='GEOIP_USE_IPAPI')
+    ipapi_timeout: float = Field(2, env='GEOIP_IPAPI_TIMEOUT')
+    cache_size: int = Field(65536, env='GEOIP_CACHE_SIZE')
+    cache_ttl: int = Field(3600, env='GEOIP_CACHE_TTL')
+    # Seconds to remember addresses not resolved because of ipapi.co errors
+    error_ttl: int = Field(30, env='GEOIP_ERROR_TTL')
+
+
+geoip_settings = GeoIPSettings()
+
+
+class UploadSettings(MainConf):
+    # Parts uploaded to S3 at the same time
+    max_in_flight: int = Field(4, env='UPLOAD_MAX_IN_FLIGHT')
+    # Max bytes of the parts being uploaded at the same time
+    memory_budget: int = Field(64 * 1024 * 1024, env='UPLOAD_MEMORY_BUDGET')
+    part_retries: int = Field(3, env='UPLOAD_PART_RETRIES')
+    # Part size grows from `UPLOAD_PART_SIZE` up to this value to keep
+    # about `UPLOAD_TARGET_PARTS` parts per object
+    part_max_size: int = Field(512 * 1024 * 1024, env='UPLOAD_PART_MAX_SIZE')
+    target_parts: int = Field(1000, env='UPLOAD_TARGET_PARTS')
+    # Upload progress is saved to the cache every `UPLOAD_PROGRESS_INTERVAL`
+    # seconds or `UPLOAD_PROGRESS_PARTS` parts
+    progress_interval: float = Field(1, env='UPLOAD_PROGRESS_INTERVAL')
+    progress_parts: int = Field(16, env='UPLOAD_PROGRESS_PARTS')
+    # Max presigned part URLs returned by one upload session request
+    session_urls: int = Field(100, env='UPLOAD_SESSION_URLS')
+
+
+upload_settings = UploadSettings()
+
+
+class UploadJobSettings(MainConf):
+    workers: int = Field(2, env='UPLOAD_JOB_WORKERS')
+    # Admission control: jobs and staged bytes per API worker
+    max_jobs: int = Field(16, env='UPLOAD_JOB_MAX_JOBS')
+    max_bytes: int = Field(10 * 1024 ** 3, env='UPLOAD_JOB_MAX_BYTES')
+    # Directory for staged request bodies, system temp directory if empty
+    directory: str = Field('', env='UPLOAD_JOB_DIR')
+
+
+upload_job_settings = UploadJobSettings()
+
+
+class ReplicationSettings(MainConf):
+    # Parts downloaded from origin ahead of the upload to the edge
+    prefetch_parts: int = Field(4, env='REPLICATION_PREFETCH_PARTS')
+    # Lease of the replication lock, it's extended while the copy runs
+    lock_ttl: float = Field(30, env='REPLICATION_LOCK_TTL')
+    # `redis` stream or `local` in-memory queue of a single instance
+    queue: str = Field('redis', env='REPLICATION_QUEUE')
+    # Replications running at the same time in one process and per edge
+    workers: int = Field(4, env='REPLICATION_WORKERS')
+    per_edge: int = Field(2, env='REPLICATION_PER_EDGE')
+    # Run replications in the API workers, otherwise in `worker.py` only
+    in_api: bool = Field(True, env='REPLICATION_IN_API')
+    # Seconds before the task of a stopped worker is taken by another one
+    claim_idle: float = Field(300, env='REPLICATION_CLAIM_IDLE')
+    max_attempts: int = Field(3, env='REPLICATION_MAX_ATTEMPTS')
+    # The first bytes of objects not smaller than `REPLICATION_HEAD_MIN_SIZE`
+    # are copied to the edge first, so it serves playback start before the
+    # whole copy is finished. 0 disables it
+    head_bytes: int = Field(64 * 1024 ** 2, env='REPLICATION_HEAD_BYTES')
+    head_min_size: int = Field(1024 ** 3, env='REPLICATION_HEAD_MIN_SIZE')
+
+
+replication_settings = ReplicationSettings()
+
+
+class S3PoolSettings(MainConf):
+    max_connections: int = Field(100, env='S3_MAX_CONNECTIONS')
+    max_connections_per_host: int = Field(20,
+                                          env='S3_MAX_CONNECTIONS_PER_HOST')
+    keepalive_timeout: float = Field(60, env='S3_KEEPALIVE_TIMEOUT')
+    # Empty region means that it's requested from S3 once per client
+    region: str = Field('', env='S3_REGION')
+    connect_timeout: float = Field(2, env='S3_CONNECT_TIMEOUT')
+    read_timeout: float = Field(30, env='S3_READ_TIMEOUT')
+
+
+pool_settings = S3PoolSettings()
+
+
+class MetricsSettings(MainConf):
+    # Directory shared by worker processes of the instance, empty keeps
+    # metrics of every process apart
+    multiproc_dir: str = Field('', env='METRICS_MULTIPROC_DIR')
+    # Seconds between saves of the process metrics to the directory
+    flush_interval: float = Field(5, env='METRICS_FLUSH_INTERVAL')
+
+
+metrics_settings = MetricsSettings()
+
+
+class RedirectSettings(MainConf):
+    cache_size: int = Field(100000, env='REDIRECT_CACHE_SIZE')
+    # Decisions cached in the worker memory aren't invalidated by other
+    # workers, so keep this TTL short
+    local_ttl: float = Field(10, env='REDIRECT_CACHE_LOCAL_TTL')
+    # Must be less than PRESIGNED_URL_EXPIRE_IN_SECONDS
+    ttl: int = Field(600, env='REDIRECT_CACHE_TTL')
+
+
+redirect_settings = RedirectSettings()
+
+
+class SchedulerSettings(MainConf):
+    # Lease of the scheduler leader, it's extended every third of it
+    leader_ttl: float = Field(15, env='SCHEDULER_LEADER_TTL')
+    # Divide nodes between all instances instead of sweeping on the leader
+    shard: bool = Field(False, env='SCHEDULER_SHARD')
+
+
+scheduler_settings = SchedulerSettings()
+
+
+class EdgeCacheSettings(MainConf):
+    # Eviction order of replicas: `lfu` or `lru`
+    policy: str = Field('lfu', env='EDGE_EVICTION_POLICY')
+    # Seconds between eviction sweeps, hits of replicas are halved on every
+    # sweep
+    eviction_interval: float = Field(300, env='EDGE_EVICTION_INTERVAL')
+    # Replicas are evicted when the edge is fuller than the high watermark
+    # until it's not fuller than the low one (shares of `capacity_bytes`)
+    high_watermark: float = Field(0.95, env='EDGE_EVICTION_HIGH_WATERMARK')
+    low_watermark: float = Field(0.85, env='EDGE_EVICTION_LOW_WATERMARK')
+    # Replicas requested during this number of seconds aren't evicted
+    min_idle: float = Field(3600, env='EDGE_EVICTION_MIN_IDLE')
+    # Requests of replicas are saved to Redis every this number of seconds
+    flush_interval: float = Field(5, env='EDGE_ACCESS_FLUSH_INTERVAL')
+
+
+edge_cache_settings = EdgeCacheSettings()
+
+
+class PrefetchSettings(MainConf):
+    # Copy trending objects to edges before they are requested there
+    enabled: bool = Field(False, env='PREFETCH_ENABLED')
+    # Demand is counted in windows of this number of seconds
+    window: float = Field(600, env='PREFETCH_WINDOW')
+    # Requests of an object in a region during the window to trend there
+    threshold: int = Field(20, env='PREFETCH_THRESHOLD')
+    # Trending objects kept per region
+    top_k: int = Field(100, env='PREFETCH_TOP_K')
+    # Object trending in this number of other regions is copied to all
+    # edges, 0 disables it
+    spread_regions: int = Field(2, env='PREFETCH_SPREAD_REGIONS')
+    # Seconds between prefetch sweeps
+    interval: float = Field(60, env='PREFETCH_INTERVAL')
+    # Bytes per second queued for prefetch to every edge on average
+    bandwidth: int = Field(10 * 1024 ** 2, env='PREFETCH_BANDWIDTH')
+    # Counters of count-min sketch: width is per row, error of the estimate
+    # is below 2 / width of the requests with probability 1 - 1 / 2 ** depth
+    sketch_width: int = Field(2048, env='PREFETCH_SKETCH_WIDTH')
+    sketch_depth: int = Field(4, env='PREFETCH_SKETCH_DEPTH')
+    # Requests are saved to Redis every this number of seconds
+    flush_interval: float = Field(5, env='PREFETCH_FLUSH_INTERVAL')
+
+
+prefetch_settings = PrefetchSettings()
+
+
 class CronSettings:
     finish_in_progress_tasks: dict = {
         'minute': 30,
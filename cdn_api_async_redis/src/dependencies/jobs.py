@@ -0,0 +1,15 @@
+from functools import lru_cache
+from typing import Annotated
+
+from fastapi import Depends
+
+from services.jobs import UploadJobs, get_upload_jobs
+
+
+@lru_cache()
+def get_upload_jobs_service(
+        jobs: UploadJobs = Depends(get_upload_jobs)) -> UploadJobs:
+    return jobs
+
+
+UploadJobsDep = Annotated[UploadJobs, Depends(get_upload_jobs_service)]
@@ -0,0 +1,15 @@
+from functools import lru_cache
+from typing import Annotated
+
+from fastapi import Depends
+
+from connectors.nodes import NodeRegistry, get_node_registry
+
+
+@lru_cache()
+def get_node_registry_service(
+        registry: NodeRegistry = Depends(get_node_registry)) -> NodeRegistry:
+    return registry
+
+
+NodesDep = Annotated[NodeRegistry, Depends(get_node_registry_service)]
@@ -0,0 +1,18 @@
+from functools import lru_cache
+from typing import Annotated
+
+from fastapi import Depends
+
+from connectors.abstract import AbstractQueue
+from connectors.queue import get_replication_queue
+
+
+@lru_cache()
+def get_replication_queue_service(
+        queue: AbstractQueue = Depends(get_replication_queue)) \
+        -> AbstractQueue:
+    return queue
+
+
+ReplicationQueueDep = Annotated[AbstractQueue,
+                                Depends(get_replication_queue_service)]
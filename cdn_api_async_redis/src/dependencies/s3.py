@@ -6,6 +6,7 @@ from fastapi import Depends
 from connectors.abstract import AbstractS3
 from connectors.aws_s3 import AWSS3, get_aws_s3
 from connectors.minio_s3 import get_minio_s3, MinioS3
+from connectors.pool import S3Pool, get_s3_pool
 
 
 @lru_cache()
@@ -24,3 +25,12 @@ def get_aws_cdn_service(
 
 
 AWSDep = Annotated[AbstractS3, Depends(get_aws_cdn_service)]
+
+
+@lru_cache()
+def get_s3_pool_service(
+        pool: S3Pool = Depends(get_s3_pool)) -> S3Pool:
+    return pool
+
+
+S3PoolDep = Annotated[S3Pool, Depends(get_s3_pool_service)]
@@ -0,0 +1,70 @@
+import re
+
+from connectors.abstract import AbstractCache
+from models.model import Node
+
+# Edges that don't have the whole object yet may have its head (the first
+# `REPLICATION_HEAD_BYTES`) copied as a separate object. Hash
+# `availability:{object}` maps edge endpoint to the range it holds,
+# e.g. `0-67108863`. Names of head objects start with the reserved prefix,
+# objects with such names can't be uploaded or deleted with the API, so
+# heads never clash with real objects.
+HEADS_PREFIX = '.heads/'
+RANGE_HEADER = re.compile(r'bytes=(\d+)-(\d+)$')
+
+
+def head_key(object_name: str) -> str:
+    return f"{HEADS_PREFIX}{object_name}"
+
+
+def is_reserved(object_name: str) -> bool:
+    return object_name.startswith(HEADS_PREFIX)
+
+
+def availability_key(object_name: str) -> str:
+    return f"availability:{object_name}"
+
+
+def requested_range(header: str | None) -> tuple[int, int] | None:
+    """
+    Closed single range of the Range header. Open ranges (`bytes=0-`) and
+    several ranges need the whole object.
+    :return: (first byte, last byte) or None
+    """
+    match = RANGE_HEADER.match(header.strip()) if header else None
+    if not match:
+        return None
+    first, last = int(match[1]), int(match[2])
+    return (first, last) if first <= last else None
+
+
+async def save_range(cache: AbstractCache,
+                     object_name: str,
+                     node: Node,
+                     last: int) -> None:
+    pipe = await cache.get_pipeline()
+    pipe.hset(availability_key(object_name),
+              mapping={node.endpoint: f"0-{last}"})
+    await pipe.execute()
+
+
+async def forget_ranges(cache: AbstractCache,
+                        object_name: str,
+                        *nodes: Node) -> None:
+    pipe = await cache.get_pipeline()
+    pipe.hdel(availability_key(object_name),
+              *(node.endpoint for node in nodes))
+    await pipe.execute()
+
+
+async def get_ranges(cache: AbstractCache,
+                     object_name: str) -> dict[str, tuple[int, int]]:
+    """
+    :return: {edge endpoint: (first byte, last byte)} of the object heads
+    """
+    data = await cache.get_from_cache_by_key(availability_key(object_name))
+    ranges = {}
+    for endpoint, range_ in (data or {}).items():
+        first, last = str(range_, 'utf-8').split('-')
+        ranges[str(endpoint, 'utf-8')] = (int(first), int(last))
+    return ranges
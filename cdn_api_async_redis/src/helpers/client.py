@@ -0,0 +1,25 @@
+from ipaddress import ip_address, ip_network
+
+from starlette.requests import Request
+
+from core.config import settings
+
+proxies = [ip_network(network) for network in settings.trusted_proxies]
+
+
+def client_ip(request: Request) -> str:
+    """
+    IP of the client. X-Real-IP header set by nginx is used only when the
+    request came from a trusted proxy, otherwise anyone could set it.
+    """
+    host = request.client.host if request.client else ''
+    real_ip = request.headers.get('x-real-ip')
+    if not real_ip or not host:
+        return host
+    try:
+        address = ip_address(host)
+    except ValueError:
+        return host
+    if any(address in network for network in proxies):
+        return real_ip.strip()
+    return host
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from time import monotonic, time
+from zlib import crc32
+
+from connectors.abstract import AbstractCache
+
+
+class Election:
+    """
+    Leader election between API workers and replicas. Every member tries to
+    take the leader lock in the cache, the leader extends its lease every
+    `ttl / 3` seconds, so the lock of a crashed leader expires after `ttl`
+    seconds and another member takes it.
+    With `shard` enabled every member also announces itself in the members
+    set and nodes are divided between the live members with rendezvous
+    hashing, so a new or a gone member moves only its share of nodes.
+    """
+
+    def __init__(self,
+                 cache: AbstractCache,
+                 ttl: float = 15,
+                 shard: bool = False,
+                 key: str = 'scheduler:leader',
+                 members_key: str = 'scheduler:members'):
+        self.cache = cache
+        self.ttl = ttl
+        self.shard = shard
+        self.key = key
+        self.members_key = members_key
+        self.member = f"{socket.gethostname()}:{os.getpid()}:" \
+                      f"{uuid.uuid4().hex[:8]}"
+        self.members: list[str] = []
+        self._leader = False
+        self._renewed_at = float('-inf')
+        self._members_at = float('-inf')
+        self._task: asyncio.Task | None = None
+
+    @property
+    def is_leader(self) -> bool:
+        # Lease can't be extended for `ttl` seconds, it's expired already
+        return self._leader and monotonic() - self._renewed_at < self.ttl
+
+    def owns(self, endpoint: str) -> bool:
+        """
+        Whether this member sweeps the node
+        :param endpoint: Endpoint of the node
+        """
+        if not self.shard:
+            return self.is_leader
+        if monotonic() - self._members_at >= self.ttl or \
+                self.member not in self.members:
+            return False
+        return max(self.members,
+                   key=lambda m: crc32(f"{m}^{endpoint}".encode())
+                   ) == self.member
+
+    async def _elect(self) -> None:
+        if self._leader:
+            leader = await self.cache.extend_lock(self.key, self.member,
+                                                  self.ttl)
+        else:
+            leader = await self.cache.acquire_lock(self.key, self.member,
+                                                   self.ttl)
+        if leader:
+            self._renewed_at = monotonic()
+            if not self._leader:
+                logging.info(f"'{self.member}' is the scheduler leader")
+        elif self._leader:
+            logging.warning(f"'{self.member}' lost the scheduler leadership")
+        self._leader = leader
+
+    async def _announce(self) -> None:
+        now = time()
+        pipe = await self.cache.get_pipeline()
+        pipe.zadd(self.members_key, {self.member: now})
+        pipe.zremrangebyscore(self.members_key, '-inf', now - self.ttl)
+        await pipe.execute()
+        members = await self.cache.get_index_range(self.members_key,
+                                                   now - self.ttl,
+                                                   float('inf'))
+        self.members = sorted(str(m, 'utf-8') for m in members)
+        self._members_at = monotonic()
+
+    async def _beat(self) -> None:
+        try:
+            await self._elect()
+            if self.shard:
+                await self._announce()
+        except Exception as e:
+            logging.error(f"Can't renew scheduler membership: {e!r}")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            await self._beat()
+
+    async def start(self) -> None:
+        # Leadership is known before the first scheduled job
+        await self._beat()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            if self._leader:
+                await self.cache.release_lock(self.key, self.member)
+            if self.shard:
+                pipe = await self.cache.get_pipeline()
+                pipe.zrem(self.members_key, self.member)
+                await pipe.execute()
+        except Exception as e:
+            # Lease and membership expire by themselves
+            logging.error(f"Can't leave the scheduler election: {e!r}")
+        self._leader = False
@@ -3,6 +3,7 @@ import logging
 from fastapi import HTTPException, status
 
 from connectors.abstract import AbstractCache
+from helpers.availability import HEADS_PREFIX
 from models.model import Node, Status
 
 
@@ -33,6 +34,12 @@ too_many_requests = HTTPException(
     headers={"WWW-Authenticate": "Bearer"},
 )
 
+reserved_object_name = HTTPException(
+    status_code=status.HTTP_400_BAD_REQUEST,
+    detail=f"Object names starting with '{HEADS_PREFIX}' are reserved",
+    headers={"WWW-Authenticate": "Bearer"},
+)
+
 locations_not_available = HTTPException(
     status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
     detail="All S3 locations are not available",
@@ -0,0 +1,75 @@
+from math import asin, cos, floor, radians, sin, sqrt
+
+from models.model import Node
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Great-circle distance between two points in kilometers.
+    Differs from geodesic distance on the ellipsoid by less than 0.5%.
+    """
+    lat1, lon1, lat2, lon2 = map(radians, (lat1, lon1, lat2, lon2))
+    a = sin((lat2 - lat1) / 2) ** 2 + \
+        cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * asin(min(1.0, sqrt(a)))
+
+
+class NearestNodeIndex:
+    """
+    Spatial index to find the closest node.
+    The globe is split into cells of `cell_size` degrees. Every cell keeps
+    only the nodes that can be the nearest one for some point of the cell:
+    node n is a candidate if d(center, n) <= min d(center, *) + 2 * radius.
+    Most cells have a single candidate, so a lookup is a dict access.
+    Cells are filled lazily and live as long as the nodes snapshot.
+    """
+
+    def __init__(self, nodes: dict[str, Node], cell_size: float = 1.0):
+        self.nodes = tuple(nodes.values())
+        self.cell_size = cell_size
+        self._lat_cells = int(180 // cell_size) or 1
+        self._lon_cells = int(360 // cell_size) or 1
+        self._cells: dict[tuple[int, int], tuple[Node, ...]] = {}
+
+    def _cell(self, latitude: float, longitude: float) -> tuple[int, int]:
+        lat = min(int(floor((latitude + 90) / self.cell_size)),
+                  self._lat_cells - 1)
+        lon = int(floor((longitude + 180) / self.cell_size)) % self._lon_cells
+        return lat, lon
+
+    def _candidates(self, cell: tuple[int, int]) -> tuple[Node, ...]:
+        lat_min = cell[0] * self.cell_size - 90
+        lon_min = cell[1] * self.cell_size - 180
+        lat_max = min(lat_min + self.cell_size, 90)
+        lon_max = lon_min + self.cell_size
+        lat_c = (lat_min + lat_max) / 2
+        lon_c = (lon_min + lon_max) / 2
+        # Corners and middles of the edges are the farthest points of a cell
+        radius = max(haversine(lat_c, lon_c, lat, lon)
+                     for lat in (lat_min, lat_c, lat_max)
+                     for lon in (lon_min, lon_c, lon_max)) * 1.01
+
+        distances = [haversine(lat_c, lon_c, n.latitude, n.longitude)
+                     for n in self.nodes]
+        border = min(distances) + 2 * radius
+        return tuple(n for n, d in zip(self.nodes, distances) if d <= border)
+
+    def closest(self, coordinates: tuple[float, float]) -> Node | None:
+        """
+        Get the node with the shortest distance to the coordinates
+        :param coordinates: (latitude, longitude)
+        :return: Node or None if there are no nodes
+        """
+        if not self.nodes:
+            return None
+        cell = self._cell(*coordinates)
+        candidates = self._cells.get(cell)
+        if candidates is None:
+            candidates = self._cells[cell] = self._candidates(cell)
+        if len(candidates) == 1:
+            return candidates[0]
+        return min(candidates,
+                   key=lambda n: haversine(coordinates[0], coordinates[1],
+                                           n.latitude, n.longitude))
@@ -1,44 +1,35 @@
 import asyncio
 import logging
-from json import JSONDecodeError, loads
-from typing import Any, Type
+from typing import Iterable
 
-from aiofiles import open
-from aiohttp import ClientConnectorError, ClientSession
 from dotenv import load_dotenv
-from geopy.distance import distance
 
-from core.config import settings
 from connectors.abstract import AbstractS3, AbstractCache
+from connectors import geoip
+from connectors.geoip import get_geo_resolver
+from connectors.pool import S3Pool
+from connectors.nodes import NodeRegistry, NodesSnapshot, \
+    get_node_registry
+from core.config import settings
+from helpers.cache import MISSING, TTLCache
 from helpers.exceptions import locations_not_available
-from models.model import Node, Status
+from helpers.metrics import OBJECT_URL_STAGE
+from models.model import Node, ObjectMeta, Status
 
 load_dotenv()
 
+object_meta_cache = TTLCache(settings.object_meta_cache_size,
+                             settings.object_meta_cache_ttl)
+
 
-async def get_active_nodes(
-        file_path: str = "./.env.minio.json"
-) -> dict[str, Node]:
+async def get_active_nodes() -> dict[str, Node]:
     """
-    Get origin and all active edge locations (is_active = True)
-    :param file_path: Edge and origin configuration
+    Get origin and all active edge locations (is_active = True) from the
+    in-memory node registry. No I/O is done here.
     :return: Collection of {node name: Node}
     """
-    try:
-        async with open(file_path, "r") as file:
-            j = loads(await file.read())
-            return {k: Node(**v) for k, v in j.items()
-                    if v['is_active'] == "True"}
-
-    except FileNotFoundError:
-        logging.error('File with nodes doesn\'t exist!!!')
-        raise FileNotFoundError
-    except JSONDecodeError as e:
-        logging.error(e)
-    except AttributeError as e:
-        logging.error(e)
-    except IOError as e:
-        logging.error(e)
+    registry = await get_node_registry()
+    return registry.nodes
 
 
 async def origin_is_alive(nodes: dict[str, Node]):
@@ -50,118 +41,100 @@ async def origin_is_alive(nodes: dict[str, Node]):
 
 
 async def find_closest_node(user_ip: str,
-                            active_nodes: dict[str, Node]) -> Node | bool:
+                            snapshot: NodesSnapshot) -> Node | bool:
     """
     Get node that has the shortest distance between user's ip and node's ip.
     Node location is known in advance. It's recorded in config file.
     :param user_ip: User IP
-    :param active_nodes: Collection of active nodes: {node name: Node}
+    :param snapshot: Nodes snapshot with the nearest node index
     :return: Node object
     """
-    async with ClientSession() as session:
-        try:
-            if settings.ipapi_key:
-                url_ip_location = f"https://ipapi.co/{user_ip}/json/" \
-                                  f"?key={settings.ipapi_key}"
-            else:
-                url_ip_location = f"https://ipapi.co/{user_ip}/json/"
-            async with session.get(url_ip_location) as response:
-                res = await response.json()
-                try:
-                    user_coordinates = (float(res['latitude']),
-                                        float(res['longitude'])
-                                        )
-                    logging.info(f"user coordinates: {user_coordinates}")
-                except KeyError:
-                    logging.error(f"'{user_ip}' not found in the database.")
-                    return False
-        except ClientConnectorError as err:
-            logging.error(err)
-            return False
-
-    # Just taking first node from the collection
-    closest_node = list(active_nodes.values())[0]
-    # Calculate min distance for first element
-    min_distance = distance(user_coordinates,
-                            (closest_node.latitude,
-                             closest_node.longitude))
-
-    # Find min distance in the active nodes
-    for node in list(active_nodes.values())[1:]:
-        distance_ = distance(user_coordinates,
-                             (node.latitude,
-                              node.longitude))
-        if distance_ < min_distance:
-            min_distance = distance_
-            closest_node = node
+    resolver = await get_geo_resolver()
+    with OBJECT_URL_STAGE.time('geo_resolve'):
+        user_coordinates = await resolver.resolve(user_ip)
+    if not user_coordinates or not snapshot.index:
+        return False
+    logging.info(f"user coordinates: {user_coordinates}")
+
+    with OBJECT_URL_STAGE.time('closest_node'):
+        closest_node = snapshot.index.closest(user_coordinates)
+    if not closest_node:
+        return False
 
     logging.info(f"Use location {closest_node.endpoint}")
     return closest_node
 
 
-async def get_object(client: Type[AbstractS3],
-                     bucket_name: str,
-                     object_name: str,
-                     node: Node) -> bool:
+async def head_object(pool: S3Pool,
+                      bucket_name: str,
+                      object_name: str,
+                      node: Node) -> ObjectMeta | None:
     """
-    Check if object exists in the bucket
-    :param client: S3 client
+    Check if object exists in the bucket. Result is cached for a few seconds
+    :param pool: S3 clients pool
     :param bucket_name: Bucket name
     :param object_name: Object name
     :param node: Node object
-    :return:
+    :return: Object metadata or None if object doesn't exist
     """
-    client: AbstractS3 = client(endpoint=node.endpoint,
-                                access_key=node.access_key_id,
-                                secret_key=node.secret_access_key,
-                                secure=False)
-
-    object_found: Any = await client.get_object(bucket_name,
-                                                object_name,
-                                                offset=0,
-                                                length=1)
-    if not object_found:
-        return False
-
-    return object_found
-
+    key = (node.endpoint, bucket_name, object_name)
+    meta = object_meta_cache.get(key)
+    if meta is MISSING:
+        client: AbstractS3 = pool.minio(node)
+        meta = await client.head_object(bucket_name, object_name)
+        object_meta_cache.set(key, meta)
+    if meta:
+        logging.info(f"Found '{object_name}' in bucket "
+                     f"'{bucket_name}' in S3 '{node.endpoint}'")
+    return meta
+
+
+async def forget_object_meta(object_name: str,
+                             nodes: Iterable[Node]) -> None:
+    """
+    Remove cached metadata of the object after it was uploaded or deleted
+    """
+    for node in nodes:
+        object_meta_cache.pop((node.endpoint, node.bucket, object_name))
 
-async def get_mpu_id(endpoint: str,
-                     filename: str,
-                     cache: AbstractCache,
-                     collection: str = "api"):
-    # If upload was failed - try to re-upload it with current mpu_id
-    key: str = f"{collection}^{filename}^{endpoint}"
 
-    res = await cache.get_from_cache_by_key(key)
-    try:
-        if str(res[b'status'], 'utf-8') == Status.IN_PROGRESS.value:
-            return str(res[b'mpu_id'], 'utf-8')
-    except TypeError:
-        return None
+def same_cluster(origin_node: Node, edge_node: Node) -> bool:
+    """
+    Check if edge can copy objects from origin on the storage side
+    """
+    return bool(origin_node.cluster) and \
+        origin_node.cluster == edge_node.cluster
 
 
-async def is_scheduler_in_progress(cache: AbstractCache,
-                                   node: Node,
-                                   object_: str,
-                                   collection: str) -> dict | None:
-    endpoint = 'http://' + node.endpoint
-    key: str = f"{collection}^{object_}^{endpoint}"
+async def get_upload_plan(endpoint: str,
+                          filename: str,
+                          cache: AbstractCache,
+                          collection: str = "api"
+                          ) -> tuple[str | None, int | None]:
+    """
+    Find failed upload to continue it with the same mpu_id and part size
+    :return: (mpu_id, part size) or (None, None) for a new upload
+    """
+    key: str = f"{collection}^{filename}^{endpoint}"
 
     res = await cache.get_from_cache_by_key(key)
     try:
-        if str(res[b'status'], 'utf-8') == Status.SCHEDULER_IN_PROGRESS.value:
-            return res
-        else:
-            return None
+        if str(res[b'status'], 'utf-8') in (Status.IN_PROGRESS.value,
+                                            Status.FAILED.value) \
+                and b'mpu_id' in res:
+            # Uploads started before part size planning used fixed size
+            part_size = int(res.get(b'part_size', settings.upload_part_size))
+            return str(res[b'mpu_id'], 'utf-8'), part_size
     except TypeError:
-        return None
+        pass
+    return None, None
 
 
 async def main():
-    print(await find_closest_node('137.0.0.1',
-                                  await get_active_nodes(
-                                      "../.env.minio.json")))
+    registry = NodeRegistry("../.env.minio.json")
+    await registry.load()
+    geoip.geo_resolver = await geoip.create_geo_resolver()
+    print(await find_closest_node('137.0.0.1', registry.snapshot))
 
 
 if __name__ == "__main__":
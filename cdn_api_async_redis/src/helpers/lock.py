@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import uuid
+from time import monotonic
+
+from connectors.abstract import AbstractCache
+
+
+class Lease:
+    """
+    Distributed lock in the cache with a lease. The holder extends the lease
+    in background while it works, so the lock of a crashed holder expires
+    after `ttl` seconds. Token can be passed to another task (e.g. a
+    scheduled job) that continues to hold the lock. The holding task is
+    cancelled if the lease is lost.
+    """
+
+    def __init__(self,
+                 cache: AbstractCache,
+                 key: str,
+                 ttl: float,
+                 token: str | None = None):
+        self.cache = cache
+        self.key = key
+        self.ttl = ttl
+        self.token = token or uuid.uuid4().hex
+        self._heartbeat: asyncio.Task | None = None
+
+    async def acquire(self) -> bool:
+        return await self.cache.acquire_lock(self.key, self.token, self.ttl)
+
+    async def release(self) -> None:
+        if not await self.cache.release_lock(self.key, self.token):
+            logging.warning(f"Lock '{self.key}' was already lost")
+
+    async def _beat(self, holder: asyncio.Task) -> None:
+        extended_at = monotonic()
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                if await self.cache.extend_lock(self.key, self.token,
+                                                self.ttl):
+                    extended_at = monotonic()
+                    continue
+                logging.error(f"Lock '{self.key}' is taken by another owner")
+            except Exception as e:
+                logging.error(f"Can't extend lock '{self.key}': {e!r}")
+                if monotonic() - extended_at < self.ttl:
+                    continue
+            holder.cancel()
+            return
+
+    async def __aenter__(self):
+        self._heartbeat = asyncio.create_task(
+            self._beat(asyncio.current_task()))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._heartbeat.cancel()
+        try:
+            await self.release()
+        except Exception as e:
+            # Lock expires by itself
+            logging.error(f"Can't release lock '{self.key}': {e!r}")
@@ -0,0 +1,280 @@
+import asyncio
+import json
+import logging
+import os
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from glob import glob
+from time import perf_counter
+
+# Metrics in Prometheus text format. Values live in the worker process and
+# are changed from the event loop only, so recording is a dict update
+# without locks. With several worker processes every process saves its
+# values to a file of the shared directory and /metrics sums the files.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60)
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name: str, help_: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_
+        self.labels = labels
+        self.values: dict[tuple[str, ...], float] = {}
+        registry.append(self)
+
+    def _labels(self, values: tuple[str, ...], extra: str = '') -> str:
+        pairs = [f'{name}="{value}"'
+                 for name, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    @property
+    def state(self) -> dict:
+        return self.values
+
+    def merge(self, total: dict, state: dict) -> None:
+        # Values of other processes are added to the total
+        for labels, value in state.items():
+            total[labels] = total.get(labels, 0) + value
+
+    def samples(self, state: dict) -> list[str]:
+        return [f"{self.name}{self._labels(labels)} {value}"
+                for labels, value in state.items()]
+
+    def render(self, state: dict | None = None) -> str:
+        return '\n'.join([f"# HELP {self.name} {self.help}",
+                          f"# TYPE {self.name} {self.kind}",
+                          *self.samples(self.state if state is None
+                                        else state)])
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels: str, value: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + value
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, *labels: str) -> None:
+        self.values[labels] = value
+
+    def merge(self, total: dict, state: dict) -> None:
+        # Gauges describe shared state, e.g. the queue, value of the process
+        # that serves the scrape is the freshest
+        pass
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self,
+                 name: str,
+                 help_: str,
+                 labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help_, labels)
+        self.buckets = buckets
+        # labels -> [count of every bucket..., count, sum]
+        self.series: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 2)
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, *labels: str):
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - started, *labels)
+
+    @property
+    def state(self) -> dict:
+        return self.series
+
+    def merge(self, total: dict, state: dict) -> None:
+        for labels, series in state.items():
+            summed = total.get(labels)
+            total[labels] = series if summed is None else [
+                a + b for a, b in zip(summed, series)]
+
+    def samples(self, state: dict) -> list[str]:
+        lines = []
+        for labels, series in state.items():
+            total: float = 0
+            for bound, count in zip(self.buckets, series):
+                total += count
+                le = self._labels(labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {total}")
+            le = self._labels(labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {series[-2]}")
+            lines.append(f"{self.name}_count{self._labels(labels)} "
+                         f"{series[-2]}")
+            lines.append(f"{self.name}_sum{self._labels(labels)} "
+                         f"{series[-1]}")
+        return lines
+
+
+registry: list[Metric] = []
+
+
+def render() -> str:
+    return '\n'.join(metric.render() for metric in registry) + '\n'
+
+
+class MetricsFiles:
+    """
+    Metrics of all worker processes, e.g. gunicorn workers, that share
+    `directory`. Every process saves its values to `<pid>.json` every
+    `flush_interval` seconds and when it stops, /metrics sums values of all
+    files, so any worker that gets the scrape returns totals of the
+    instance. Files of stopped processes are kept to keep counters growing,
+    the directory is emptied before the workers start.
+    """
+
+    def __init__(self, directory: str, flush_interval: float = 5):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.path = os.path.join(directory, f'{os.getpid()}.json')
+        self._task: asyncio.Task | None = None
+
+    @staticmethod
+    def dump() -> dict[str, list]:
+        # Copy is taken on the event loop, JSON keys are strings, so labels
+        # are saved in lists of pairs
+        return {metric.name: [[labels, [*value] if isinstance(value, list)
+                               else value]
+                              for labels, value in metric.state.items()]
+                for metric in registry}
+
+    def save(self, data: dict[str, list]) -> None:
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(data, file)
+        # Readers never see a half written file
+        os.replace(temporary, self.path)
+
+    def collect(self, data: dict[str, list]) -> dict[str, dict]:
+        self.save(data)
+        totals: dict[str, dict] = {metric.name: {} for metric in registry}
+        for path in glob(os.path.join(self.directory, '*.json')):
+            try:
+                with open(path) as file:
+                    saved = json.load(file)
+            except (OSError, ValueError) as e:
+                logging.warning(f"Can't read metrics file {path}: {e!r}")
+                continue
+            for metric in registry:
+                state = {tuple(labels): value
+                         for labels, value in saved.get(metric.name, [])}
+                metric.merge(totals[metric.name], state)
+        return totals
+
+    async def render(self) -> str:
+        totals = await asyncio.to_thread(self.collect, self.dump())
+        # Gauges aren't summed, values of this process are rendered
+        return '\n'.join(
+            metric.render(metric.state if isinstance(metric, Gauge)
+                          else totals[metric.name])
+            for metric in registry) + '\n'
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self.save, self.dump())
+            except OSError as e:
+                logging.warning(f"Metrics aren't saved: {e!r}")
+
+    async def start(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await asyncio.to_thread(self.save, self.dump())
+
+
+metrics_files: MetricsFiles | None = None
+
+
+# Redis round trips of the current request, the list is shared with tasks
+# started by the request
+redis_round_trips: ContextVar[list[int] | None] = ContextVar(
+    'redis_round_trips', default=None)
+
+
+def count_round_trip() -> None:
+    counter = redis_round_trips.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that measures requests and counts their Redis round
+    trips. Route is the name of the route function.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        counter = [0]
+        token = redis_round_trips.set(counter)
+        started = perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            redis_round_trips.reset(token)
+            route = getattr(scope.get('endpoint'), '__name__', 'unmatched')
+            REQUEST_SECONDS.observe(perf_counter() - started, route)
+            REDIS_ROUND_TRIPS.observe(counter[0], route)
+
+
+REQUEST_SECONDS = Histogram('cdn_request_seconds',
+                            'Request duration', ('route',))
+REDIS_ROUND_TRIPS = Histogram('cdn_redis_round_trips',
+                              'Redis round trips per request', ('route',),
+                              buckets=(0, 1, 2, 3, 5, 8, 13, 21))
+OBJECT_URL_STAGE = Histogram('cdn_object_url_stage_seconds',
+                             'Duration of object_url stages', ('stage',))
+UPLOAD_PART_SECONDS = Histogram('cdn_upload_part_seconds',
+                                'Duration of part upload with retries',
+                                ('link',))
+UPLOAD_PART_SPEED = Histogram('cdn_upload_part_bytes_per_second',
+                              'Speed of part upload', ('link',),
+                              buckets=tuple(2 ** i * 1024 ** 2
+                                            for i in range(-4, 11)))
+RATE_LIMITED = Counter('cdn_rate_limited_total',
+                       'Requests rejected by rate limit', ('route',))
+SWEEP_SECONDS = Histogram('cdn_scheduler_sweep_seconds',
+                          'Duration of scheduler sweeps', ('task',))
+QUEUE_DEPTH = Gauge('cdn_replication_queue_depth',
+                    'Replication tasks waiting or running')
+EVICTED_BYTES = Counter('cdn_edge_evicted_bytes_total',
+                        'Bytes of replicas evicted from edges', ('node',))
+PREFETCHED_BYTES = Counter('cdn_prefetched_bytes_total',
+                           'Bytes of objects queued for prefetch to edges',
+                           ('node',))
@@ -0,0 +1,200 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from time import time
+
+from connectors.abstract import AbstractCache
+from models.model import Status
+
+# Progress records `{collection}^{object}^{endpoint}` are indexed in sorted
+# sets `progress:{status}:{endpoint}` scored by time of the last update, so
+# sweeps read only the records they need. Finished records are never swept
+# and aren't indexed, otherwise their index grows with every object.
+BACKFILL_MARKER = 'progress:index:backfilled'
+FINISHED_DROPPED_MARKER = 'progress:index:finished-dropped'
+UNINDEXED = (Status.FINISHED.value,)
+
+
+def index_key(status: str, endpoint: str) -> str:
+    return f"progress:{status}:{endpoint}"
+
+
+def add_progress(pipe, key: str, entity: dict) -> None:
+    """
+    Add update of the progress record and its index to the pipeline
+    """
+    pipe.hset(name=key, mapping=entity)
+    if 'status' in entity:
+        endpoint = key[key.rindex('^') + 1:]
+        for status in Status:
+            if status.value != entity['status']:
+                pipe.zrem(index_key(status.value, endpoint), key)
+        if entity['status'] not in UNINDEXED:
+            pipe.zadd(index_key(entity['status'], endpoint), {key: time()})
+
+
+def remove_progress(pipe, key: str) -> None:
+    pipe.delete(key)
+    endpoint = key[key.rindex('^') + 1:]
+    for status in Status:
+        pipe.zrem(index_key(status.value, endpoint), key)
+
+
+async def save_progress(cache: AbstractCache, key: str, entity: dict) -> None:
+    """
+    Write progress record and move it to the index of its status
+    """
+    pipe = await cache.get_pipeline()
+    add_progress(pipe, key, entity)
+    await pipe.execute()
+
+
+async def delete_progress(cache: AbstractCache, *keys: str) -> None:
+    pipe = await cache.get_pipeline()
+    for key in keys:
+        remove_progress(pipe, key)
+    await pipe.execute()
+
+
+async def get_stale_progress(cache: AbstractCache,
+                             endpoint: str,
+                             statuses: tuple[str, ...],
+                             min_time: float = float('-inf'),
+                             max_time: float = float('inf')
+                             ) -> dict[str, dict]:
+    """
+    Progress records of the node with the statuses updated between min_time
+    and max_time (epoch seconds)
+    :return: {key: record}
+    """
+    keys: list[str] = []
+    for status in statuses:
+        keys.extend(str(key, 'utf-8') for key in await cache.get_index_range(
+            index_key(status, endpoint), min_time, max_time))
+    records = await cache.get_many_by_keys(keys)
+    # Index may be behind the record, e.g. after the backfill
+    return {key: record for key, record in zip(keys, records)
+            if record and str(record.get(b'status', b''), 'utf-8') in statuses}
+
+
+async def backfill_progress_index(cache: AbstractCache,
+                                  batch: int = 500) -> None:
+    """
+    Index progress records written before the index existed. Runs once per
+    Redis database.
+    """
+    if await cache.get_from_cache_by_id(BACKFILL_MARKER):
+        return
+    keys: list[str] = []
+    indexed = 0
+
+    async def index_batch() -> int:
+        pipe = await cache.get_pipeline()
+        count = 0
+        for key, record in zip(keys, await cache.get_many_by_keys(keys)):
+            if not record or b'status' not in record:
+                continue
+            status = str(record[b'status'], 'utf-8')
+            if status in UNINDEXED:
+                continue
+            count += 1
+            updated = datetime.fromisoformat(
+                str(record[b'last_modified'], 'utf-8')).replace(
+                tzinfo=timezone.utc)
+            pipe.zadd(index_key(status, key[key.rindex('^') + 1:]),
+                      {key: updated.timestamp()})
+        await pipe.execute()
+        return count
+
+    async for key in await cache.get_keys_by_pattern('*^*^*'):
+        keys.append(str(key, 'utf-8'))
+        if len(keys) >= batch:
+            indexed += await index_batch()
+            keys = []
+    if keys:
+        indexed += await index_batch()
+    await cache.put_to_cache_by_id(BACKFILL_MARKER, 1, None)
+    logging.info(f"Progress index is built for {indexed} records")
+
+
+async def drop_finished_index(cache: AbstractCache) -> None:
+    """
+    Delete indexes of finished records written by earlier versions. Runs once
+    per Redis database.
+    """
+    if await cache.get_from_cache_by_id(FINISHED_DROPPED_MARKER):
+        return
+    pipe = await cache.get_pipeline()
+    async for key in await cache.get_keys_by_pattern(
+            index_key(Status.FINISHED.value, '*')):
+        pipe.delete(key)
+    await pipe.execute()
+    await cache.put_to_cache_by_id(FINISHED_DROPPED_MARKER, 1, None)
+
+
+class ProgressCheckpointer:
+    """
+    Coalesced writer of upload progress records. Only the latest record of
+    every key is kept in memory and written with one pipeline every
+    `interval` seconds or after `parts` updates. The first record is written
+    right away, so the upload can be found and resumed. Writes run in the
+    background and never block uploading of parts.
+    Records are only a hint for resuming: `list_parts` is the source of truth
+    for the uploaded parts.
+    """
+
+    def __init__(self, cache: AbstractCache, interval: float, parts: int):
+        self.cache = cache
+        self.interval = interval
+        self.parts = parts
+        self._pending: dict[str, dict] = {}
+        self._updates = 0
+        self._written = False
+        self._lock = asyncio.Lock()
+        self._flushing: asyncio.Task | None = None
+        self._timer: asyncio.Task | None = None
+
+    def update(self, key: str, entity: dict) -> None:
+        """
+        Replace pending record of the key. Doesn't wait for the cache.
+        """
+        self._pending[key] = entity
+        self._updates += 1
+        if not self._written or self._updates >= self.parts:
+            self._written = True
+            if self._flushing is None or self._flushing.done():
+                self._flushing = asyncio.create_task(self.flush())
+
+    async def flush(self) -> None:
+        # Lock keeps the order of writes, newer record is never overwritten
+        async with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            self._updates = 0
+            try:
+                pipe = await self.cache.get_pipeline()
+                for key, entity in pending.items():
+                    add_progress(pipe, key, entity)
+                await pipe.execute()
+            except Exception as e:
+                logging.error(f"Can't save upload progress: {e}")
+                # Try again with the next flush unless there is a newer record
+                self._pending = pending | self._pending
+
+    async def _tick(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            # Write isn't interrupted when the timer is cancelled
+            await asyncio.shield(self.flush())
+
+    async def __aenter__(self):
+        self._timer = asyncio.create_task(self._tick())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        # Upload is completed or failed, save the last state
+        self._timer.cancel()
+        if self._flushing:
+            await asyncio.gather(self._flushing, return_exceptions=True)
+        await self.flush()
@@ -0,0 +1,27 @@
+from typing import AsyncIterator
+
+
+class BodyReader:
+    """
+    File-like adapter over the request body stream for the multipart upload.
+    Keeps at most one part and one network chunk in memory, so the body goes
+    to S3 without a temporary file.
+    """
+
+    def __init__(self, stream: AsyncIterator[bytes]):
+        self._stream = stream.__aiter__()
+        self._buffer = bytearray()
+        self._eof = False
+
+    async def read(self, size: int) -> bytes:
+        """
+        Read `size` bytes, less only at the end of the body
+        """
+        while len(self._buffer) < size and not self._eof:
+            try:
+                self._buffer += await self._stream.__anext__()
+            except StopAsyncIteration:
+                self._eof = True
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
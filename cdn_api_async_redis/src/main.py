@@ -5,28 +5,110 @@ import uvicorn
 from fastapi import FastAPI, Depends
 from fastapi.responses import ORJSONResponse
 
+from api import metrics
 from api.v1 import films
-from core.config import settings
+from core.config import edge_cache_settings, metrics_settings, \
+    pool_settings, prefetch_settings, replication_settings, \
+    resilience_settings, rl, scheduler_settings, settings, \
+    upload_job_settings
 from core.logger import LOGGING
-from connectors import redis
+from connectors import geoip, nodes, pool, queue, redis, \
+    scheduler as sweeps
 from connectors.scheduler import get_scheduler, add_startup_jobs
-from services.redis import rate_limit
+from helpers.election import Election
+from helpers import metrics as helpers_metrics
+from helpers.metrics import MetricsMiddleware
+from services import capacity, jobs, prefetch, replication
+from services import rate_limiter
+from services.rate_limiter import rate_limit
 
 
 async def startup():
-    redis.redis = redis.Redis(host=settings.redis_host,
-                              port=settings.redis_port,
-                              ssl=False)
+    if metrics_settings.multiproc_dir:
+        helpers_metrics.metrics_files = helpers_metrics.MetricsFiles(
+            metrics_settings.multiproc_dir,
+            metrics_settings.flush_interval)
+        await helpers_metrics.metrics_files.start()
+    nodes.node_registry = nodes.NodeRegistry(settings.nodes_file,
+                                             settings.nodes_reload_interval,
+                                             settings.nodes_index_cell_size)
+    await nodes.node_registry.start()
+    geoip.geo_resolver = await geoip.create_geo_resolver()
+    pool.s3_pool = pool.S3Pool(pool_settings.max_connections,
+                               pool_settings.max_connections_per_host,
+                               pool_settings.keepalive_timeout,
+                               pool_settings.region,
+                               pool_settings.connect_timeout,
+                               pool_settings.read_timeout)
+    await pool.s3_pool.start()
+    redis.redis = redis.Redis(
+        host=settings.redis_host,
+        port=settings.redis_port,
+        ssl=False,
+        socket_timeout=resilience_settings.redis_timeout,
+        socket_connect_timeout=resilience_settings.redis_timeout)
+    queue.replication_queue = await queue.create_replication_queue()
+    if replication_settings.in_api or replication_settings.queue == 'local':
+        replication.replication_workers = replication.ReplicationWorkers(
+            queue.replication_queue,
+            redis.redis,
+            replication_settings.workers,
+            replication_settings.per_edge,
+            replication_settings.claim_idle / 3)
+        await replication.replication_workers.start()
+    if rl.is_rate_limit:
+        rate_limiter.rate_limiter = rate_limiter.RateLimiter(
+            redis.redis,
+            int(rl.request_limit_per_minute * rl.window / 60),
+            rl.window,
+            rl.routes,
+            rl.sync_interval,
+            rl.sync_batch)
+        await rate_limiter.rate_limiter.start()
+    capacity.replica_tracker = capacity.ReplicaTracker(
+        redis.redis,
+        edge_cache_settings.flush_interval)
+    await capacity.replica_tracker.start()
+    if prefetch_settings.enabled:
+        prefetch.demand_counter = prefetch.DemandCounter(
+            redis.redis,
+            prefetch_settings.flush_interval)
+        await prefetch.demand_counter.start()
+    # Only the leader or shard owners run the sweeps
+    sweeps.election = Election(redis.redis,
+                               scheduler_settings.leader_ttl,
+                               scheduler_settings.shard)
+    await sweeps.election.start()
     # Connecting to scheduler
     scheduler = await get_scheduler()
     await add_startup_jobs(scheduler, redis.redis)
     scheduler.start()
     logging.info(f'List of scheduled jobs: {scheduler.get_jobs()}')
+    jobs.upload_jobs = jobs.UploadJobs(upload_job_settings.workers,
+                                       upload_job_settings.max_jobs,
+                                       upload_job_settings.max_bytes,
+                                       upload_job_settings.directory)
+    await jobs.upload_jobs.start()
 
 
 async def shutdown():
     scheduler = await get_scheduler()
     scheduler.shutdown()
+    await sweeps.election.close()
+    await jobs.upload_jobs.close()
+    await capacity.replica_tracker.close()
+    if prefetch.demand_counter:
+        await prefetch.demand_counter.close()
+    if rate_limiter.rate_limiter:
+        await rate_limiter.rate_limiter.close()
+    if replication.replication_workers:
+        await replication.replication_workers.close()
+    await queue.replication_queue.close()
+    await nodes.node_registry.close()
+    await geoip.geo_resolver.close()
+    await pool.s3_pool.close()
+    if helpers_metrics.metrics_files:
+        await helpers_metrics.metrics_files.close()
 
 
 @asynccontextmanager
@@ -47,6 +129,8 @@ app = FastAPI(
     dependencies=[Depends(rate_limit)])
 
 app.include_router(films.router, prefix='/api/v1/films', tags=['films'])
+app.include_router(metrics.router)
+app.add_middleware(MetricsMiddleware)
 
 if __name__ == '__main__':
     uvicorn.run(
@@ -19,7 +19,38 @@ class Model(BaseModel):
         allow_population_by_field_name = True
 
 
-@dataclass
+class UploadSessionIn(Model):
+    object_name: str
+    size: int
+    content_type: str | None = None
+
+
+class PartUrl(Model):
+    part_number: int
+    url: str
+
+
+class UploadSession(Model):
+    object_name: str
+    upload_id: str
+    size: int
+    part_size: int
+    parts_count: int
+    # Parts already uploaded to S3, they can be skipped
+    uploaded_parts: list[int] = []
+    urls: list[PartUrl] = []
+
+
+@dataclass(slots=True)
+class QueueItem:
+    # Id of the message in the queue, it's used to acknowledge it
+    id: str
+    task: dict
+    priority: bool = False
+    attempts: int = 0
+
+
+@dataclass(frozen=True, slots=True)
 class Node:
     endpoint: str
     alias: str
@@ -29,9 +60,30 @@ class Node:
     latitude: float
     longitude: float
     is_active: str
+    # Bucket with objects on the node, `BUCKET_NAME` if it's not set
+    bucket: str = ''
+    # Nodes with the same cluster name are served by one S3 service and
+    # can copy objects from each other without the API in between
+    cluster: str = ''
+    # Bytes of replicas the edge keeps, cold ones are evicted above it.
+    # 0 is unlimited, origin is never limited
+    capacity_bytes: int = 0
+    # Demand of clients of nodes with the same region is counted together
+    # and trending objects are copied to all edges of the region. Node
+    # without region is a region of its own
+    region: str = ''
+
+
+@dataclass(frozen=True, slots=True)
+class ObjectMeta:
+    size: int
+    etag: str
+    content_type: str | None = None
 
 
 class Status(Enum):
     FINISHED = 'finished'
     IN_PROGRESS = 'in_progress'
     SCHEDULER_IN_PROGRESS = 'scheduler_in_progress'
+    QUEUED = 'queued'
+    FAILED = 'failed'
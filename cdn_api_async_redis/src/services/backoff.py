@@ -1,43 +1,227 @@
+import asyncio
 import logging
 from functools import wraps
-from time import sleep
-from redis.exceptions import ConnectionError
+from random import uniform
+from time import monotonic
+from typing import Any, Awaitable, Callable
+
+from redis.exceptions import ConnectionError, TimeoutError
+
+from core.config import resilience_settings
 
 
 class BackoffError(Exception):
     ...
 
 
-def backoff(service, start_sleep_time=0.1, factor=2, border_sleep_time=10):
+class CircuitOpenError(BackoffError):
+    ...
+
+
+class CircuitBreaker:
+    """
+    Предохранитель для одной зависимости (Redis, S3 нода).
+    После `failure_threshold` ошибок подряд размыкается и сразу отклоняет
+    вызовы. Через `recovery_timeout` секунд пропускает один пробный вызов:
+    успех замыкает цепь, ошибка снова размыкает.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5,
+                 recovery_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._trial = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> None:
+        """
+        :raise CircuitOpenError: цепь разомкнута
+        """
+        if self.opened_at is None:
+            return
+        if not self._trial and \
+                monotonic() - self.opened_at >= self.recovery_timeout:
+            self._trial = True
+            return
+        raise CircuitOpenError(f"Circuit for {self.name} is open")
+
+    def success(self) -> None:
+        if self.opened_at is not None:
+            logging.info(f"Circuit for {self.name} is closed")
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def cancel(self) -> None:
+        # Пробный вызов отменён, следующий вызов может попробовать снова
+        self._trial = False
+
+    def failure(self) -> None:
+        self.failures += 1
+        if self._trial or self.failures >= self.failure_threshold:
+            if not self._trial:
+                logging.error(f"Circuit for {self.name} is open")
+            self.opened_at = monotonic()
+            self._trial = False
+
+
+class RetryBudget:
+    """
+    Бюджет повторов для одной зависимости. Каждый вызов пополняет бюджет на
+    `ratio`, каждый повтор тратит единицу, в запасе не больше `reserve`.
+    Когда запас исчерпан, повторов не больше `ratio` от потока запросов, и
+    они не умножают нагрузку на больную зависимость.
+    """
+
+    def __init__(self, ratio: float = 0.2, reserve: int = 10):
+        self.ratio = ratio
+        self.reserve = reserve
+        self.tokens = float(reserve)
+
+    def deposit(self) -> None:
+        self.tokens = min(self.tokens + self.ratio, self.reserve)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+def endpoint_of(client, *args, **kwargs) -> str:
+    """
+    Название S3 ноды по endpoint клиента, общее для Minio и AWS клиентов
+    """
+    return client.endpoint.split('://')[-1]
+
+
+breakers: dict[str, CircuitBreaker] = {}
+budgets: dict[str, RetryBudget] = {}
+
+
+def get_breaker(service: str) -> CircuitBreaker:
+    breaker = breakers.get(service)
+    if breaker is None:
+        breaker = breakers[service] = CircuitBreaker(
+            service,
+            resilience_settings.failure_threshold,
+            resilience_settings.recovery_timeout)
+    return breaker
+
+
+def get_budget(service: str) -> RetryBudget:
+    budget = budgets.get(service)
+    if budget is None:
+        budget = budgets[service] = RetryBudget(
+            resilience_settings.retry_budget_ratio,
+            resilience_settings.retry_budget_reserve)
+    return budget
+
+
+async def retry(func: Callable[[], Awaitable[Any]],
+                service: str,
+                start_sleep_time: float = 0.1,
+                factor: float = 2,
+                border_sleep_time: float = 10,
+                max_tries: int = 3,
+                deadline: float | None = None,
+                exceptions: tuple[type[BaseException], ...] = (
+                        BackoffError, ConnectionError, TimeoutError)
+                ) -> Any:
+    """
+    Выполнить функцию с повторами. Между повторами ждёт случайное время
+    (full jitter) от 0 до start_sleep_time * factor^n, но не больше
+    border_sleep_time. Не блокирует event loop.
+    :param func: функция без аргументов, возвращающая awaitable
+    :param service: название зависимости для предохранителя и бюджета
+    :param max_tries: максимальное количество попыток
+    :param deadline: сколько секунд можно потратить на все попытки
+    :param exceptions: ошибки, после которых есть смысл повторить
+    :return: результат выполнения функции
+    """
+    breaker = get_breaker(service)
+    budget = get_budget(service)
+    budget.deposit()
+    started = monotonic()
+    attempt = 0
+    while True:
+        breaker.allow()
+        try:
+            if deadline is None:
+                result = await func()
+            else:
+                result = await asyncio.wait_for(
+                    func(), max(deadline - (monotonic() - started), 0))
+        except exceptions + (asyncio.TimeoutError,) as e:
+            breaker.failure()
+            attempt += 1
+            wait = uniform(0, min(start_sleep_time * factor ** attempt,
+                                  border_sleep_time))
+            if attempt >= max_tries or breaker.is_open or \
+                    deadline is not None and \
+                    monotonic() - started + wait >= deadline or \
+                    not budget.withdraw():
+                logging.error(f'{service} is not available: {e!r}')
+                raise
+            logging.warning(f'{service} failed: {e!r}, retry {attempt}')
+            await asyncio.sleep(wait)
+            continue
+        except asyncio.CancelledError:
+            breaker.cancel()
+            raise
+        except Exception:
+            # Зависимость ответила, ошибка не связана с её доступностью
+            breaker.success()
+            raise
+        breaker.success()
+        return result
+
+
+def backoff(service: str | Callable[..., str],
+            start_sleep_time: float = 0.1,
+            factor: float = 2,
+            border_sleep_time: float = 10,
+            max_tries: int = 3,
+            deadline: float | None = None,
+            exceptions: tuple[type[BaseException], ...] = (
+                    BackoffError, ConnectionError, TimeoutError)):
     """
     Метод для повторного выполнения функции через некоторое время, если
-    возникла ошибка. Использует наивный экспоненциальный рост времени повтора
-    (factor) до граничного времени ожидания (border_sleep_time)
+    возникла ошибка. Используется экспоненциальный рост времени повтора
+    (factor) до граничного времени ожидания (border_sleep_time) со случайной
+    задержкой (full jitter), см. `retry`.
 
     Формула:
-        t = start_sleep_time * 2^(n) if t < border_sleep_time
-        t = border_sleep_time if t >= border_sleep_time
-    :param service: название сервиса
+        t = random(0, start_sleep_time * factor^(n)) if t < border_sleep_time
+        t = random(0, border_sleep_time) if t >= border_sleep_time
+    :param service: название сервиса или функция, которая получает название
+    из аргументов вызова (например, endpoint S3 ноды)
     :param start_sleep_time: начальное время повтора
     :param factor: во сколько раз нужно увеличить время ожидания
     :param border_sleep_time: граничное время ожидания
+    :param max_tries: максимальное количество попыток
+    :param deadline: сколько секунд можно потратить на все попытки
+    :param exceptions: ошибки, после которых есть смысл повторить
     :return: результат выполнения функции
     """
 
     def func_wrapper(func):
         @wraps(func)
         async def inner(*args, **kwargs):
-            new_factor = factor
-            while True:
-                try:
-                    await func(*args, **kwargs)
-                    logging.info(f"Подключение к {service} прошло успешно")
-                    break
-                except (BackoffError, ConnectionError):
-                    logging.error(f'Подключение к {service} не установлено')
-                wait = min(start_sleep_time * 2 ** new_factor,
-                           border_sleep_time)
-                new_factor += 1
-                sleep(wait)
+            name = service(*args, **kwargs) if callable(service) else service
+            return await retry(lambda: func(*args, **kwargs),
+                               name,
+                               start_sleep_time,
+                               factor,
+                               border_sleep_time,
+                               max_tries,
+                               deadline,
+                               exceptions)
         return inner
     return func_wrapper
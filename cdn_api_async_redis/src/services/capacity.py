@@ -0,0 +1,175 @@
+import asyncio
+import logging
+from time import time
+
+from core.config import edge_cache_settings
+from connectors.abstract import AbstractCache
+from models.model import Node
+
+# Accesses kept in memory before they are saved without waiting for the
+# flush interval
+MAX_PENDING = 10000
+
+
+def replicas_key(kind: str, endpoint: str) -> str:
+    """
+    Replicas of the edge, `endpoint` is 'http://host:port' as in progress
+    keys. Kinds: `size` - hash of object sizes, `lru` - sorted set scored by
+    the last access, `lfu` - sorted set scored by decaying number of hits.
+    """
+    return f"replicas:{kind}:{endpoint}"
+
+
+def is_limited(node: Node) -> bool:
+    # Objects are never evicted from origin
+    return node.alias != 'origin' and node.capacity_bytes > 0
+
+
+async def record_replica(cache: AbstractCache,
+                         node: Node,
+                         object_name: str,
+                         size: int) -> None:
+    """
+    Count the object copied to the edge in the capacity of the edge
+    """
+    if not is_limited(node):
+        return
+    endpoint = 'http://' + node.endpoint
+    pipe = await cache.get_pipeline()
+    pipe.hset(replicas_key('size', endpoint), mapping={object_name: size})
+    pipe.zadd(replicas_key('lru', endpoint), {object_name: time()})
+    await pipe.execute()
+
+
+async def forget_replica(cache: AbstractCache,
+                         node: Node,
+                         object_name: str) -> None:
+    endpoint = 'http://' + node.endpoint
+    pipe = await cache.get_pipeline()
+    pipe.hdel(replicas_key('size', endpoint), object_name)
+    pipe.zrem(replicas_key('lru', endpoint), object_name)
+    pipe.zrem(replicas_key('lfu', endpoint), object_name)
+    await pipe.execute()
+
+
+async def get_replicas(cache: AbstractCache,
+                       node: Node) -> tuple[dict[str, int], list[str]]:
+    """
+    Replicas of the edge in order of eviction. Only replicas not accessed
+    for `EDGE_EVICTION_MIN_IDLE` seconds are evicted. With `lfu` policy the
+    least often requested replicas go first and the least recently
+    requested of them break ties, with `lru` - the least recently requested.
+    :return: ({object name: size} of all replicas, candidates to evict)
+    """
+    endpoint = 'http://' + node.endpoint
+    pipe = await cache.get_pipeline()
+    pipe.hgetall(replicas_key('size', endpoint))
+    pipe.zrange(replicas_key('lru', endpoint), 0, -1, withscores=True)
+    pipe.zrange(replicas_key('lfu', endpoint), 0, -1, withscores=True)
+    sizes, accessed, hits = await pipe.execute()
+    sizes = {str(name, 'utf-8'): int(size) for name, size in sizes.items()}
+    accessed = {str(name, 'utf-8'): score for name, score in accessed}
+    hits = {str(name, 'utf-8'): score for name, score in hits}
+
+    border = time() - edge_cache_settings.min_idle
+    candidates = [name for name in sizes if accessed.get(name, 0) < border]
+    if edge_cache_settings.policy == 'lru':
+        candidates.sort(key=lambda name: accessed.get(name, 0))
+    else:
+        candidates.sort(key=lambda name: (hits.get(name, 0),
+                                          accessed.get(name, 0)))
+    return sizes, candidates
+
+
+async def decay_hits(cache: AbstractCache, node: Node) -> None:
+    """
+    Halve hits of all replicas of the edge, so titles that were popular
+    long ago can be evicted
+    """
+    key = replicas_key('lfu', 'http://' + node.endpoint)
+    pipe = await cache.get_pipeline()
+    pipe.zunionstore(key, {key: 0.5})
+    await pipe.execute()
+
+
+class ReplicaTracker:
+    """
+    Frequency and recency of requests to replicas on edges with limited
+    capacity. Requests are counted in memory and saved to the cache in
+    background with one round trip every `flush_interval` seconds, so
+    `object_url` doesn't wait for the cache.
+    """
+
+    def __init__(self, cache: AbstractCache, flush_interval: float = 5):
+        self.cache = cache
+        self.flush_interval = flush_interval
+        # (edge endpoint, object name) -> [hits, last access, size]
+        self._accesses: dict[tuple[str, str], list] = {}
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def touch(self, node: Node, object_name: str, size: int = 0) -> None:
+        """
+        Count request of the object served by the edge. No I/O is done here.
+        :param size: Size of the object if it's known
+        """
+        if not is_limited(node):
+            return
+        key = ('http://' + node.endpoint, object_name)
+        access = self._accesses.get(key)
+        if access is None:
+            access = self._accesses[key] = [0, 0, 0]
+        access[0] += 1
+        access[1] = time()
+        if size:
+            access[2] = size
+        if len(self._accesses) >= MAX_PENDING:
+            self._wake.set()
+
+    async def flush(self) -> None:
+        accesses, self._accesses = self._accesses, {}
+        if not accesses:
+            return
+        pipe = await self.cache.get_pipeline()
+        for (endpoint, object_name), (hits, accessed, size) in \
+                accesses.items():
+            pipe.zadd(replicas_key('lru', endpoint), {object_name: accessed})
+            pipe.zincrby(replicas_key('lfu', endpoint), hits, object_name)
+            if size:
+                # Replicas copied before capacity was limited are counted
+                # when they are requested
+                pipe.hset(replicas_key('size', endpoint),
+                          mapping={object_name: size})
+        try:
+            await pipe.execute()
+        except Exception as e:
+            # Accesses are statistics, they aren't retried
+            logging.warning(f"Replica accesses aren't saved: {e!r}")
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+
+replica_tracker: ReplicaTracker | None = None
+
+
+def touch_replica(node: Node, object_name: str, size: int = 0) -> None:
+    # Tracker isn't started in replication workers
+    if replica_tracker:
+        replica_tracker.touch(node, object_name, size)
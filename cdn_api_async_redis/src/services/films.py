@@ -1,115 +1,143 @@
 import logging
-from datetime import datetime
 
-from apscheduler.schedulers import SchedulerAlreadyRunningError
 from fastapi import HTTPException
 from starlette import status
 
-from connectors.aws_s3 import AWSS3, S3MultipartUpload
-from connectors.minio_s3 import MinioS3
-from connectors.scheduler import jobs, copy_object_to_node
-from core.config import settings
-from helpers.exceptions import object_not_exist, object_already_uploaded
-from helpers.helper_async import get_object, origin_is_alive, \
-    is_scheduler_in_progress
-from models.model import Status
+from connectors.aws_s3 import S3MultipartUpload
+from connectors.minio_s3 import S3_ERRORS
+from connectors.scheduler import drop_head, schedule_replication
+from helpers.availability import get_ranges, head_key, is_reserved
+from helpers.exceptions import object_not_exist, object_already_uploaded, \
+    reserved_object_name
+from helpers.helper_async import head_object, origin_is_alive, \
+    forget_object_meta, get_upload_plan
+from helpers.metrics import OBJECT_URL_STAGE
+from helpers.progress import delete_progress
+from services.backoff import BackoffError
+from services.capacity import forget_replica, touch_replica
+from services.redirects import redirect_cache
 
 
 async def get_client_data(active_nodes, cache, closest_node, object_name,
-                          scheduler):
+                          queue, pool, range_=None):
+    """
+    Choose the node serving the object and queue its copy to the closest
+    edge if it isn't there
+    :param range_: (first byte, last byte) requested by the client, it may
+    be served by the head of the object copied to the edge
+    :return: (client, serving node, object name on the serving node)
+    """
     # Check if object exists in the closest edge location
-    object_ = await get_object(MinioS3,
-                               settings.bucket_name,
-                               object_name,
-                               closest_node)
-    endpoint = closest_node.endpoint
-    access_key = closest_node.access_key_id
-    secret_key = closest_node.secret_access_key
+    edge_alive = True
+    probe = 'origin_probe' if closest_node.alias == 'origin' \
+        else 'edge_probe'
+    try:
+        with OBJECT_URL_STAGE.time(probe):
+            object_ = await head_object(pool,
+                                        closest_node.bucket,
+                                        object_name,
+                                        closest_node)
+    except (BackoffError,) + S3_ERRORS as e:
+        if closest_node.alias == 'origin':
+            raise
+        # Sick edge doesn't stop serving objects from origin
+        logging.error(f"Edge '{closest_node.endpoint}' is not available: "
+                      f"{e!r}")
+        object_, edge_alive = None, False
+    serving_node = closest_node
+    if object_:
+        touch_replica(closest_node, object_name, object_.size)
     # object doesn't exist on edge location
     if not object_ and closest_node.alias != 'origin':
         origin_node = await origin_is_alive(active_nodes)
 
         # Object doesn't exist on origin node too
-        if not await get_object(MinioS3,
-                                settings.bucket_name,
-                                object_name,
-                                origin_node):
+        with OBJECT_URL_STAGE.time('origin_probe'):
+            origin_object = await head_object(pool,
+                                              origin_node.bucket,
+                                              object_name,
+                                              origin_node)
+        if not origin_object:
             # Nothing to be copied. Raise exception
             raise await object_not_exist(object_name,
-                                         settings.bucket_name)
+                                         origin_node.bucket)
 
         # Use endpoint and creds from origin to create url
-        endpoint = origin_node.endpoint
-        access_key = origin_node.access_key_id
-        secret_key = origin_node.secret_access_key
+        serving_node = origin_node
 
-        # Copy object to closest_node using Scheduler
-        storage_data = (cache, closest_node, object_name, "cdn")
-        if not await is_scheduler_in_progress(*storage_data):
-            await jobs(scheduler,
-                       copy_object_to_node,
-                       args=(AWSS3, object_name, origin_node, closest_node,
-                             cache, Status.IN_PROGRESS.value),
-                       next_run_time=datetime.now())
-            try:
-                scheduler.start()
-            except SchedulerAlreadyRunningError as e:
-                logging.info(e)
+        # Copy object to closest_node using Scheduler. Only one replication
+        # of the object to the node runs in the cluster
+        if edge_alive:
+            await schedule_replication(queue,
+                                       object_name,
+                                       closest_node,
+                                       cache)
+            if range_:
+                with OBJECT_URL_STAGE.time('availability'):
+                    held = (await get_ranges(cache, object_name)).get(
+                        closest_node.endpoint)
+                if held and held[0] <= range_[0] and range_[1] <= held[1]:
+                    logging.info(f"Range {range_} of '{object_name}' is "
+                                 f"served by its head on "
+                                 f"'{closest_node.endpoint}'")
+                    return pool.minio(closest_node), closest_node, \
+                        head_key(object_name)
 
     # object doesn't exist on origin location
     elif not object_ and closest_node.alias == 'origin':
         # Nothing to be copied. Raise exception
-        raise await object_not_exist(object_name, settings.bucket_name)
-    client = MinioS3(endpoint=endpoint,
-                     access_key=access_key,
-                     secret_key=secret_key,
-                     secure=False)
-    return client, endpoint
+        raise await object_not_exist(object_name, closest_node.bucket)
+    client = pool.minio(serving_node)
+    return client, serving_node, object_name
 
 
-async def get_multipart_upload_client_data(cache, file_upload, filename,
-                                           origin_node):
+async def get_multipart_upload_client_data(cache, filename, content_type,
+                                           total_bytes, origin_node, pool):
+    # Every upload starts here: API, streamed and session uploads
+    if is_reserved(filename):
+        raise reserved_object_name
     await object_already_uploaded(cache,
                                   origin_node,
                                   filename,
                                   collection="api")
     endpoint = 'http://' + origin_node.endpoint
-    origin_client_dict = {
-        'endpoint': endpoint,
-        'aws_access_key_id': origin_node.access_key_id,
-        'aws_secret_access_key': origin_node.secret_access_key,
-        'verify': False}
+    mpu_id, part_size = await get_upload_plan(endpoint, filename, cache)
     origin_client: S3MultipartUpload = S3MultipartUpload(
-        settings.bucket_name,
+        origin_node.bucket,
         filename,
-        content_type=file_upload.content_type,
-        total_bytes=file_upload.size,
-        **origin_client_dict)
-    return endpoint, origin_client
+        content_type=content_type,
+        total_bytes=total_bytes,
+        part_size=part_size,
+        endpoint=endpoint,
+        client=await pool.aws(origin_node))
+    return origin_client, mpu_id
 
 
-async def process_deleting_object(active_nodes, cache, object_name):
+async def process_deleting_object(active_nodes, cache, object_name, pool):
+    if is_reserved(object_name):
+        raise reserved_object_name
     endpoints = []
     for node in active_nodes.values():
-        object_ = await get_object(MinioS3,
-                                   settings.bucket_name,
-                                   object_name,
-                                   node)
+        object_ = await head_object(pool,
+                                    node.bucket,
+                                    object_name,
+                                    node)
         if not object_:
             logging.info(f"{object_name} doesn't exist on {node.endpoint}")
             continue
-        client = MinioS3(endpoint=node.endpoint,
-                         access_key=node.access_key_id,
-                         secret_key=node.secret_access_key,
-                         secure=False)
-        await client.remove_object(settings.bucket_name,
+        client = pool.minio(node)
+        await client.remove_object(node.bucket,
                                    object_name)
         endpoint = 'http://' + node.endpoint
         endpoints.append(endpoint)
         key_api = f"api^{object_name}^{endpoint}"
         key_cdn = f"cdn^{object_name}^{endpoint}"
-        await cache.delete_from_cache_by_id(key_api)
-        await cache.delete_from_cache_by_id(key_cdn)
+        await delete_progress(cache, key_api, key_cdn)
+        await forget_replica(cache, node, object_name)
+    for node in active_nodes.values():
+        await drop_head(cache, node, object_name)
+    await forget_object_meta(object_name, active_nodes.values())
+    await redirect_cache.invalidate(cache, object_name, active_nodes.values())
     if not endpoints:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
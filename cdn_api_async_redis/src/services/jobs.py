@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import os
+import tempfile
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+
+from aiofiles import open
+from fastapi import HTTPException, status
+
+from connectors.abstract import AbstractCache
+from connectors.aws_s3 import S3MultipartUpload
+from helpers.progress import save_progress
+from models.model import Status
+from services.service import multipart_upload
+
+# Staged body is copied to disk by chunks of this size
+STAGE_CHUNK = 1024 * 1024
+
+
+@dataclass
+class UploadJob:
+    job_id: str
+    cache: AbstractCache
+    upload_client: S3MultipartUpload
+    mpu_id: str | None
+    path: str
+    size: int
+
+    @property
+    def key(self) -> str:
+        return f"api^{self.upload_client.key}^{self.upload_client.endpoint}"
+
+
+class UploadJobs:
+    """
+    Background uploads. Request body is staged to a local file, the client
+    gets 202 with job id right away, and the file is uploaded to S3 by one of
+    `workers` tasks. New jobs are rejected when the worker already has
+    `max_jobs` jobs or `max_bytes` staged bytes.
+    """
+
+    def __init__(self,
+                 workers: int = 2,
+                 max_jobs: int = 16,
+                 max_bytes: int = 10 * 1024 ** 3,
+                 directory: str | None = None):
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self.max_bytes = max_bytes
+        self.directory = directory or tempfile.gettempdir()
+        self.jobs = 0
+        self.staged_bytes = 0
+        self._queue: asyncio.Queue[UploadJob] = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+
+    def admit(self, size: int) -> None:
+        """
+        Reserve room for the job or raise 503
+        :param size: Body size in bytes
+        """
+        if self.jobs >= self.max_jobs or \
+                self.jobs and self.staged_bytes + size > self.max_bytes:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many uploads in progress. Please retry later",
+                headers={"WWW-Authenticate": "Bearer",
+                         "Retry-After": "60"},
+            )
+        self.jobs += 1
+        self.staged_bytes += size
+
+    def release(self, size: int) -> None:
+        self.jobs -= 1
+        self.staged_bytes -= size
+
+    async def submit(self,
+                     cache: AbstractCache,
+                     upload_client: S3MultipartUpload,
+                     mpu_id: str | None,
+                     reader) -> str:
+        """
+        Stage the body and queue the upload
+        :param reader: Object with async `read(size)`, e.g. UploadFile
+        :return: Job id
+        """
+        size = upload_client.total_bytes
+        self.admit(size)
+        job_id = uuid.uuid4().hex
+        path = os.path.join(self.directory, f"upload-{job_id}")
+        try:
+            async with open(path, "wb") as file:
+                while data := await reader.read(STAGE_CHUNK):
+                    await file.write(data)
+            job = UploadJob(job_id, cache, upload_client, mpu_id, path, size)
+            await save_progress(
+                cache,
+                job.key,
+                {"job_id": job_id,
+                 "size": size,
+                 "uploaded": 0,
+                 "last_modified": str(datetime.utcnow()),
+                 "status": Status.QUEUED.value})
+        except BaseException:
+            self.release(size)
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        await self._queue.put(job)
+        logging.info(f"Upload job '{job_id}' for '{upload_client.key}' "
+                     f"queued")
+        return job_id
+
+    async def _run(self, job: UploadJob) -> None:
+        try:
+            async with open(job.path, "rb") as file:
+                await multipart_upload(job.cache,
+                                       job.upload_client,
+                                       status=Status.IN_PROGRESS.value,
+                                       object_=file,
+                                       mpu_id=job.mpu_id)
+            logging.info(f"Upload job '{job.job_id}' finished")
+        except Exception as e:
+            logging.error(f"Upload job '{job.job_id}' failed: {e}")
+            # mpu_id stays in the record, so the upload can be resumed
+            await save_progress(
+                job.cache,
+                job.key,
+                {"last_modified": str(datetime.utcnow()),
+                 "status": Status.FAILED.value})
+        finally:
+            os.remove(job.path)
+            self.release(job.size)
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._work())
+                       for _ in range(self.workers)]
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Queued jobs can't be resumed, client has to upload them again
+        while not self._queue.empty():
+            job = self._queue.get_nowait()
+            os.remove(job.path)
+            self.release(job.size)
+            await save_progress(
+                job.cache,
+                job.key,
+                {"last_modified": str(datetime.utcnow()),
+                 "status": Status.FAILED.value})
+
+
+upload_jobs: UploadJobs | None = None
+
+
+async def get_upload_jobs() -> UploadJobs:
+    # Set on the application start up
+    assert upload_jobs is not None
+    return upload_jobs
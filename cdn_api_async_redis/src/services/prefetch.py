@@ -0,0 +1,178 @@
+import asyncio
+import logging
+from collections import defaultdict
+from time import time
+from zlib import crc32
+
+from core.config import prefetch_settings
+from connectors.abstract import AbstractCache
+from models.model import Node
+
+# Requests kept in memory before they are saved without waiting for the
+# flush interval
+MAX_PENDING = 10000
+
+
+def region_of(node: Node) -> str:
+    # Node without region is a region of its own
+    return node.region or node.alias
+
+
+def demand_key(kind: str, region: str, window: int) -> str:
+    """
+    Demand of the region in the window. Kinds: `cms` - hash with counters of
+    count-min sketch, `hot` - sorted set of objects requested at least
+    `PREFETCH_THRESHOLD` times scored by the estimate.
+    """
+    return f"prefetch:{kind}:{region}:{window}"
+
+
+def sketch_fields(object_name: str, width: int, depth: int) -> list[str]:
+    return [f"{row}:{crc32(f'{row}:{object_name}'.encode()) % width}"
+            for row in range(depth)]
+
+
+class DemandCounter:
+    """
+    Requests of objects per region counted in count-min sketches in the
+    cache, one sketch per region and window of `PREFETCH_WINDOW` seconds.
+    Sketch takes `PREFETCH_SKETCH_WIDTH * PREFETCH_SKETCH_DEPTH` counters
+    however many objects are requested and never underestimates. Requests
+    are counted in memory and saved in background every `flush_interval`
+    seconds, objects that reached the threshold are kept in the top-K set
+    of the region.
+    """
+
+    def __init__(self, cache: AbstractCache, flush_interval: float = 5):
+        self.cache = cache
+        self.flush_interval = flush_interval
+        # (region, object name) -> requests
+        self._counts: defaultdict[tuple[str, str], int] = defaultdict(int)
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def count(self, node: Node, object_name: str) -> None:
+        """
+        Count request of the object from clients of the node. No I/O is done
+        here.
+        """
+        self._counts[(region_of(node), object_name)] += 1
+        if len(self._counts) >= MAX_PENDING:
+            self._wake.set()
+
+    async def flush(self) -> None:
+        counts, self._counts = self._counts, defaultdict(int)
+        if not counts:
+            return
+        window = int(time() // prefetch_settings.window)
+        try:
+            pipe = await self.cache.get_pipeline()
+            for (region, object_name), requests in counts.items():
+                key = demand_key('cms', region, window)
+                for field in sketch_fields(object_name,
+                                           prefetch_settings.sketch_width,
+                                           prefetch_settings.sketch_depth):
+                    pipe.hincrby(key, field, requests)
+            for region in {region for region, _ in counts}:
+                pipe.expire(demand_key('cms', region, window),
+                            2 * prefetch_settings.window)
+            results = iter(await pipe.execute())
+
+            hot: defaultdict[str, dict[str, int]] = defaultdict(dict)
+            for region, object_name in counts:
+                estimate = min(next(results) for _ in
+                               range(prefetch_settings.sketch_depth))
+                if estimate >= prefetch_settings.threshold:
+                    hot[region][object_name] = estimate
+            if not hot:
+                return
+            pipe = await self.cache.get_pipeline()
+            for region, objects in hot.items():
+                key = demand_key('hot', region, window)
+                pipe.zadd(key, objects)
+                pipe.zremrangebyrank(key, 0, -prefetch_settings.top_k - 1)
+                pipe.expire(key, 2 * prefetch_settings.window)
+            await pipe.execute()
+        except Exception as e:
+            # Demand is statistics, it isn't retried
+            logging.warning(f"Demand isn't saved: {e!r}")
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+
+async def get_trending(cache: AbstractCache,
+                       regions: set[str]) -> dict[str, dict[str, int]]:
+    """
+    Objects requested at least `PREFETCH_THRESHOLD` times in the current or
+    the previous window, so trends don't disappear when a window starts
+    :return: {region: {object name: requests}}
+    """
+    window = int(time() // prefetch_settings.window)
+    ordered = sorted(regions)
+    pipe = await cache.get_pipeline()
+    for region in ordered:
+        for window_ in (window - 1, window):
+            pipe.zrange(demand_key('hot', region, window_), 0, -1,
+                        withscores=True)
+    results = iter(await pipe.execute())
+    trending = {}
+    for region in ordered:
+        objects: dict[str, int] = {}
+        for _ in range(2):
+            for object_name, estimate in next(results):
+                name = str(object_name, 'utf-8')
+                objects[name] = max(objects.get(name, 0), int(estimate))
+        trending[region] = objects
+    return trending
+
+
+def prefetch_candidates(trending: dict[str, dict[str, int]],
+                        region: str) -> list[str]:
+    """
+    Objects to copy to edges of the region, most requested first: objects
+    trending in the region and objects trending in at least
+    `PREFETCH_SPREAD_REGIONS` other regions, before anyone asks for them
+    here
+    """
+    demand: dict[str, float] = dict(trending.get(region, {}))
+    spread = prefetch_settings.spread_regions
+    if spread:
+        elsewhere: defaultdict[str, list[int]] = defaultdict(list)
+        for other, objects in trending.items():
+            if other == region:
+                continue
+            for object_name, requests in objects.items():
+                elsewhere[object_name].append(requests)
+        for object_name, requests_by_region in elsewhere.items():
+            if len(requests_by_region) >= spread and \
+                    object_name not in demand:
+                # Behind the objects requested here with the same demand
+                demand[object_name] = min(requests_by_region) - 0.5
+    return sorted(demand, key=lambda name: demand[name],
+                  reverse=True)[:prefetch_settings.top_k]
+
+
+demand_counter: DemandCounter | None = None
+
+
+def count_demand(node: Node, object_name: str) -> None:
+    # Counter isn't started when prefetch is disabled
+    if demand_counter:
+        demand_counter.count(node, object_name)
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from time import monotonic
+
+from starlette.requests import Request
+
+from core.config import rl
+from connectors.abstract import AbstractCache
+from helpers.client import client_ip
+from helpers.exceptions import too_many_requests
+from helpers.metrics import RATE_LIMITED
+
+
+@dataclass(slots=True)
+class Bucket:
+    tokens: float
+    updated: float
+    # Requests allowed here and not counted in the cache yet
+    unsynced: int = 0
+    # Requests of all instances in the sliding window at the last sync
+    remote: float = 0
+    synced: float = float('-inf')
+
+
+class RateLimiter:
+    """
+    Requests limit per client and route. Every instance allows requests with
+    a local token bucket (refilled with `limit / window` tokens per second,
+    so there are no bursts at window boundaries) and counts them in the
+    sliding window in the cache in background, once per `sync_interval`
+    seconds or `sync_batch` requests of a client. Request doesn't wait for
+    the cache, so the cluster may go over the limit by the requests allowed
+    between two syncs.
+    """
+
+    def __init__(self,
+                 cache: AbstractCache,
+                 limit: int,
+                 window: float = 60,
+                 routes: dict[str, int] | None = None,
+                 sync_interval: float = 1,
+                 sync_batch: int = 10):
+        self.cache = cache
+        self.limit = limit
+        self.window = window
+        self.routes = routes or {}
+        self.sync_interval = sync_interval
+        self.sync_batch = sync_batch
+        self.buckets: dict[tuple[str, str], Bucket] = {}
+        self._dirty: set[tuple[str, str]] = set()
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def allow(self, route: str, client: str) -> bool:
+        """
+        Take a token for the request. No I/O is done here.
+        :param route: Name of the route, see `routes`
+        :param client: Client IP
+        """
+        limit = self.routes.get(route, self.limit)
+        if limit <= 0:
+            return True
+        now = monotonic()
+        key = (route, client)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = Bucket(tokens=limit, updated=now)
+        bucket.tokens = min(limit, bucket.tokens +
+                            (now - bucket.updated) * limit / self.window)
+        bucket.updated = now
+        if bucket.tokens < 1 or bucket.remote + bucket.unsynced >= limit:
+            # Refresh count of the cluster, the window moves on
+            if now - bucket.synced >= self.sync_interval:
+                self._dirty.add(key)
+            return False
+        bucket.tokens -= 1
+        bucket.unsynced += 1
+        self._dirty.add(key)
+        if bucket.unsynced >= self.sync_batch:
+            self._wake.set()
+        return True
+
+    async def sync(self) -> None:
+        """
+        Count allowed requests in the cache with one round trip and get
+        requests of all instances
+        """
+        keys, self._dirty = self._dirty, set()
+        counts = {}
+        for key in keys:
+            bucket = self.buckets.get(key)
+            if bucket:
+                counts[key] = bucket.unsynced
+                bucket.unsynced = 0
+        if not counts:
+            return
+        try:
+            estimates = await self.cache.add_to_windows(
+                {'{rl:%s:%s}' % key: count for key, count in counts.items()},
+                self.window)
+        except Exception as e:
+            logging.warning(f"Rate limit isn't synced: {e!r}")
+            # Local buckets still work, count the requests with the next sync
+            for key, count in counts.items():
+                if bucket := self.buckets.get(key):
+                    bucket.unsynced += count
+                    self._dirty.add(key)
+            return
+        now = monotonic()
+        for key, estimate in zip(counts, estimates.values()):
+            if bucket := self.buckets.get(key):
+                bucket.remote = estimate
+                bucket.synced = now
+
+    def prune(self) -> None:
+        # Full buckets of idle clients are the same as new buckets
+        border = monotonic() - self.window
+        for key in [key for key, bucket in self.buckets.items()
+                    if bucket.updated < border and key not in self._dirty]:
+            del self.buckets[key]
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.sync_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.sync()
+            self.prune()
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+rate_limiter: RateLimiter | None = None
+
+
+async def rate_limit(request: Request):
+    """
+    Ограничение количества запросов к серверу (Rate limit) на клиента и
+    маршрут. Запросы, которые не прошли лимит, получат HTTP-статус
+    429 Too Many Requests. Запрос не ждёт Redis, см. `RateLimiter`.
+    :param request: Из request получим IP клиента и маршрут
+    :return:
+    """
+    # Limiter is started on startup when the limit is enabled
+    if not rl.is_rate_limit or rate_limiter is None:
+        return
+    endpoint = request.scope.get('endpoint')
+    route = getattr(endpoint, '__name__', request.url.path)
+    if not rate_limiter.allow(route, client_ip(request)):
+        RATE_LIMITED.inc(route)
+        raise too_many_requests
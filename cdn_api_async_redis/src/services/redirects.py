@@ -0,0 +1,88 @@
+import logging
+from typing import Iterable
+
+import orjson
+
+from core.config import redirect_settings, settings
+from connectors.abstract import AbstractCache
+from helpers.cache import MISSING, TTLCache
+from models.model import Node
+
+
+class RedirectCache:
+    """
+    Two-tier cache of redirect decisions:
+    (object name, closest node) -> (serving endpoint, presigned URL).
+    In-process LRU answers repeated requests without any I/O, Redis shares
+    decisions between workers. Entries live shorter than presigned URLs, so
+    a cached URL is still valid when the client follows it. In-process
+    entries of other workers are not invalidated, so their TTL is short.
+    """
+
+    def __init__(self,
+                 maxsize: int,
+                 local_ttl: float,
+                 ttl: int,
+                 url_expire: int):
+        # Cached URL must stay valid at least half of its life time
+        self.ttl = max(1, min(ttl, url_expire // 2))
+        self.local = TTLCache(maxsize, min(local_ttl, self.ttl))
+
+    @staticmethod
+    def key(object_name: str, node: Node) -> str:
+        return f"redirect:{node.endpoint}:{object_name}"
+
+    async def get(self,
+                  cache: AbstractCache,
+                  object_name: str,
+                  node: Node) -> tuple[str, str] | None:
+        """
+        Get cached decision
+        :return: (endpoint, url) or None
+        """
+        key = self.key(object_name, node)
+        decision = self.local.get(key)
+        if decision is not MISSING:
+            return decision
+
+        data = await cache.get_from_cache_by_id(key)
+        if not data:
+            return None
+        decision = tuple(orjson.loads(data))
+        self.local.set(key, decision)
+        return decision
+
+    async def put(self,
+                  cache: AbstractCache,
+                  object_name: str,
+                  node: Node,
+                  endpoint: str,
+                  url: str) -> None:
+        key = self.key(object_name, node)
+        self.local.set(key, (endpoint, url))
+        await cache.put_to_cache_by_id(key,
+                                       orjson.dumps((endpoint, url)),
+                                       self.ttl)
+
+    async def invalidate(self,
+                         cache: AbstractCache,
+                         object_name: str,
+                         nodes: Iterable[Node]) -> None:
+        """
+        Remove decisions for the object made for any of the nodes
+        """
+        keys = [self.key(object_name, node) for node in nodes]
+        if not keys:
+            return
+        for key in keys:
+            self.local.pop(key)
+        pipe = await cache.get_pipeline()
+        pipe.delete(*keys)
+        await pipe.execute()
+        logging.info(f"Redirect cache invalidated for '{object_name}'")
+
+
+redirect_cache = RedirectCache(redirect_settings.cache_size,
+                               redirect_settings.local_ttl,
+                               redirect_settings.ttl,
+                               settings.presigned_url_expire_in_seconds)
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+from collections import defaultdict
+
+from connectors.abstract import AbstractCache, AbstractQueue
+from connectors.scheduler import replicate_to_node
+from models.model import QueueItem
+
+# Seconds to wait for a task before the queue is polled again
+POLL_INTERVAL = 5
+# Tasks taken from the queue per worker, tasks waiting for a busy edge don't
+# keep tasks of other edges in the queue
+HELD_PER_WORKER = 4
+
+
+class ReplicationWorkers:
+    """
+    Consumers of the replication queue. At most `workers` copies run at the
+    same time, at most `per_edge` of them to the same edge. Task waits for
+    its edge before it takes a worker, so a slow edge doesn't stop copies
+    to other edges. Up to `HELD_PER_WORKER * workers` tasks are taken from
+    the queue. Taken task is touched in the queue every `touch_interval`
+    seconds until it's acknowledged when the copy is finished or returned to
+    the queue when it failed.
+    """
+
+    def __init__(self,
+                 queue: AbstractQueue,
+                 cache: AbstractCache,
+                 workers: int = 4,
+                 per_edge: int = 2,
+                 touch_interval: float = 100):
+        self.queue = queue
+        self.cache = cache
+        self.per_edge = per_edge
+        self.touch_interval = touch_interval
+        self.max_held = HELD_PER_WORKER * workers
+        self._slots = asyncio.Semaphore(workers)
+        self._room = asyncio.Event()
+        self._edges: defaultdict[str, asyncio.Semaphore] = defaultdict(
+            lambda: asyncio.Semaphore(self.per_edge))
+        self._running: set[asyncio.Task] = set()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def busy(self) -> int:
+        # Tasks taken from the queue and not finished yet
+        return len(self._running)
+
+    async def _touch(self, item: QueueItem) -> None:
+        while True:
+            await asyncio.sleep(self.touch_interval)
+            try:
+                await self.queue.touch(item)
+            except Exception as e:
+                logging.error(f"Can't touch replication task: {e!r}")
+
+    async def _process(self, item: QueueItem) -> None:
+        # Task is claimed by another consumer if it isn't touched, e.g. while
+        # it waits for the edge or copies a big object
+        touching = asyncio.create_task(self._touch(item))
+        task = item.task
+        if item.attempts:
+            # Lock of the previous attempt may be held by a consumer that is
+            # still copying, the token of the task must not take it over
+            task = {**task, "token": None}
+        try:
+            async with self._edges[task["edge"]], self._slots:
+                await replicate_to_node(self.cache, task)
+            await self.queue.ack(item)
+        except Exception as e:
+            logging.error(f"Replication {item.task} failed: {e!r}")
+            try:
+                await self.queue.retry(item)
+            except Exception as e:
+                # Task stays pending and is claimed again later
+                logging.error(f"Can't return task to the queue: {e!r}")
+        finally:
+            touching.cancel()
+
+    def _done(self, task: asyncio.Task) -> None:
+        self._running.discard(task)
+        self._room.set()
+
+    async def _consume(self) -> None:
+        while True:
+            while len(self._running) >= self.max_held:
+                self._room.clear()
+                await self._room.wait()
+            try:
+                items = await self.queue.get(1, POLL_INTERVAL)
+            except Exception as e:
+                logging.error(f"Can't read replication queue: {e!r}")
+                await asyncio.sleep(POLL_INTERVAL)
+                continue
+            # Queue may return more tasks than asked, e.g. one of every
+            # priority, all of them are processed
+            for item in items:
+                task = asyncio.create_task(self._process(item))
+                self._running.add(task)
+                task.add_done_callback(self._done)
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._consume())
+
+    async def close(self) -> None:
+        # Unfinished tasks aren't acknowledged and are claimed again
+        tasks = [*self._running]
+        if self._task:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+replication_workers: ReplicationWorkers | None = None
@@ -5,7 +5,10 @@ from fastapi import UploadFile
 
 from connectors.abstract import AbstractS3, AbstractCache
 from connectors.aws_s3 import S3MultipartUpload
+from helpers.helper_async import get_active_nodes, forget_object_meta
+from helpers.progress import save_progress
 from models.model import Status
+from services.redirects import redirect_cache
 
 
 async def multipart_upload(cache: AbstractCache,
@@ -17,7 +20,7 @@ async def multipart_upload(cache: AbstractCache,
                            collection: str = "api",
                            mpu_id: str = None,
                            ):
-    async with upload_client.client as s3:
+    async with upload_client.connect() as s3:
         if mpu_id:
             logging.info(f"Continuing upload with id={mpu_id}")
             finished_parts: list = await upload_client.get_uploaded_parts(
@@ -53,14 +56,28 @@ async def multipart_upload(cache: AbstractCache,
         # Complete object upload
         res = await upload_client.complete(s3, mpu_id, parts)
 
+    await finish_upload(cache, upload_client, collection)
+    logging.info(f"Upload completed with metadata: "
+                 f"{res}")
+    return res
+
+
+async def finish_upload(cache: AbstractCache,
+                        upload_client: S3MultipartUpload,
+                        collection: str) -> None:
+    """
+    Mark object as uploaded to the node
+    """
     # Uploading finished status to cache
     object_name = upload_client.key
     status_ = Status.FINISHED.value
     key = f"{collection}^{object_name}^{upload_client.endpoint}"
     entity = {"last_modified": str(datetime.utcnow()),
               "status": status_}
-    await cache.put_to_cache_by_key(key, entity)
-
-    logging.info(f"Upload completed with metadata: "
-                 f"{res}")
-    return res
+    await save_progress(cache, key, entity)
+    # Object became available on the node, forget redirects to other nodes
+    active_nodes = await get_active_nodes()
+    await forget_object_meta(object_name, active_nodes.values())
+    await redirect_cache.invalidate(cache,
+                                    object_name,
+                                    active_nodes.values())
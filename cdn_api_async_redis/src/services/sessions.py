@@ -0,0 +1,179 @@
+import logging
+from datetime import datetime
+
+from botocore.exceptions import ClientError
+from fastapi import HTTPException, status
+
+from connectors.abstract import AbstractCache
+from connectors.aws_s3 import S3MultipartUpload
+from connectors.pool import S3Pool
+from core.config import settings, upload_settings
+from helpers.progress import delete_progress, save_progress
+from models.model import Node, PartUrl, Status, UploadSession, \
+    UploadSessionIn
+from services.films import get_multipart_upload_client_data
+from services.service import finish_upload
+
+# Upload sessions: client uploads parts straight to origin S3 with presigned
+# URLs, the API only creates and completes multipart upload.
+
+
+async def presign_parts(client: S3MultipartUpload,
+                        s3,
+                        mpu_id: str,
+                        first: int,
+                        count: int) -> list[PartUrl]:
+    last = min(first + min(count, upload_settings.session_urls),
+               client.parts_count() + 1)
+    return [PartUrl(part_number=number,
+                    url=await client.presign_part(
+                        s3, mpu_id, number,
+                        settings.presigned_url_expire_in_seconds))
+            for number in range(max(first, 1), last)]
+
+
+async def create_session(cache: AbstractCache,
+                         data: UploadSessionIn,
+                         origin_node: Node,
+                         pool: S3Pool) -> UploadSession:
+    """
+    Start multipart upload or continue the unfinished one
+    :return: Session with URLs for the first parts
+    """
+    client, mpu_id = await get_multipart_upload_client_data(
+        cache,
+        data.object_name,
+        data.content_type,
+        data.size,
+        origin_node,
+        pool)
+    async with client.connect() as s3:
+        uploaded = []
+        if mpu_id:
+            try:
+                uploaded = await client.get_uploaded_parts(s3, mpu_id)
+                logging.info(f"Continuing upload session with id={mpu_id}")
+            except ClientError as e:
+                # Upload was aborted, start a new one
+                logging.info(e)
+                mpu_id = None
+        if not mpu_id:
+            client.part_bytes = client.plan_part_size(client.total_bytes)
+            mpu_id = await client.create(s3)
+            logging.info(f"Starting upload session with id={mpu_id}")
+
+        key = f"api^{client.key}^{client.endpoint}"
+        await save_progress(
+            cache,
+            key,
+            {"mpu_id": mpu_id,
+             "part_size": client.part_bytes,
+             "size": client.total_bytes,
+             "uploaded": sum(p["Size"] for p in uploaded),
+             "last_modified": str(datetime.utcnow()),
+             "status": Status.IN_PROGRESS.value})
+
+        return UploadSession(
+            object_name=client.key,
+            upload_id=mpu_id,
+            size=client.total_bytes,
+            part_size=client.part_bytes,
+            parts_count=client.parts_count(),
+            uploaded_parts=[p["PartNumber"] for p in uploaded],
+            urls=await presign_parts(client, s3, mpu_id, 1,
+                                     upload_settings.session_urls))
+
+
+async def get_session_client(cache: AbstractCache,
+                             object_name: str,
+                             origin_node: Node,
+                             pool: S3Pool
+                             ) -> tuple[S3MultipartUpload, str]:
+    """
+    Restore client of the session from the progress record
+    :return: (client, mpu_id)
+    """
+    endpoint = 'http://' + origin_node.endpoint
+    res = await cache.get_from_cache_by_key(f"api^{object_name}^{endpoint}")
+    if not res or b'mpu_id' not in res or b'part_size' not in res or \
+            str(res[b'status'], 'utf-8') != Status.IN_PROGRESS.value:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Upload session for {object_name} not found.",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    client = S3MultipartUpload(origin_node.bucket,
+                               object_name,
+                               total_bytes=int(res[b'size']),
+                               part_size=int(res[b'part_size']),
+                               endpoint=endpoint,
+                               client=await pool.aws(origin_node))
+    return client, str(res[b'mpu_id'], 'utf-8')
+
+
+async def get_session_urls(cache: AbstractCache,
+                           object_name: str,
+                           origin_node: Node,
+                           pool: S3Pool,
+                           first: int,
+                           count: int) -> UploadSession:
+    client, mpu_id = await get_session_client(cache, object_name,
+                                              origin_node, pool)
+    # Session that gets URLs is alive, the abort sweep must not take it for
+    # a stale upload
+    await save_progress(
+        cache,
+        f"api^{client.key}^{client.endpoint}",
+        {"last_modified": str(datetime.utcnow()),
+         "status": Status.IN_PROGRESS.value})
+    async with client.connect() as s3:
+        return UploadSession(
+            object_name=object_name,
+            upload_id=mpu_id,
+            size=client.total_bytes,
+            part_size=client.part_bytes,
+            parts_count=client.parts_count(),
+            urls=await presign_parts(client, s3, mpu_id, first, count))
+
+
+async def complete_session(cache: AbstractCache,
+                           object_name: str,
+                           origin_node: Node,
+                           pool: S3Pool) -> dict:
+    """
+    Complete multipart upload when all parts are uploaded. Uploaded parts are
+    taken from S3, not from the client.
+    """
+    client, mpu_id = await get_session_client(cache, object_name,
+                                              origin_node, pool)
+    async with client.connect() as s3:
+        parts = await client.get_uploaded_parts(s3, mpu_id)
+        uploaded = {p["PartNumber"] for p in parts}
+        missing = [number for number in range(1, client.parts_count() + 1)
+                   if number not in uploaded]
+        if missing or sum(p["Size"] for p in parts) != client.total_bytes:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Upload of {object_name} isn't finished, missing "
+                       f"parts: {missing[:100]}",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        res = await client.complete(
+            s3, mpu_id,
+            [{"PartNumber": p["PartNumber"], "ETag": p["ETag"]}
+             for p in sorted(parts, key=lambda p: p["PartNumber"])])
+
+    await finish_upload(cache, client, "api")
+    logging.info(f"Upload session completed with metadata: {res}")
+    return res
+
+
+async def abort_session(cache: AbstractCache,
+                        object_name: str,
+                        origin_node: Node,
+                        pool: S3Pool) -> None:
+    client, mpu_id = await get_session_client(cache, object_name,
+                                              origin_node, pool)
+    async with client.connect() as s3:
+        await client.abort_multipart_upload(s3, mpu_id)
+    await delete_progress(cache, f"api^{object_name}^{client.endpoint}")
@@ -0,0 +1,20 @@
+"""
+Tests run offline from `cdn_api_async_redis/src`: `python -m pytest tests`.
+Settings get defaults here, values from the environment and `.env` win.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+for name, value in {'PROJECT_NAME': 'cdn-test',
+                    'HOST_CDN': '127.0.0.1',
+                    'PORT_CDN': '8000',
+                    'BUCKET_NAME': 'video',
+                    'UPLOAD_PART_SIZE': str(8 * 1024 ** 2),
+                    'IPAPI_KEY': '',
+                    'REDIS_HOST': '127.0.0.1',
+                    'REDIS_PORT': '6379',
+                    'CACHE_EXPIRE_IN_SECONDS': '3600',
+                    'GEOIP_USE_IPAPI': 'False'}.items():
+    os.environ.setdefault(name, value)
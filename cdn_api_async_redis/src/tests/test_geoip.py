@@ -0,0 +1,86 @@
+import asyncio
+import os
+
+from connectors.abstract import AbstractGeoResolver
+from connectors.geoip import CachedGeoResolver, ChainGeoResolver, \
+    GeoLookupError, LocalGeoResolver
+
+DATABASE = os.path.join(os.path.dirname(__file__), 'geoip.csv')
+PRAGUE = (50.0874654, 14.4212535)
+NEW_YORK = (40.7127281, -74.0060152)
+
+
+def resolve_locally(*ips: str) -> list:
+    async def resolve() -> list:
+        resolver = LocalGeoResolver(DATABASE)
+        await resolver.load()
+        return [await resolver.resolve(ip) for ip in ips]
+    return asyncio.run(resolve())
+
+
+class FlakyResolver(AbstractGeoResolver):
+    """
+    Fails the first `failures` lookups, then knows only `known` addresses
+    """
+
+    def __init__(self, known: dict, failures: int = 0):
+        self.known = known
+        self.failures = failures
+        self.calls = 0
+
+    async def resolve(self, ip: str):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise GeoLookupError('ipapi.co is not available')
+        return self.known.get(ip)
+
+    async def close(self):
+        ...
+
+
+def test_known_addresses():
+    assert resolve_locally('137.0.10.20', '198.51.100.1',
+                           '2001:db8:1::7') == [PRAGUE, NEW_YORK, PRAGUE]
+
+
+def test_range_borders():
+    assert resolve_locally('137.0.0.0', '137.0.255.255',
+                           '137.1.0.0') == [PRAGUE, PRAGUE, None]
+
+
+def test_unknown_addresses():
+    assert resolve_locally('8.8.8.8', '2001:db8:2::1',
+                           'not an ip') == [None, None, None]
+
+
+def test_networks_without_coordinates_are_skipped():
+    assert resolve_locally('198.51.100.200') == [None]
+
+
+def test_chain_asks_next_resolver_for_unknown_address():
+    async def resolve():
+        local = LocalGeoResolver(DATABASE)
+        await local.load()
+        remote = FlakyResolver({'8.8.8.8': NEW_YORK})
+        chain = ChainGeoResolver(local, remote)
+        return [await chain.resolve('137.0.0.1'),
+                await chain.resolve('8.8.8.8')], remote.calls
+    assert asyncio.run(resolve()) == ([PRAGUE, NEW_YORK], 1)
+
+
+def test_not_found_is_cached():
+    async def resolve():
+        backend = FlakyResolver({})
+        cached = CachedGeoResolver(backend, 10, ttl=3600, error_ttl=0)
+        return [await cached.resolve('8.8.8.8') for _ in range(2)], \
+            backend.calls
+    assert asyncio.run(resolve()) == ([None, None], 1)
+
+
+def test_failed_lookup_is_cached_only_for_error_ttl():
+    async def resolve():
+        backend = FlakyResolver({'8.8.8.8': NEW_YORK}, failures=1)
+        cached = CachedGeoResolver(backend, 10, ttl=3600, error_ttl=0)
+        return [await cached.resolve('8.8.8.8') for _ in range(3)], \
+            backend.calls
+    assert asyncio.run(resolve()) == ([None, NEW_YORK, NEW_YORK], 2)
@@ -0,0 +1,42 @@
+import asyncio
+import json
+import os
+
+from helpers import metrics
+from helpers.metrics import MetricsFiles
+
+
+def test_metrics_of_all_workers_are_summed(tmp_path):
+    metrics.RATE_LIMITED.inc('object_url', value=2)
+    metrics.REDIS_ROUND_TRIPS.observe(1, 'object_url')
+    metrics.QUEUE_DEPTH.set(7)
+    files = MetricsFiles(str(tmp_path))
+    # Another worker saved its metrics, including a gauge that isn't summed
+    other = files.dump()
+    other['cdn_replication_queue_depth'] = [[[], 100]]
+    with open(os.path.join(tmp_path, '1.json'), 'w') as file:
+        json.dump(other, file)
+    own = files.dump()
+
+    text = asyncio.run(files.render())
+
+    limited = dict(own['cdn_rate_limited_total'])['object_url',]
+    assert (f'cdn_rate_limited_total{{route="object_url"}} {2 * limited}'
+            in text)
+    trips = dict((tuple(labels), series) for labels, series
+                 in own['cdn_redis_round_trips'])['object_url',]
+    assert (f'cdn_redis_round_trips_count{{route="object_url"}} '
+            f'{2 * trips[-2]}' in text)
+    assert 'cdn_replication_queue_depth 7' in text
+    assert os.path.exists(files.path)
+
+
+def test_unreadable_file_is_skipped(tmp_path):
+    metrics.RATE_LIMITED.inc('films')
+    with open(os.path.join(tmp_path, '1.json'), 'w') as file:
+        file.write('{"cdn_rate')
+    files = MetricsFiles(str(tmp_path))
+
+    text = asyncio.run(files.render())
+
+    assert 'cdn_rate_limited_total{route="films"}' in text
@@ -0,0 +1,65 @@
+import asyncio
+import logging
+import signal
+
+from core.config import pool_settings, replication_settings, \
+    resilience_settings, settings
+from connectors import nodes, pool, queue, redis
+from services import replication
+
+
+async def startup():
+    nodes.node_registry = nodes.NodeRegistry(settings.nodes_file,
+                                             settings.nodes_reload_interval,
+                                             settings.nodes_index_cell_size)
+    await nodes.node_registry.start()
+    pool.s3_pool = pool.S3Pool(pool_settings.max_connections,
+                               pool_settings.max_connections_per_host,
+                               pool_settings.keepalive_timeout,
+                               pool_settings.region,
+                               pool_settings.connect_timeout,
+                               pool_settings.read_timeout)
+    await pool.s3_pool.start()
+    redis.redis = redis.Redis(
+        host=settings.redis_host,
+        port=settings.redis_port,
+        ssl=False,
+        socket_timeout=resilience_settings.redis_timeout,
+        socket_connect_timeout=resilience_settings.redis_timeout)
+    queue.replication_queue = await queue.create_replication_queue()
+    replication.replication_workers = replication.ReplicationWorkers(
+        queue.replication_queue,
+        redis.redis,
+        replication_settings.workers,
+        replication_settings.per_edge,
+        replication_settings.claim_idle / 3)
+    await replication.replication_workers.start()
+
+
+async def shutdown():
+    await replication.replication_workers.close()
+    await queue.replication_queue.close()
+    await nodes.node_registry.close()
+    await pool.s3_pool.close()
+
+
+async def main():
+    """
+    Replication worker. Copies objects from the replication queue to edges,
+    so replications don't share the event loop with API requests. Use with
+    REPLICATION_IN_API=False.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await startup()
+    logging.info('Replication worker is started')
+    try:
+        await stop.wait()
+    finally:
+        await shutdown()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())